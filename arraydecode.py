@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# Vectorized 8X300/8X305 instruction decode using NumPy
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from s8x30x import S8X30x, CpuType, OT, iv_regs, src_regs, dest_regs
+
+
+# Field layout of the structured array returned by decode().  The form
+# field is an index into ArrayDecoder.forms, or -1 if the word is not a
+# valid instruction, in which case the other fields (except opcode and
+# fast_io) are zero.  rot_len holds the 'r' or 'l' field of the
+# instruction, whichever it has, and target is the jump target already
+# relocated to the page of the instruction.
+decoded_dtype = np.dtype([('opcode',  np.uint8),
+                          ('form',    np.int16),
+                          ('src',     np.uint8),
+                          ('dst',     np.uint8),
+                          ('rot_len', np.uint8),
+                          ('imm',     np.uint8),
+                          ('target',  np.uint16),
+                          ('fast_io', np.uint8)])
+
+field_column = { 's': 'src', 'd': 'dst', 'r': 'rot_len', 'l': 'rot_len',
+                 'i': 'imm', 'j': 'target' }
+
+
+# Split a 16-bit field mask into runs of contiguous bits, as
+# (shift, width) pairs from most to least significant.
+def mask_runs(mask):
+    runs = []
+    bit = 15
+    while bit >= 0:
+        if mask & (1 << bit):
+            top = bit
+            while bit >= 0 and mask & (1 << bit):
+                bit -= 1
+            runs.append((bit + 1, top - bit))
+        else:
+            bit -= 1
+    return runs
+
+
+class ArrayDecoder:
+    def __init__(self, cpu_type = CpuType.s8x300):
+        self.cpu_type = cpu_type
+        table = S8X30x(cpu_type).decode_table()
+        self.forms = [(inst, form) for inst, form, letters, page_mask
+                      in table.forms]
+        self.form_fields = table.form_fields
+        self.page_masks = [page_mask for inst, form, letters, page_mask
+                           in table.forms]
+        self.src_ok  = np.array([v in src_regs[cpu_type] for v in range(32)])
+        self.dest_ok = np.array([v in dest_regs[cpu_type] for v in range(32)])
+        self.iv_ok   = np.array([v in iv_regs for v in range(32)])
+
+    @staticmethod
+    def __extract(words, mask):
+        v = np.zeros(len(words), dtype = np.uint16)
+        for shift, width in mask_runs(mask):
+            v = (v << width) | ((words >> shift) & ((1 << width) - 1))
+        return v
+
+    # data is either a two-dimensional array of bytes with one column
+    # per ROM bank (most significant opcode byte, least significant
+    # opcode byte, then optionally fast I/O select), or a
+    # one-dimensional array of such rows interleaved, in which case
+    # banks gives the number of columns.
+    def decode(self, data, base = 0, banks = 2):
+        data = np.asarray(data, dtype = np.uint8)
+        if data.ndim == 1:
+            data = data.reshape(-1, banks)
+        count = len(data)
+        words = (data[:, 0].astype(np.uint16) << 8) | data[:, 1]
+        pc = np.arange(base, base + count, dtype = np.uint16)
+
+        result = np.zeros(count, dtype = decoded_dtype)
+        result['opcode'] = words >> 13
+        result['form'] = -1
+        if data.shape[1] > 2:
+            result['fast_io'] = data[:, 2]
+        unmatched = np.ones(count, dtype = bool)
+
+        # Forms are tried in instruction set order, which is the
+        # order S8X30x.inst_search() tries them for each opcode.
+        for n, (inst, form) in enumerate(self.forms):
+            bits = int.from_bytes(form.bits, 'big')
+            mask = int.from_bytes(form.mask, 'big')
+            match = unmatched & ((words & mask) == (bits & mask))
+            if not match.any():
+                continue
+            fields = { f: self.__extract(words, m)
+                       for f, m in self.form_fields[n].items() }
+            if 's' in fields:
+                if OT.sr in form.operands:
+                    match &= self.src_ok[fields['s']]
+                elif OT.siv in form.operands:
+                    match &= self.iv_ok[fields['s']]
+            if 'd' in fields:
+                if OT.dr in form.operands:
+                    match &= self.dest_ok[fields['d']]
+                elif OT.div in form.operands:
+                    match &= self.iv_ok[fields['d']]
+            if 'j' in fields and self.page_masks[n]:
+                fields['j'] = fields['j'] + (pc & self.page_masks[n])
+            result['form'][match] = n
+            for f, v in fields.items():
+                result[field_column[f]][match] = v[match]
+            unmatched &= ~match
+        return result
+
+
+_decoders = { }
+
+# Decode a whole image, returning a structured array of decoded_dtype
+# with one element per address.
+def decode_array(data, cpu_type = CpuType.s8x300, base = 0, banks = 2):
+    if cpu_type not in _decoders:
+        _decoders[cpu_type] = ArrayDecoder(cpu_type)
+    return _decoders[cpu_type].decode(data, base, banks)
+
+
+if __name__ == '__main__':
+    # Check decode_array() against S8X30x.disassemble_inst() for every
+    # possible instruction word.
+    for cpu_type in CpuType:
+        s8x30x = S8X30x(cpu_type)
+        decoder = ArrayDecoder(cpu_type)
+        words = np.arange(65536, dtype = np.uint32)
+        data = np.stack([words >> 8, words & 0xff], axis = 1)
+        for base in [0x0000, 0x1234]:
+            result = decoder.decode(data[base:], base)
+            for pc in range(base, 65536):
+                fw = { pc: [pc >> 8, pc & 0xff] }
+                dis, operands, d = s8x30x.disassemble_inst(fw, pc)
+                r = result[pc - base]
+                if r['form'] < 0:
+                    assert dis.strip() == 'dw', hex(pc)
+                    continue
+                assert decoder.forms[r['form']][0].mnem == dis.strip(), hex(pc)
+                for f, v in d.fields.items():
+                    assert r[field_column[f]] == v, (hex(pc), f)
+        print(cpu_type.name, 'ok')
@@ -0,0 +1,467 @@
+#!/usr/bin/python3
+# Signetics 8X300, 8X305 assembler
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from s8x30x import S8X30x, CpuType, OT, Reg, src_regs, dest_regs, \
+                   UnknownMnemonic, NoMatchingForm, OperandOutOfRange
+
+class UndefinedSymbol(Exception):
+    def __init__(self, name):
+        super().__init__('undefined symbol "%s"' % name)
+
+class DuplicateSymbol(Exception):
+    def __init__(self, name):
+        super().__init__('symbol "%s" already defined' % name)
+
+class BadOperand(Exception):
+    def __init__(self, operand):
+        super().__init__('bad operand "%s"' % operand)
+
+class BadStatement(Exception):
+    def __init__(self):
+        super().__init__('syntax error')
+
+class AddressConflict(Exception):
+    def __init__(self, address):
+        super().__init__('address %04x already assigned' % address)
+
+# An error in a particular line of the source.
+class AssemblyError(Exception):
+    def __init__(self, filename, line_number, error):
+        super().__init__('%s:%d: %s' % (filename, line_number, error))
+        self.filename = filename
+        self.line_number = line_number
+        self.error = error
+
+
+label_re   = re.compile(r'\s*([A-Za-z_.][\w.]*):')
+equ_re     = re.compile(r'\s*([A-Za-z_.][\w.]*)\s*(?:\s[eE][qQ][uU]\s|=)(.*)$')
+stmt_re    = re.compile(r'\s*([A-Za-z]\w*)(?:\s+(.*))?$')
+term_re    = re.compile(r'\s*([+-])?\s*([0-9][0-9a-fA-F]*[hH]|0[xX][0-9a-fA-F]+|[0-9]+|\$|[A-Za-z_.][\w.]*)')
+rot_re     = re.compile(r'(\w+)\s*>>>\s*([0-7])$')
+iv_re      = re.compile(r'([A-Za-z_.][\w.]*)\s*(?:\[\s*([0-9]+)\s*(?::\s*([0-9]+)\s*)?\])?$')
+select_re  = re.compile(r'(?:\s*(rd|wr)=([0-9]+))+\s*$')
+selects_re = re.compile(r'(rd|wr)=([0-9]+)')
+
+
+# A parsed operand, with each way it may be interpreted: as a
+# register with rotation, as an IV operand, or as an expression.
+# Those that don't apply are None.
+class Operand:
+    def __init__(self, text):
+        self.text = text
+        self.reg = None
+        self.rot = 0
+        self.iv = None      # (direction 's' or 'd', register, length, select)
+        self.io_reg = None  # ivl or ivr, for a bare fast I/O write name
+        self.expr = None
+
+
+# An expression is compiled to a list of (sign, value) terms, where a
+# value is an integer, a symbol name, or None for the current address.
+def compile_expr(text):
+    terms = []
+    pos = 0
+    while pos < len(text):
+        m = term_re.match(text, pos)
+        if m is None or (terms and m.group(1) is None):
+            return None
+        sign, term = m.groups()
+        sign = -1 if sign == '-' else 1
+        if term == '$':
+            value = None
+        elif term[0].isdigit():
+            if term[-1] in 'hH':
+                value = int(term[:-1], 16)
+            else:
+                value = int(term, 0 if term[:2].lower() == '0x' else 10)
+        else:
+            value = term
+        terms.append((sign, value))
+        pos = m.end()
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+    if not terms:
+        return None
+    return terms
+
+
+class Statement:
+    def __init__(self, line_number, label = None):
+        self.line_number = line_number
+        self.label = label
+        self.kind = None       # None, 'org', 'equ', 'dw' or 'inst'
+        self.name = None       # symbol defined by equ
+        self.expr = None       # expression of org, equ or dw
+        self.inst = None
+        self.operands = None
+        self.selects = { }     # read and write selects from annotation
+        self.address = None
+
+
+# The assembler accepts the syntax of the disassembler output.  Each
+# line is parsed once, into a Statement.  Symbols are then resolved
+# by passes over the statements that only evaluate org and equ
+# expressions, repeated only while there are forward references among
+# those.  Instructions are encoded in a final pass, trying the forms
+# of the instruction in order.
+#
+# If a fast I/O decoder is given, its names are accepted for IV
+# operands, and a select byte is generated for each word.  The
+# disassembler can't distinguish a write to a named device through
+# the IVL or IVR register from one through an unsubscripted dliv or
+# driv; the assembler uses the latter unless only the former is
+# possible (a rotated source or an immediate longer than five bits).
+# Selects that the disassembler annotates as "// rd=n wr=n" are
+# accepted in that form.
+class Assembler:
+    max_passes = 16
+    program_size = 0x2000
+
+    def __init__(self, cpu_type = CpuType.s8x300, fast_io_decoder = None):
+        self.cpu_type = cpu_type
+        self.s8x30x = S8X30x(cpu_type)
+        self.fast_io_decoder = fast_io_decoder
+
+        self.reg_names = { name: int(reg) for name, reg in Reg.__members__.items()
+                           if not reg.is_iv() }
+        self.src_regs = src_regs[cpu_type]
+        self.dest_regs = dest_regs[cpu_type]
+
+        # IV operand names, mapped to (direction, bank, select)
+        self.iv_names = { 'sliv': ('s', Reg.liv0, None),
+                          'sriv': ('s', Reg.riv0, None),
+                          'dliv': ('d', Reg.liv0, None),
+                          'driv': ('d', Reg.riv0, None) }
+        if fast_io_decoder is not None:
+            for kind, names in fast_io_decoder.iv_name.items():
+                bank = Reg.liv0 if kind[1] == 'l' else Reg.riv0
+                for select, name in names.items():
+                    self.iv_names[name] = (kind[0], bank, select)
+
+        self.page_masks = { OT.jmp5: 0xffe0, OT.jmp8: 0xff00, OT.jmp13: 0 }
+
+        # for each form, the operands that appear in the source (as
+        # opposed to the length and rotation that are part of them)
+        self.form_operands = { }
+
+    def parse_operand(self, text):
+        op = Operand(text)
+        m = rot_re.match(text)
+        if m:
+            op.reg = self.reg_names.get(m.group(1).lower())
+            op.rot = int(m.group(2))
+            if op.reg is None:
+                raise BadOperand(text)
+            return op
+        m = iv_re.match(text)
+        if m:
+            name, lb, rb = m.groups()
+            if name.lower() in self.reg_names and lb is None:
+                op.reg = self.reg_names[name.lower()]
+                return op
+            iv = self.iv_names.get(name)
+            if iv is None:
+                iv = self.iv_names.get(name.lower())
+            if iv is not None:
+                direction, bank, select = iv
+                if lb is None:
+                    lb, rb = 7, 0
+                    if direction == 'd' and select is not None:
+                        op.io_reg = Reg.ivl if bank == Reg.liv0 else Reg.ivr
+                    op.expr = compile_expr(text)  # might also be a label
+                else:
+                    lb = int(lb)
+                    rb = lb if rb is None else int(rb)
+                if not (0 <= rb <= 7 and 1 <= lb - rb + 1 <= 8):
+                    raise BadOperand(text)
+                op.iv = (direction, bank + 7 - rb, lb - rb + 1, select)
+                return op
+        op.expr = compile_expr(text)
+        if op.expr is None:
+            raise BadOperand(text)
+        return op
+
+    def parse_line(self, line, line_number):
+        selects = { }
+        for marker in ('//', ';'):
+            i = line.find(marker)
+            if i >= 0:
+                comment = line[i + len(marker):]
+                line = line[:i]
+                if marker == '//' and select_re.match(comment):
+                    selects = { k: int(v) for k, v in selects_re.findall(comment) }
+        label = None
+        m = label_re.match(line)
+        if m:
+            label = m.group(1)
+            line = line[m.end():]
+        stmt = Statement(line_number, label)
+        if not line.strip():
+            return stmt
+        m = equ_re.match(line)
+        if m and label is None:
+            stmt.kind = 'equ'
+            stmt.name = m.group(1)
+            stmt.expr = compile_expr(m.group(2))
+            if stmt.expr is None:
+                raise BadOperand(m.group(2).strip())
+            return stmt
+        m = stmt_re.match(line)
+        if m is None:
+            raise BadStatement()
+        mnem = m.group(1).lower()
+        operands = [o.strip() for o in (m.group(2) or '').split(',')]
+        if operands == ['']:
+            operands = []
+        if mnem in ('org', 'dw'):
+            if len(operands) != 1:
+                raise BadStatement()
+            stmt.kind = mnem
+            stmt.expr = compile_expr(operands[0])
+            if stmt.expr is None:
+                raise BadOperand(operands[0])
+        else:
+            stmt.kind = 'inst'
+            stmt.inst = self.s8x30x.inst_by_mnemonic(mnem)
+            stmt.operands = [self.parse_operand(o) for o in operands]
+        stmt.selects = selects
+        return stmt
+
+    def evaluate(self, expr, address):
+        v = 0
+        for sign, value in expr:
+            if value is None:
+                value = address
+            elif not isinstance(value, int):
+                if value not in self.symbols:
+                    raise UndefinedSymbol(value)
+                value = self.symbols[value]
+            v += sign * value
+        return v
+
+    def error(self, stmt, e):
+        self.errors.append(AssemblyError(self.filename, stmt.line_number, e))
+
+    # Returns True if the value of the symbol changed.
+    def define(self, stmt, name, value):
+        owner = self.symbol_owner.setdefault(name, stmt)
+        if owner is not stmt:
+            raise DuplicateSymbol(name)
+        old = self.symbols.get(name)
+        self.symbols[name] = value
+        return old is not None and old != value
+
+    # Assigns addresses to statements and values to symbols.  Returns
+    # True if another pass is needed, because a forward reference
+    # couldn't yet be resolved or a symbol's value changed.
+    def resolve_pass(self, final):
+        again = False
+        address = 0
+        for stmt in self.statements:
+            try:
+                if stmt.kind == 'org':
+                    address = self.evaluate(stmt.expr, address)
+                    if not 0 <= address < self.program_size:
+                        raise OperandOutOfRange()
+            except UndefinedSymbol as e:
+                again = True
+                if final:
+                    self.error(stmt, e)
+            except OperandOutOfRange as e:
+                if final:
+                    self.error(stmt, e)
+            if stmt.label is not None:
+                try:
+                    again |= self.define(stmt, stmt.label, address)
+                except DuplicateSymbol as e:
+                    self.error(stmt, e)
+                    stmt.label = None
+            if stmt.kind == 'equ':
+                try:
+                    again |= self.define(stmt, stmt.name,
+                                         self.evaluate(stmt.expr, address))
+                except UndefinedSymbol as e:
+                    again = True
+                    if final:
+                        self.error(stmt, e)
+                except DuplicateSymbol as e:
+                    self.error(stmt, e)
+                    stmt.kind = None
+            stmt.address = address
+            if stmt.kind in ('inst', 'dw'):
+                address += 1
+        return again
+
+    def resolve(self):
+        for p in range(self.max_passes):
+            if not self.resolve_pass(False):
+                return
+        self.resolve_pass(True)
+
+    # Matches the operands against a form, returning the fields and
+    # the read and write selects, or None if the operands are not of
+    # the right kinds.  Raises OperandOutOfRange if they are but a
+    # value doesn't fit.
+    def match_form(self, form, operands, address, allow_io_reg):
+        form_operands = self.form_operands.get(id(form))
+        if form_operands is None:
+            form_operands = [o for o in form.operands
+                             if o not in (OT.blen, OT.brot)]
+            self.form_operands[id(form)] = form_operands
+        if len(form_operands) != len(operands):
+            return None
+        fields = { }
+        selects = { }
+        length = None
+        for ot, op in zip(form_operands, operands):
+            if ot is OT.sr:
+                if op.reg not in self.src_regs:
+                    return None
+                if op.rot and OT.brot not in form.operands:
+                    return None
+                fields['s'] = op.reg
+                if OT.brot in form.operands:
+                    fields['r'] = op.rot
+            elif ot is OT.dr:
+                reg = op.reg
+                if reg is None and allow_io_reg and op.io_reg is not None:
+                    reg = op.io_reg
+                    selects['wr'] = op.iv[3]
+                if reg not in self.dest_regs or op.rot:
+                    return None
+                fields['d'] = reg
+            elif ot is OT.siv or ot is OT.div:
+                if op.iv is None:
+                    return None
+                direction, reg, l, select = op.iv
+                if direction != ot.name[0]:
+                    return None
+                if length is not None and l != length:
+                    return None
+                length = l
+                fields[direction] = reg
+                if select is not None:
+                    selects['rd' if direction == 's' else 'wr'] = select
+            else:
+                if op.expr is None:
+                    return None
+                value = self.evaluate(op.expr, address)
+                if ot is OT.imm:
+                    width = form.fields['i'].width
+                    if not -(1 << (width - 1)) <= value < (1 << width):
+                        raise OperandOutOfRange()
+                    fields['i'] = value & ((1 << width) - 1)
+                else:
+                    value -= address & self.page_masks[ot]
+                    if not 0 <= value < (1 << form.fields['j'].width):
+                        raise OperandOutOfRange()
+                    fields['j'] = value
+        if OT.blen in form.operands:
+            fields['l'] = length & 7
+        return fields, selects
+
+    def encode(self, stmt):
+        if stmt.kind == 'dw':
+            value = self.evaluate(stmt.expr, stmt.address)
+            if not -0x8000 <= value < 0x10000:
+                raise OperandOutOfRange()
+            return value & 0xffff, stmt.selects
+        error = NoMatchingForm()
+        for allow_io_reg in (False, True):
+            for form in stmt.inst.forms:
+                try:
+                    m = self.match_form(form, stmt.operands, stmt.address,
+                                        allow_io_reg)
+                except OperandOutOfRange as e:
+                    error = e
+                    continue
+                if m is not None:
+                    fields, selects = m
+                    selects.update(stmt.selects)
+                    return form.encode(fields), selects
+        raise error
+
+    # Assembles the lines of a source file.  Returns the list of
+    # errors, each an AssemblyError; the assembled words are left in
+    # self.words, a dictionary of address to (opcode, select byte).
+    def assemble(self, lines, filename = '<input>'):
+        self.filename = filename
+        self.errors = []
+        self.statements = []
+        for line_number, line in enumerate(lines, 1):
+            try:
+                self.statements.append(self.parse_line(line, line_number))
+            except (BadStatement, BadOperand, UnknownMnemonic) as e:
+                self.errors.append(AssemblyError(filename, line_number, e))
+
+        self.symbols = { }
+        self.symbol_owner = { }
+        self.resolve()
+
+        self.words = { }
+        fast_io = self.fast_io_decoder
+        for stmt in self.statements:
+            if stmt.kind not in ('inst', 'dw'):
+                continue
+            try:
+                if stmt.address >= self.program_size:
+                    raise OperandOutOfRange()
+                if stmt.address in self.words:
+                    raise AddressConflict(stmt.address)
+                word, selects = self.encode(stmt)
+            except (UndefinedSymbol, NoMatchingForm, OperandOutOfRange,
+                    AddressConflict) as e:
+                self.error(stmt, e)
+                continue
+            select = None
+            if fast_io is not None:
+                select = fast_io.select_byte(selects.get('rd'), selects.get('wr'))
+            self.words[stmt.address] = (word, select)
+        self.errors.sort(key = lambda e: e.line_number)
+        return self.errors
+
+    # Returns the assembled program as a list of banks from address
+    # zero: most significant opcode byte, least significant opcode
+    # byte, and, if there's a fast I/O decoder, fast I/O select.
+    # Unassigned addresses are filled with NOP and the idle select.
+    def banks(self):
+        size = max(self.words) + 1 if self.words else 0
+        data = [bytearray(size), bytearray(size)]
+        if self.fast_io_decoder is not None:
+            data.append(bytearray([self.fast_io_decoder.select_byte()]) * size)
+        for address, (word, select) in self.words.items():
+            data[0][address] = word >> 8
+            data[1][address] = word & 0xff
+            if select is not None:
+                data[2][address] = select
+        return data
+
+
+if __name__ == '__main__':
+    asm = Assembler()
+    errors = asm.assemble(['        org     10h',
+                           'x0010:  xmit    0ffh,aux',
+                           'x0011:  add     r1>>>3,r2',
+                           '        move    sliv[4:2],driv[3:1]',
+                           '        nzt     sriv[0],x0011',
+                           '        xec     x0010,r1',
+                           '        jmp     x0010'])
+    for e in errors:
+        print(e)
+    for address in sorted(asm.words):
+        print('%04x: %04x' % (address, asm.words[address][0]))
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+# Benchmarks for the s8x30x disassembler
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, top_dir)
+
+from s8x30x import S8X30x, CpuType
+from intelhex import IntelHex
+from memory import Memory
+from wd1000 import WD1000
+from wd1001 import WD1001
+import disassembler
+
+
+# A synthetic image of random words, with a fast I/O select bank.  The
+# same seed always gives the same image, so results are comparable.
+def synthetic_image(size = 8192, seed = 8300):
+    rng = random.Random(seed)
+    return [bytearray(rng.getrandbits(8) for i in range(size))
+            for bank in range(3)]
+
+def hex_text(data):
+    f = io.StringIO()
+    IntelHex().write(f, data)
+    return f.getvalue()
+
+
+# Each benchmark is set up for one image and CPU type, and returns a
+# function to be timed, and the number of instructions it processes.
+class Context:
+    def __init__(self, cpu_type, banks, hex_files = None):
+        self.cpu_type = cpu_type
+        self.banks = banks
+        self.memory = Memory(banks)
+        self.size = len(self.memory)
+        self.hex = hex_files or [hex_text(b) for b in banks]
+        self.s8x30x = S8X30x(cpu_type)
+        self.table_s8x30x = S8X30x(cpu_type, decode_table = True)
+        self.decoded = disassembler.decode(self.table_s8x30x, self.memory, 0)
+        self.symtab = disassembler.pass1(self.decoded)
+
+
+def bench_disassemble_inst(ctx):
+    s8x30x, fw = ctx.s8x30x, ctx.memory
+    def run():
+        for pc in range(ctx.size):
+            s8x30x.disassemble_inst(fw, pc)
+    return run, ctx.size
+
+def bench_disassemble_inst_table(ctx):
+    s8x30x, fw = ctx.table_s8x30x, ctx.memory
+    def run():
+        for pc in range(ctx.size):
+            s8x30x.disassemble_inst(fw, pc)
+    return run, ctx.size
+
+def bench_decode(ctx):
+    def run():
+        disassembler.decode(ctx.table_s8x30x, ctx.memory, 0)
+    return run, ctx.size
+
+def bench_pass1(ctx):
+    def run():
+        disassembler.pass1(ctx.decoded)
+    return run, ctx.size
+
+def bench_pass2(ctx, decoder = None):
+    def run():
+        disassembler.pass2(ctx.table_s8x30x, ctx.memory, 0, ctx.decoded,
+                           ctx.symtab, output_file = io.StringIO(),
+                           fast_io_decoder = decoder)
+    return run, ctx.size
+
+def bench_pass2_wd1001(ctx):
+    return bench_pass2(ctx, WD1001())
+
+def bench_memory_getitem(ctx):
+    memory = ctx.memory
+    def run():
+        for pc in range(ctx.size):
+            memory[pc]
+    return run, ctx.size
+
+def bench_intelhex_read(ctx):
+    def run():
+        for text in ctx.hex:
+            IntelHex().read(io.StringIO(text))
+    return run, ctx.size
+
+def bench_fast_io_decode(ctx, decoder):
+    operands = []
+    for pc, d in enumerate(ctx.decoded):
+        if d is None:
+            operands.append('')
+        else:
+            operands.append(d.text(ctx.symtab)[1])
+    fw = ctx.memory
+    def run():
+        for pc in range(ctx.size):
+            decoder.fast_io_decode(fw[pc][2:], operands[pc])
+    return run, ctx.size
+
+def bench_wd1000_fast_io_decode(ctx):
+    return bench_fast_io_decode(ctx, WD1000())
+
+def bench_wd1001_fast_io_decode(ctx):
+    return bench_fast_io_decode(ctx, WD1001())
+
+benchmarks = [('disassemble_inst',       bench_disassemble_inst),
+              ('disassemble_inst_table', bench_disassemble_inst_table),
+              ('decode',                 bench_decode),
+              ('pass1',                  bench_pass1),
+              ('pass2',                  bench_pass2),
+              ('pass2_wd1001',           bench_pass2_wd1001),
+              ('memory_getitem',         bench_memory_getitem),
+              ('intelhex_read',          bench_intelhex_read),
+              ('wd1000_fast_io_decode',  bench_wd1000_fast_io_decode),
+              ('wd1001_fast_io_decode',  bench_wd1001_fast_io_decode)]
+
+
+# Returns the best of repeat timings, and the peak memory allocated,
+# which is measured by a separate run since tracing slows it down.
+def measure(run, repeat):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def run_benchmarks(contexts, selected, repeat):
+    results = []
+    for image, ctx in contexts:
+        for name, bench in benchmarks:
+            if selected and name not in selected:
+                continue
+            run, count = bench(ctx)
+            seconds, peak = measure(run, repeat)
+            results.append({ 'benchmark':      name,
+                             'image':          image,
+                             'cpu':            ctx.cpu_type.name,
+                             'instructions':   count,
+                             'seconds':        seconds,
+                             'inst_per_sec':   count / seconds,
+                             'peak_bytes':     peak })
+            print('%-24s %-10s %-7s %12.0f inst/s %10.3f ms %9.1f KiB peak' %
+                  (name, image, ctx.cpu_type.name, count / seconds,
+                   seconds * 1000, peak / 1024))
+    return results
+
+
+def result_key(r):
+    return (r['benchmark'], r['image'], r['cpu'])
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = { result_key(r): r for r in json.load(f)['results'] }
+    print()
+    print('relative to %s:' % baseline_path)
+    for r in results:
+        b = baseline.get(result_key(r))
+        if b is None:
+            continue
+        print('%-24s %-10s %-7s %6.2fx speed %6.2fx peak memory' %
+              (r['benchmark'], r['image'], r['cpu'],
+               r['inst_per_sec'] / b['inst_per_sec'],
+               r['peak_bytes'] / max(b['peak_bytes'], 1)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks for the s8x30x disassembler')
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+                        help = 'number of timed runs of each benchmark, the best of which is reported')
+    parser.add_argument('-b', '--benchmark', action = 'append', default = [],
+                        choices = [name for name, bench in benchmarks],
+                        help = 'run only the given benchmark (may be repeated)')
+    parser.add_argument('--hex', nargs = 3, metavar = 'FILE',
+                        help = 'also benchmark Intel hex files (most significant byte, least significant byte, fast I/O select)')
+    parser.add_argument('-o', '--output',
+                        help = 'save results as JSON')
+    parser.add_argument('-c', '--compare', metavar = 'FILE',
+                        help = 'compare with results previously saved as JSON')
+    args = parser.parse_args()
+
+    image = synthetic_image()
+    contexts = [('synthetic', Context(cpu_type, image)) for cpu_type in CpuType]
+    if args.hex:
+        hex_files = []
+        for fn in args.hex:
+            with open(fn) as f:
+                hex_files.append(f.read())
+        banks = [IntelHex().read(text) for text in hex_files]
+        contexts += [('hex', Context(cpu_type, banks, hex_files))
+                     for cpu_type in CpuType]
+
+    results = run_benchmarks(contexts, args.benchmark, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({ 'time':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'python':   platform.python_version(),
+                        'platform': platform.platform(),
+                        'repeat':   args.repeat,
+                        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                        'results':  results }, f, indent = 1)
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# Startup time benchmark for the dis8x30x command
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# When dis8x30x is run once per file, as from an editor or version
+# control hook, most of the time of each run is starting the process
+# and importing modules.  This runs dis8x30x in a new process for each
+# of a few typical command lines, and reports the wall time of each,
+# and the time spent importing modules (as measured by python -X
+# importtime) beyond those imported by the interpreter itself.  The
+# exit status is 1 if the import time of any run exceeds the budget.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from bench8x30x import synthetic_image
+
+
+default_budget_ms = 40
+
+# command lines, with the image files appended
+commands = [('cached',          []),
+            ('cached_wd1001',   ['--wd1001']),
+            ('no_cache',        ['--no-cache']),
+            ('no_cache_wd1001', ['--no-cache', '--wd1001', '-l']),
+            ('traverse_xref',   ['--no-cache', '-t', '-x'])]
+
+
+# Parses the output of -X importtime, returning a dictionary of the
+# cumulative time in microseconds of each module imported at the top
+# level, that is, not by another module.
+def top_level_imports(stderr):
+    imports = { }
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        name = fields[2]
+        if name.startswith(' ') and not name.startswith('  '):
+            try:
+                imports[name.strip()] = int(fields[1])
+            except ValueError:
+                pass  # the heading
+    return imports
+
+def run(args, env):
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                       env = env, stdout = subprocess.DEVNULL,
+                       stderr = subprocess.PIPE, universal_newlines = True,
+                       check = True)
+    return time.perf_counter() - t0, top_level_imports(p.stderr)
+
+# Returns the best wall time of repeat runs, and the import time of the
+# modules of that run that the bare interpreter doesn't import.
+def measure(args, env, baseline, repeat):
+    best = None
+    for i in range(repeat):
+        seconds, imports = run(args, env)
+        if best is None or seconds < best[0]:
+            best = seconds, imports
+    seconds, imports = best
+    imports = { name: us for name, us in imports.items()
+                if name not in baseline }
+    return seconds, imports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Startup time benchmark for dis8x30x')
+    parser.add_argument('-r', '--repeat', type = int, default = 10,
+                        help = 'number of runs of each command line, the best of which is reported')
+    parser.add_argument('-b', '--budget', type = float, default = default_budget_ms,
+                        metavar = 'MS',
+                        help = 'import time budget in milliseconds (default %(default)g)')
+    parser.add_argument('-v', '--verbose', action = 'store_true',
+                        help = 'list the import time of each module')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # byte code is compiled by the first run of each module, as it
+        # would be for an installed copy
+        env = dict(os.environ)
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        env['S8X30X_CACHE_DIR'] = os.path.join(tmp, 'cache')
+        files = []
+        for i, bank in enumerate(synthetic_image()):
+            files.append(os.path.join(tmp, '%d.bin' % i))
+            with open(files[-1], 'wb') as f:
+                f.write(bank)
+        dis = os.path.join(top_dir, 'dis8x30x')
+        for name, options in commands:
+            run([dis] + options + files, env)
+
+        seconds, baseline = measure(['-c', 'pass'], env, { }, args.repeat)
+        print('%-16s %8.1f ms' % ('interpreter', seconds * 1000))
+        over = False
+        for name, options in commands:
+            seconds, imports = measure([dis] + options + files, env,
+                                       baseline, args.repeat)
+            import_ms = sum(imports.values()) / 1000
+            over |= import_ms > args.budget
+            print('%-16s %8.1f ms %8.1f ms imports%s' %
+                  (name, seconds * 1000, import_ms,
+                   ' over budget' if import_ms > args.budget else ''))
+            if args.verbose:
+                for module, us in sorted(imports.items(), key = lambda i: -i[1]):
+                    print('    %-24s %8.1f ms' % (module, us / 1000))
+
+    sys.exit(1 if over else 0)
@@ -0,0 +1,432 @@
+#!/usr/bin/python3
+# Signetics 8X300, 8X305 disassembler
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The disassembler proper, used by the dis8x30x command, and batch
+# disassembly of many ROM sets in parallel.
+
+# Modules only needed for some options (the process pool, manifests,
+# traversal, cross-references, and the fast I/O decoder of each board)
+# are imported when first used, since startup is most of the time of
+# a run, and importing concurrent.futures alone takes about as long as
+# a run that hits the result cache.
+
+from collections import Counter
+import io
+from itertools import islice
+import os
+import sys
+
+from s8x30x import S8X30x, CpuType
+from intelhex import IntelHex
+from memory import Memory
+from resultcache import ResultCache
+
+
+# Functions creating the fast I/O decoder of each board, by name, which
+# import the board's module only when called.
+def _wd1000():
+    from wd1000 import WD1000
+    return WD1000()
+
+def _wd1001():
+    from wd1001 import WD1001
+    return WD1001()
+
+fast_io_decoders = { 'wd1000': _wd1000, 'wd1001': _wd1001 }
+
+
+# The disassembler decodes each word of the image once, into a list
+# used by both of the following passes.  Each entry is a DecodedInst,
+# or None for a word that isn't a valid instruction.
+def decode(s8x30x, fw, base):
+    ext = None
+    if fw.bank_count > 2:
+        ext = fw.bank(2)
+    return s8x30x.decode_words(fw.words, base, ext)
+
+
+# collect jump targets
+# If code_mask is given, only words for which it is true are treated
+# as instructions.
+def pass1(decoded, code_mask = None):
+    symtab_by_value = {}
+    for i, d in enumerate(decoded):
+        if code_mask is not None and not code_mask[i]:
+            continue
+        if d is not None and d.j is not None:
+            symtab_by_value[d.j] = 'x%04x' % d.j
+    return symtab_by_value
+
+
+# '%02x ' of each byte value, for the object code of listings
+hex_bytes = ['%02x ' % b for b in range(256)]
+
+# number of lines pass2() joins into each write
+chunk_lines = 2048
+
+# render the output text, as a generator of lines, so that output can
+# be written as it's produced without holding all of it
+# If addresses is given, only the lines for those addresses are
+# rendered.  annotations, if given, is a dictionary of address to text
+# appended to the line, as from XrefIndex.annotations().
+def render(s8x30x, fw, base, decoded,
+           symtab_by_value, show_obj = False, code_mask = None,
+           fast_io_decoder = None, addresses = None, annotations = None):
+    format_bad_inst = s8x30x.format_bad_inst
+    io_operands = s8x30x.io_operands
+    if addresses is None:
+        labels = { pc: name + ':' for pc, name in symtab_by_value.items() }
+        addresses = range(base, base + len(decoded))
+    else:
+        labels = { pc: symtab_by_value[pc] + ':' for pc in addresses
+                   if pc in symtab_by_value }
+    if annotations is None:
+        annotations = { }
+    fast_io = fast_io_decoder is not None and fw.bank_count > 2
+    if fast_io:
+        lookup = fast_io_decoder.lookup
+    for pc in addresses:
+        d = decoded[pc - base]
+        if code_mask is not None and not code_mask[pc - base]:
+            d = None
+        word = fw[pc]
+        src_name = dst_name = None
+        note = ''
+        if fast_io:
+            src_kind = dst_kind = None
+            if d is not None:
+                src_kind, dst_kind = io_operands(d.form, d)
+            src_name, dst_name, note = lookup(word[2], src_kind, dst_kind)
+        if d is None:
+            (dis, operands) = format_bad_inst((word[0] << 8) + word[1])
+        else:
+            (dis, operands) = d.text(symtab_by_value,
+                                     src_name = src_name,
+                                     dst_name = dst_name)
+        line = '%-8s%-8s%s%s%s\n' % (labels.get(pc, ''), dis, operands,
+                                    annotations.get(pc, ''), note)
+        if show_obj:
+            line = '%04x: %s%s' % (pc, ''.join([hex_bytes[b] for b in word]), line)
+        yield line
+
+
+# write the output text, in chunks of lines
+def pass2(s8x30x, fw, base, decoded,
+          symtab_by_value, show_obj = False, output_file = sys.stdout,
+          code_mask = None, fast_io_decoder = None, annotations = None):
+    lines = render(s8x30x, fw, base, decoded, symtab_by_value, show_obj,
+                   code_mask, fast_io_decoder, annotations = annotations)
+    write = output_file.write
+    while True:
+        chunk = ''.join(islice(lines, chunk_lines))
+        if not chunk:
+            break
+        write(chunk)
+
+
+# Returns the annotations of two dictionaries of address to annotation
+# text, either of which may be None, with the text of the first first.
+def join_annotations(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    result = dict(second)
+    for pc, text in first.items():
+        result[pc] = text + second.get(pc, '')
+    return result
+
+
+# If entry_points is given, only code reachable from those addresses
+# is disassembled as instructions, and everything else as data.  If
+# xref is true, each jump target is annotated with the addresses
+# referring to it.  If coverage, an exectrace.Coverage, is given, each
+# instruction is annotated with its execution count.
+def disassemble(s8x30x, fw, show_obj = False, output_file = sys.stdout,
+                base = 0, entry_points = None, fast_io_decoder = None,
+                xref = False, coverage = None):
+    decoded = decode(s8x30x, fw, base)
+    code_mask = None
+    if entry_points is not None:
+        from flowgraph import FlowGraph
+        code_mask = FlowGraph(decoded, base, entry_points).code_mask()
+    symtab_by_value = pass1(decoded, code_mask)
+    #symtab_by_name = { v: k for k, v in symtab_by_value.items() }
+    annotations = None
+    if xref:
+        from xref import XrefIndex
+        annotations = XrefIndex(s8x30x, decoded, fw, base,
+                                code_mask).annotations()
+    if coverage is not None:
+        annotations = join_annotations(annotations,
+                                       coverage.annotations(decoded, base, code_mask))
+    pass2(s8x30x, fw, base, decoded, symtab_by_value,
+          show_obj = show_obj, output_file = output_file,
+          code_mask = code_mask, fast_io_decoder = fast_io_decoder,
+          annotations = annotations)
+
+
+# Changed whenever the output of disassemble() changes for the same
+# input, so that results cached by earlier versions aren't used.
+listing_version = 1
+
+# The cache key of the output of disassemble() with the given
+# arguments: the interleaved image, and the versions of the
+# instruction set, fast I/O select tables and output format.
+def listing_key(cache, s8x30x, fw, show_obj = False, base = 0,
+                entry_points = None, fast_io_decoder = None, xref = False,
+                coverage = None):
+    fast_io = None
+    if fast_io_decoder is not None:
+        fast_io = fast_io_decoder.table_signature()
+    parts = [fast_io, show_obj, base, entry_points, xref, fw.bank_count, fw.view]
+    if coverage is not None:
+        parts.append(memoryview(coverage.counts).cast('B'))
+    return cache.key('listing', listing_version,
+                     S8X30x.inst_set_signature(s8x30x.cpu_type), *parts)
+
+# Writes each chunk of text to output_file as it's written, and to a
+# cache entry through a resultcache.CacheWriter.
+class CopyingWriter:
+    def __init__(self, output_file, cache_writer):
+        self.output_file = output_file
+        self.cache_writer = cache_writer
+
+    def write(self, text):
+        self.output_file.write(text)
+        self.cache_writer.write(text.encode('utf-8'))
+
+# As disassemble(), but the output is taken from the cache if it's
+# there, and stored in it if not.  Returns True for a cache hit.  On a
+# miss, each chunk of the output is written both to output_file and to
+# the cache entry as it's rendered, so the listing is never held in
+# memory as a whole; the entry is only stored if the listing is
+# complete.
+def disassemble_cached(cache, s8x30x, fw, show_obj = False,
+                       output_file = sys.stdout, base = 0,
+                       entry_points = None, fast_io_decoder = None,
+                       xref = False, coverage = None):
+    if cache is None:
+        disassemble(s8x30x, fw, show_obj, output_file, base, entry_points,
+                    fast_io_decoder, xref, coverage)
+        return False
+    key = listing_key(cache, s8x30x, fw, show_obj, base, entry_points,
+                      fast_io_decoder, xref, coverage)
+    data = cache.get(key)
+    if data is not None:
+        output_file.write(data.decode('utf-8'))
+        return True
+    cache_writer = cache.writer(key)
+    try:
+        disassemble(s8x30x, fw, show_obj, CopyingWriter(output_file, cache_writer),
+                    base, entry_points, fast_io_decoder, xref, coverage)
+    except BaseException:
+        cache_writer.abort()
+        raise
+    cache_writer.commit()
+    return False
+
+
+# report decode counters: instructions by mnemonic and form, words
+# that are not valid instructions, and fast I/O select names
+# substituted and selects only annotated
+def report_counts(s8x30x, fw, decoded, code_mask = None,
+                  output_file = sys.stderr, fast_io_decoder = None):
+    by_form = Counter()
+    substituted = annotated = 0
+    for pc, d in enumerate(decoded):
+        if code_mask is not None and not code_mask[pc]:
+            d = None
+        if d is not None:
+            by_form[d.inst.mnem, ','.join(o.name for o in d.form.operands)] += 1
+        if fast_io_decoder is not None and len(fw[pc]) > 2:
+            src_kind = dst_kind = None
+            if d is not None:
+                src_kind, dst_kind = s8x30x.io_operands(d.form, d)
+            src_name, dst_name, note = fast_io_decoder.lookup(fw[pc][2], src_kind, dst_kind)
+            substituted += (src_name is not None) + (dst_name is not None)
+            annotated += note != ''
+    output_file.write('%-28s %8s\n' % ('instruction form', 'count'))
+    for (mnem, operands), count in sorted(by_form.items()):
+        output_file.write('%-6s %-21s %8d\n' % (mnem, operands, count))
+    output_file.write('%-28s %8d\n' % ('dw (data or bad instruction)', len(decoded) - sum(by_form.values())))
+    if fast_io_decoder is not None:
+        output_file.write('%-28s %8d\n' % ('fast I/O names substituted', substituted))
+        output_file.write('%-28s %8d\n' % ('fast I/O selects annotated', annotated))
+
+
+# Reads a ROM set, each of files being a filename or a binary file
+# object, in raw binary or Intel hex format.  Gaps in the data of an
+# Intel hex file are filled with ff, as in an erased EPROM.
+def load_memory(files, inputformat = 'binary'):
+    if inputformat == 'hex':
+        data = []
+        for f in files:
+            if isinstance(f, str):
+                with open(f, 'rb') as f:
+                    data.append(IntelHex().read_image(f))
+            else:
+                data.append(IntelHex().read_image(f))
+        return Memory(data)
+    return Memory.from_files(files)
+
+
+# A batch job is a dictionary describing one ROM set:
+#   name       name of the job, used for its output file
+#   files      bank files (most significant byte, least significant
+#              byte, then optionally fast I/O select)
+#   format     'binary' or 'hex'
+#   cpu        '8x300' or '8x305'
+#   fastio     None, 'wd1000' or 'wd1001'
+#   listing    True for listing format
+#   traverse   True to disassemble only reachable code
+#   entry      list of additional entry points
+#   xref       True to annotate jump targets with their references
+#   output     output file, or None to return the text
+#   cache      maximum size in bytes of the result cache, zero to not
+#              use the cache
+job_defaults = { 'format':   'binary',
+                 'cpu':      '8x300',
+                 'fastio':   None,
+                 'listing':  False,
+                 'traverse': False,
+                 'entry':    [],
+                 'xref':     False,
+                 'output':   None,
+                 'cache':    0 }
+
+def make_job(name, files, defaults = { }, **options):
+    job = dict(job_defaults)
+    job.update(defaults)
+    job.update(options)
+    job['name'] = name
+    job['files'] = files
+    return job
+
+def cpu_type_by_name(name):
+    return CpuType['s' + name.lower().lstrip('s')]
+
+# A manifest is a JSON file containing a list of jobs.  Only name and
+# files are required.  Relative paths are relative to the directory
+# of the manifest.
+def read_manifest(path, defaults = { }):
+    import json
+    with open(path) as f:
+        entries = json.load(f)
+    directory = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in entries:
+        entry = dict(entry)
+        files = [os.path.join(directory, fn) for fn in entry.pop('files')]
+        if entry.get('output') is not None:
+            entry['output'] = os.path.join(directory, entry['output'])
+        jobs.append(make_job(entry.pop('name'), files, defaults, **entry))
+    return jobs
+
+hex_suffixes = ('.hex', '.ihx')
+
+# Each subdirectory of a directory is a ROM set, with its bank files
+# in order of name (e.g., 0.bin, 1.bin, 2.bin).  Files with a suffix
+# of .hex or .ihx are Intel hex.
+def scan_directory(path, defaults = { }):
+    jobs = []
+    for name in sorted(os.listdir(path)):
+        subdir = os.path.join(path, name)
+        if not os.path.isdir(subdir):
+            continue
+        files = [os.path.join(subdir, fn) for fn in sorted(os.listdir(subdir))
+                 if os.path.isfile(os.path.join(subdir, fn))]
+        if len(files) < 2:
+            continue
+        options = { }
+        if all(fn.lower().endswith(hex_suffixes) for fn in files):
+            options['format'] = 'hex'
+        jobs.append(make_job(name, files, defaults, **options))
+    return jobs
+
+
+# Per process instances, so that a worker process constructs each
+# only once however many jobs it runs.
+_s8x30x = { }
+_fast_io = { }
+_cache = { }
+
+def _get_s8x30x(cpu_type):
+    if cpu_type not in _s8x30x:
+        _s8x30x[cpu_type] = S8X30x(cpu_type, decode_table = True)
+    return _s8x30x[cpu_type]
+
+def _get_fast_io_decoder(name):
+    if name is None:
+        return None
+    if name not in _fast_io:
+        _fast_io[name] = fast_io_decoders[name]()
+    return _fast_io[name]
+
+def _get_cache(max_bytes):
+    if not max_bytes:
+        return None
+    if max_bytes not in _cache:
+        _cache[max_bytes] = ResultCache.default(max_bytes)
+    return _cache[max_bytes]
+
+# Decode tables are built (or loaded from the cache) in the parent
+# before the pool is started, so that workers load the cache file,
+# sharing its pages, or inherit the tables when forked, rather than
+# each building them.
+def _init_worker(cpu_types):
+    for cpu_type in cpu_types:
+        _get_s8x30x(cpu_type).decode_table()
+
+# Runs a job, returning (name, error, text), where error is None or
+# a message, and text is the output if it wasn't written to a file.
+def run_job(job):
+    try:
+        s8x30x = _get_s8x30x(cpu_type_by_name(job['cpu']))
+        memory = load_memory(job['files'], job['format'])
+        entry_points = None
+        if job['traverse'] or job['entry']:
+            entry_points = [0] + list(job['entry'])
+        output_file = io.StringIO()
+        disassemble_cached(_get_cache(job['cache']), s8x30x, memory,
+                           show_obj = job['listing'],
+                           output_file = output_file,
+                           entry_points = entry_points,
+                           fast_io_decoder = _get_fast_io_decoder(job['fastio']),
+                           xref = job['xref'])
+        if job['output'] is None:
+            return job['name'], None, output_file.getvalue()
+        with open(job['output'], 'w') as f:
+            f.write(output_file.getvalue())
+        return job['name'], None, None
+    except Exception as e:
+        return job['name'], '%s: %s' % (e.__class__.__name__, e), None
+
+# Runs jobs across a pool of worker processes, yielding the result of
+# each, as from run_job(), in order, as it becomes available.
+def run_batch(jobs, workers = None):
+    cpu_types = sorted(set(cpu_type_by_name(job['cpu']) for job in jobs),
+                       key = lambda c: c.value)
+    _init_worker(cpu_types)
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield run_job(job)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers = workers,
+                             initializer = _init_worker,
+                             initargs = (cpu_types,)) as executor:
+        yield from executor.map(run_job, jobs)
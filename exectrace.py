@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+# Execution trace and code coverage recorder for the 8X300/8X305 simulator
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+import os
+import struct
+import sys
+import zlib
+
+
+ADDRESSES = 65536
+
+
+def write_file(path, data):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# Files hold arrays in little-endian byte order, whatever the byte
+# order of the machine writing or reading them.
+def little_endian_bytes(a):
+    if sys.byteorder == 'big':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def from_little_endian(typecode, data):
+    a = array(typecode, data)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+# The number of times each address was executed, over one or more
+# runs.  Coverage files hold a header of magic, version and number of
+# runs, followed by the zlib compressed counts, as 32-bit little-endian
+# values.  Counts saturate rather than overflow when merged.
+class Coverage:
+    magic = b'S8X30XCV'
+    version = 1
+    header = struct.Struct('<8sII')
+
+    def __init__(self):
+        self.counts = array('I', bytes(4 * ADDRESSES))
+        self.runs = 0
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, runs = cls.header.unpack_from(data)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError('%s is not a coverage file of version %d' %
+                             (path, cls.version))
+        coverage = cls()
+        coverage.counts = from_little_endian('I', zlib.decompress(data[cls.header.size:]))
+        if len(coverage.counts) != ADDRESSES:
+            raise ValueError('%s is truncated' % path)
+        coverage.runs = runs
+        return coverage
+
+    def save(self, path):
+        write_file(path, self.header.pack(self.magic, self.version, self.runs) +
+                   zlib.compress(little_endian_bytes(self.counts)))
+
+    def merge(self, other):
+        limit = 0xffffffff
+        self.counts = array('I', [a + b if a + b <= limit else limit
+                                  for a, b in zip(self.counts, other.counts)])
+        self.runs += other.runs
+
+    # Returns the number of instructions executed, and the number of
+    # instructions, of those in decoded (as from decode()) for which
+    # code_mask, if given, is true.
+    def summary(self, decoded, base = 0, code_mask = None):
+        counts = self.counts
+        executed = total = 0
+        for i, d in enumerate(decoded):
+            if d is None or (code_mask is not None and not code_mask[i]):
+                continue
+            total += 1
+            executed += counts[base + i] != 0
+        return executed, total
+
+    # Returns a dictionary of address to listing annotation, giving the
+    # execution count of each instruction executed, and marking those
+    # not executed.  Words that aren't instructions aren't annotated
+    # unless they were executed.
+    def annotations(self, decoded, base = 0, code_mask = None):
+        counts = self.counts
+        result = { }
+        for i, d in enumerate(decoded):
+            count = counts[base + i]
+            if count:
+                result[base + i] = ' ; count %d' % count
+            elif d is not None and (code_mask is None or code_mask[i]):
+                result[base + i] = ' ; not run'
+        return result
+
+
+# Records the instructions executed by a Simulator, as a ring buffer of
+# records of the last instructions executed, and the coverage of all of
+# them.  An instruction entry is the PC, the instruction word, and the
+# fast I/O select byte if there is one, packed into a 64-bit value by
+# entry().  Instructions run singly are recorded in the ring as their
+# entries.  Those run by a translated block are recorded as the block
+# exit taken: each exit is added with the entries of the instructions
+# executed before it, and a ring record of the exit stands for those
+# instructions.  entries() expands the records of the ring into the
+# entries of the last size instructions.  cursor[0] is the number of
+# records written, which the simulator's translated code updates in
+# place.  A recorder of size zero has no ring, and records only the
+# coverage, at less cost to the simulator.
+#
+# Instructions run singly are counted in counts.  Those run by a block
+# are counted by the exit taken, and the count of each exit is added to
+# the addresses of its instructions when the recorder is folded, as it
+# is when its coverage or position is read.
+#
+# Trace files hold a header of magic, version, position (the number of
+# instructions recorded) and number of entries, followed by the zlib
+# compressed entries, oldest first, as 64-bit little-endian values.
+class TraceRecorder:
+    magic = b'S8X30XTR'
+    version = 1
+    header = struct.Struct('<8sIQI')
+
+    default_size = 1 << 16
+
+    HAS_SELECT = 1 << 40
+    EXIT = 1 << 41
+
+    def __init__(self, size = default_size):
+        if size & (size - 1):
+            raise ValueError('trace size must be a power of two or zero')
+        self.mask = size - 1
+        self.ring = array('Q', bytes(8 * size)) if size else None
+        self.cursor = [0]
+        self.__coverage = Coverage()
+        self.__coverage.runs = 1
+        self.counts = self.__coverage.counts
+        self.exit_counts = []
+        self.exit_paths = []
+        self.exit_records = 0       # exit records written, as of the last fold
+        self.exit_instructions = 0  # instructions executed by exits taken
+
+    # Returns the ring record of a new exit, whose path is the entries
+    # of the instructions executed before it.
+    def add_exit(self, path):
+        self.exit_counts.append(0)
+        self.exit_paths.append(tuple(path))
+        return self.EXIT | (len(self.exit_counts) - 1)
+
+    def fold(self):
+        counts = self.counts
+        exit_counts = self.exit_counts
+        limit = 0xffffffff
+        for e, n in enumerate(exit_counts):
+            if n:
+                path = self.exit_paths[e]
+                for entry in path:
+                    address = entry & 0xffff
+                    counts[address] = min(counts[address] + n, limit)
+                if self.ring is not None:
+                    self.exit_records += n
+                self.exit_instructions += n * len(path)
+                exit_counts[e] = 0
+
+    @property
+    def coverage(self):
+        self.fold()
+        return self.__coverage
+
+    # The number of instructions recorded.
+    @property
+    def position(self):
+        self.fold()
+        return self.cursor[0] - self.exit_records + self.exit_instructions
+
+    @classmethod
+    def entry(cls, pc, word, select = None):
+        if select is None:
+            return pc | word << 16
+        return pc | word << 16 | select << 32 | cls.HAS_SELECT
+
+    # Returns the PC, word and select byte (or None) of an entry.
+    @classmethod
+    def unpack(cls, entry):
+        select = None
+        if entry & cls.HAS_SELECT:
+            select = (entry >> 32) & 0xff
+        return entry & 0xffff, (entry >> 16) & 0xffff, select
+
+    # Returns the entries of the last instructions recorded, up to the
+    # size of the ring, oldest first.
+    def entries(self):
+        if self.ring is None:
+            return array('Q')
+        size = self.mask + 1
+        records = self.cursor[0]
+        if records <= size:
+            records = self.ring[:records]
+        else:
+            start = records & self.mask
+            records = self.ring[start:] + self.ring[:start]
+        entries = array('Q')
+        paths = self.exit_paths
+        for record in records:
+            if record & self.EXIT:
+                entries.extend(paths[record & ~self.EXIT])
+            else:
+                entries.append(record)
+        if len(entries) > size:
+            entries = entries[len(entries) - size:]
+        return entries
+
+    def save(self, path):
+        entries = self.entries()
+        write_file(path, self.header.pack(self.magic, self.version,
+                                          self.position, len(entries)) +
+                   zlib.compress(little_endian_bytes(entries)))
+
+    # Returns the position and entries of a trace file.
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, position, count = cls.header.unpack_from(data)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError('%s is not a trace file of version %d' %
+                             (path, cls.version))
+        entries = from_little_endian('Q', zlib.decompress(data[cls.header.size:]))
+        if len(entries) != count:
+            raise ValueError('%s is truncated' % path)
+        return position, entries
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from s8x30x import S8X30x, CpuType, BadInstruction
+
+    parser = argparse.ArgumentParser(description = 'Execution trace and coverage files of the 8X300/8X305 simulator')
+    parser.add_argument('-5', '--8x305', action='store_const', dest='cpu_type',
+                        const=CpuType.s8x305, default=CpuType.s8x300,
+                        help = '8X305 processor')
+    subparsers = parser.add_subparsers(dest = 'command')
+    show_parser = subparsers.add_parser('show', help = 'list the instructions of a trace file')
+    show_parser.add_argument('-n', '--count', type = int,
+                             help = 'list only the last COUNT instructions')
+    show_parser.add_argument('trace')
+    merge_parser = subparsers.add_parser('merge', help = 'merge coverage files')
+    merge_parser.add_argument('-o', '--output', required = True,
+                              help = 'output coverage file')
+    merge_parser.add_argument('coverage', nargs = '+')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        position, entries = TraceRecorder.load(args.trace)
+        if args.count is not None:
+            entries = entries[-args.count:] if args.count else entries[:0]
+        number = position - len(entries)
+        lookup = S8X30x(cpu_type = args.cpu_type, decode_table = True).decode_table().lookup
+        for entry in entries:
+            pc, word, select = TraceRecorder.unpack(entry)
+            try:
+                dis, operands = lookup(word, pc, select).text()
+            except BadInstruction:
+                dis, operands = 'dw      ', S8X30x.ihex(word)
+            print('%10d %04x: %04x %2s  %-8s%s' %
+                  (number, pc, word, '' if select is None else '%02x' % select,
+                   dis, operands))
+            number += 1
+    elif args.command == 'merge':
+        coverage = Coverage()
+        for path in args.coverage:
+            coverage.merge(Coverage.load(path))
+        coverage.save(args.output)
+        print('%d runs, %d addresses executed' %
+              (coverage.runs, sum(1 for count in coverage.counts if count)))
+    else:
+        parser.print_usage()
+        sys.exit(2)
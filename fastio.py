@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# Table-driven fast I/O select decode for 8X300/8X305 based boards
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import cached_property
+import hashlib
+
+# Generic names of the I/O operands an instruction can have.  ivl and
+# ivr are the IV bank address registers used as the destination of a
+# register operation or XMIT, and are named using the dliv and driv
+# tables respectively.
+src_kinds = (None, 'sliv', 'sriv')
+dst_kinds = (None, 'dliv', 'driv', 'ivl', 'ivr')
+
+dst_table = { 'dliv': 'dliv', 'driv': 'driv', 'ivl': 'dliv', 'ivr': 'driv' }
+
+
+# A board's fast I/O select byte holds a read select field and a write
+# select field, each with an idle value meaning no device selected.
+# Subclasses define iv_name, giving the device names for each generic
+# operand name and select value, and the position, mask and idle value
+# of each select field.
+#
+# The names and annotations for every combination of select byte and
+# I/O operands are compiled into a table the first time one is looked
+# up, so that a decoder used only for its table_signature(), as for a
+# result cache hit, doesn't build it.
+class FastIODecoder():
+    iv_name = { 'sliv': { }, 'sriv': { }, 'dliv': { }, 'driv': { } }
+
+    rd_shift = 0
+    rd_mask  = 0x7
+    rd_idle  = 0x7
+
+    wr_shift = 4
+    wr_mask  = 0x7
+    wr_idle  = 0x0
+
+    def __init__(self):
+        self.rd_select = [(ext >> self.rd_shift) & self.rd_mask
+                          for ext in range(256)]
+        self.wr_select = [(ext >> self.wr_shift) & self.wr_mask
+                          for ext in range(256)]
+
+        self.kinds = len(src_kinds) * len(dst_kinds)
+        self.src_index = { k: i * len(dst_kinds) for i, k in enumerate(src_kinds) }
+        self.dst_index = { k: i for i, k in enumerate(dst_kinds) }
+
+    # table[ext * kinds + src * len(dst_kinds) + dst] is the tuple
+    # (source name, destination name, annotation), with None for a
+    # name that isn't replaced, and the annotation listing selects not
+    # accounted for by a replaced name.
+    @cached_property
+    def table(self):
+        table = []
+        for ext in range(256):
+            rr = self.rd_select[ext]
+            wr = self.wr_select[ext]
+            for src_kind in src_kinds:
+                src_name = None
+                if src_kind is not None:
+                    src_name = self.iv_name[src_kind].get(rr)
+                for dst_kind in dst_kinds:
+                    dst_name = None
+                    if dst_kind is not None:
+                        dst_name = self.iv_name[dst_table[dst_kind]].get(wr)
+                    annotation = ''
+                    if rr != self.rd_idle and src_name is None:
+                        annotation += ' rd=%d' % rr
+                    if wr != self.wr_idle and dst_name is None:
+                        annotation += ' wr=%d' % wr
+                    if annotation:
+                        annotation = ' //' + annotation
+                    table.append((src_name, dst_name, annotation))
+        return table
+
+    # Returns (source name, destination name, annotation) for an
+    # instruction with the given select byte and generic I/O operand
+    # names (as from S8X30x.io_operands()).
+    def lookup(self, ext, src_kind = None, dst_kind = None):
+        return self.table[ext * self.kinds +
+                          self.src_index[src_kind] +
+                          self.dst_index[dst_kind]]
+
+    # A hash of the select names and fields, which changes whenever the
+    # decoding would, for use in cache keys.
+    @classmethod
+    def table_signature(cls):
+        desc = [cls.__name__,
+                sorted((kind, sorted(names.items()))
+                       for kind, names in cls.iv_name.items()),
+                cls.rd_shift, cls.rd_mask, cls.rd_idle,
+                cls.wr_shift, cls.wr_mask, cls.wr_idle]
+        return hashlib.sha256(repr(desc).encode('ascii')).digest()
+
+    # Returns the select byte for the given read and write selects,
+    # with the idle select for either that is None.  This is the
+    # inverse of rd_select and wr_select, as used by the assembler.
+    def select_byte(self, rd = None, wr = None):
+        if rd is None:
+            rd = self.rd_idle
+        if wr is None:
+            wr = self.wr_idle
+        return (((rd & self.rd_mask) << self.rd_shift) |
+                ((wr & self.wr_mask) << self.wr_shift))
+
+    # Process the fast I/O selects of an already rendered operand
+    # string, substituting device names for generic I/O operand names.
+    # A bare ivl or ivr is only a destination in the destination
+    # position, the second operand (or the only one); as a source
+    # register it isn't renamed.
+    def fast_io_decode(self, ext, operands):
+        ops = operands.split(',')
+        src_kind = dst_kind = None
+        for i, op in enumerate(ops):
+            if op in ('ivl', 'ivr'):
+                if i == 1 or len(ops) == 1:
+                    dst_kind, dst_op = op, i
+            elif op[:4] in self.src_index:
+                src_kind, src_op = op[:4], i
+            elif op[:4] in self.dst_index:
+                dst_kind, dst_op = op[:4], i
+        src_name, dst_name, annotation = self.lookup(ext[0], src_kind, dst_kind)
+        if src_name is not None:
+            ops[src_op] = src_name + ops[src_op][4:]
+        if dst_name is not None:
+            ops[dst_op] = dst_name + ops[dst_op][len(dst_kind):]
+        return ','.join(ops) + annotation
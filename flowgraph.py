@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# Control flow analysis for 8X300/8X305 firmware
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_right
+
+from s8x30x import OT
+
+# flags for each address
+CODE = 0x01   # reached by normal control flow
+EXEC = 0x02   # executed by an XEC
+
+branch_mnemonics = frozenset(['jmp', 'nzt', 'xec'])
+
+
+class BasicBlock:
+    def __init__(self, start, end, executed = False):
+        self.start = start       # address of first instruction
+        self.end = end           # address following last instruction
+        self.executed = executed # only reached as the target of an XEC
+        self.succs = []          # start addresses of successor blocks
+        self.preds = []          # start addresses of predecessor blocks
+
+    def __repr__(self):
+        return 'BasicBlock(%04x-%04x)' % (self.start, self.end - 1)
+
+    def __len__(self):
+        return self.end - self.start
+
+
+# Recursive traversal of an image decoded by S8X30x.decode_words(),
+# starting from the given entry points (address zero, the reset
+# address, by default).  Only instructions reachable from the entry
+# points are considered code.
+#
+# An XEC executes a single instruction at its target and then
+# continues with the instruction following the XEC, unless the target
+# is a taken branch.  The instruction at an XEC target is marked EXEC,
+# and its own branch targets are followed, but the instructions
+# following it are not reached through the XEC.
+#
+# The range of XEC targets of an IV operand follows from its length.
+# For a register operand the range isn't known, so the targets are
+# taken to be the base address and the JMP instructions that
+# immediately follow it, the usual form of a jump table.
+class FlowGraph:
+    def __init__(self, decoded, base = 0, entry_points = (0,)):
+        self.decoded = decoded
+        self.base = base
+        self.flags = bytearray(len(decoded))
+        self.entry_points = [a for a in entry_points if self.in_image(a)]
+        self.jump_sources = { }   # target -> list of branch addresses
+        self.xec_sources = { }    # target -> list of XEC addresses
+        self.traverse()
+        self.build_blocks()
+
+    def in_image(self, address):
+        return self.base <= address < self.base + len(self.decoded)
+
+    def inst(self, address):
+        return self.decoded[address - self.base]
+
+    def is_code(self, address):
+        return self.in_image(address) and self.flags[address - self.base] != 0
+
+    # Returns a list, indexed by offset from base, of whether each
+    # word is reachable code.
+    def code_mask(self):
+        return [f != 0 for f in self.flags]
+
+    def xec_targets(self, address):
+        d = self.inst(address)
+        j = d.j
+        if OT.siv in d.form.operands:
+            count = 1 << (d.l or 8)
+            return sorted(set((j & ~0x1f) | ((j + v) & 0x1f)
+                              for v in range(min(count, 32))))
+        targets = [j]
+        for v in range(1, 256):
+            t = (j & ~0xff) | ((j + v) & 0xff)
+            if not self.in_image(t):
+                break
+            d = self.inst(t)
+            if d is None or d.inst.mnem != 'jmp':
+                break
+            targets.append(t)
+        return targets
+
+    def __add_source(self, table, target, source):
+        table.setdefault(target, []).append(source)
+
+    def traverse(self):
+        work = list(self.entry_points)
+        while work:
+            address = work.pop()
+            while self.in_image(address) and not self.flags[address - self.base] & CODE:
+                d = self.inst(address)
+                if d is None:
+                    break  # not a valid instruction
+                self.flags[address - self.base] |= CODE
+                work += self.__branch_targets(address, d)
+                if d.inst.mnem == 'jmp':
+                    break
+                address += 1
+
+    # Returns the addresses execution may continue at, other than by
+    # falling through, from the instruction at address.
+    def __branch_targets(self, address, d, executed = False):
+        mnem = d.inst.mnem
+        if mnem in ('jmp', 'nzt'):
+            self.__add_source(self.jump_sources, d.j, address)
+            return [d.j]
+        if mnem != 'xec':
+            return []
+        targets = []
+        for t in self.xec_targets(address):
+            self.__add_source(self.xec_sources, t, address)
+            if not self.in_image(t) or self.flags[t - self.base] & EXEC:
+                continue
+            dt = self.inst(t)
+            if dt is None:
+                continue
+            self.flags[t - self.base] |= EXEC
+            targets += self.__branch_targets(t, dt, True)
+        return targets
+
+    def build_blocks(self):
+        leaders = set(self.entry_points)
+        leaders.update(t for t in self.jump_sources if self.is_code(t))
+        leaders.update(t for t in self.xec_sources if self.is_code(t))
+        for offset, flags in enumerate(self.flags):
+            if flags and self.decoded[offset].inst.mnem in branch_mnemonics:
+                leaders.add(self.base + offset + 1)
+
+        self.blocks = { }
+        for start in sorted(leaders):
+            if not self.is_code(start):
+                continue
+            if not self.flags[start - self.base] & CODE:
+                # only executed by XEC
+                self.blocks[start] = BasicBlock(start, start + 1, True)
+                continue
+            end = start
+            while True:
+                mnem = self.inst(end).inst.mnem
+                end += 1
+                if (mnem in branch_mnemonics or end in leaders or
+                    not self.is_code(end) or
+                    not self.flags[end - self.base] & CODE):
+                    break
+            self.blocks[start] = BasicBlock(start, end)
+        self.block_starts = sorted(self.blocks)
+
+        for block in self.blocks.values():
+            last = block.end - 1
+            d = self.inst(last)
+            mnem = d.inst.mnem
+            succs = []
+            if mnem in ('jmp', 'nzt'):
+                succs.append(d.j)
+            elif mnem == 'xec':
+                succs += self.xec_targets(last)
+            if (not block.executed and mnem != 'jmp' and
+                self.is_code(block.end)):
+                succs.append(block.end)
+            for s in succs:
+                if s in self.blocks and s not in block.succs:
+                    block.succs.append(s)
+                    self.blocks[s].preds.append(block.start)
+
+    # Returns the block containing the address, or None.
+    def block_at(self, address):
+        i = bisect_right(self.block_starts, address)
+        if i == 0:
+            return None
+        block = self.blocks[self.block_starts[i - 1]]
+        if address < block.end:
+            return block
+        return None
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+# Instruction level comparison of two 8X300/8X305 images
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_right
+from difflib import SequenceMatcher
+
+
+# An image is divided into segments, each ending with an
+# unconditional JMP (or at the end of the image), which for this
+# architecture are the nearest thing to functions.  Each instruction
+# is reduced to a token that doesn't depend on where the segment is
+# located: the opcode itself for an instruction without a jump
+# target, or for one with a target, the instruction and its other
+# fields along with the offset of the target within the segment, or
+# None for a target outside the segment.  Words that aren't valid
+# instructions are tokens of their own.
+#
+# The tuple of a segment's tokens is its key, and segments with equal
+# keys are the same code wherever they are.  The targets outside each
+# segment are kept separately, to be checked once the segments of two
+# images have been matched.
+class Segment:
+    def __init__(self, start, end, tokens, targets):
+        self.start = start       # address of first word
+        self.end = end           # address following last word
+        self.tokens = tokens
+        self.key = tuple(tokens)
+        self.targets = targets   # list of (offset, target) outside segment
+
+    def __repr__(self):
+        return 'Segment(%04x-%04x)' % (self.start, self.end - 1)
+
+    def __len__(self):
+        return self.end - self.start
+
+
+# Divides an image decoded by S8X30x.decode_words() into segments.
+def segments(decoded, words, base = 0):
+    result = []
+    start = 0
+    for i, d in enumerate(decoded):
+        if d is not None and d.inst.mnem == 'jmp':
+            result.append(make_segment(decoded, words, base, start, i + 1))
+            start = i + 1
+    if start < len(decoded):
+        result.append(make_segment(decoded, words, base, start, len(decoded)))
+    return result
+
+
+def make_segment(decoded, words, base, start, end):
+    tokens = []
+    targets = []
+    lo = base + start
+    hi = base + end
+    for i in range(start, end):
+        d = decoded[i]
+        if d is None:
+            tokens.append(('dw', words[i]))
+        elif d.j is None:
+            tokens.append(words[i])
+        else:
+            target = d.j
+            others = (d.s, d.l)
+            if lo <= target < hi:
+                tokens.append((d.inst.mnem, others, target - lo))
+            else:
+                tokens.append((d.inst.mnem, others, None))
+                targets.append((i - start, target))
+    return Segment(lo, hi, tokens, targets)
+
+
+# One entry of the comparison of two images.  kind is one of:
+#   'equal'     same code at the same offset in the sequence of segments
+#   'moved'     same code, but out of sequence
+#   'modified'  a segment of each image, in corresponding positions
+#               but differing, or same code with a jump target outside
+#               the segment that doesn't correspond
+#   'deleted'   segment only in the old image
+#   'inserted'  segment only in the new image
+# a and b are the segments of the old and new images, or None.  For a
+# modified segment, changes is the number of differing words, and
+# retargeted the offsets of jumps out of the segment whose targets
+# don't correspond.
+class Change:
+    def __init__(self, kind, a, b, changes = 0):
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self.changes = changes
+        self.retargeted = []
+
+    def __repr__(self):
+        return 'Change(%s, %r, %r)' % (self.kind, self.a, self.b)
+
+
+# Counts the words that differ between two segments.
+def count_changes(a, b):
+    matched = sum(size for i, j, size in
+                  SequenceMatcher(None, a.tokens, b.tokens,
+                                  autojunk = False).get_matching_blocks())
+    return max(len(a), len(b)) - matched
+
+
+# Maps addresses of the old image to the new, using the segments
+# whose code is the same in both.
+class AddressMap:
+    def __init__(self, pairs):
+        pairs = sorted(pairs, key = lambda p: p[0].start)
+        self.starts = [a.start for a, b in pairs]
+        self.pairs = pairs
+
+    def __getitem__(self, address):
+        i = bisect_right(self.starts, address) - 1
+        if i >= 0:
+            a, b = self.pairs[i]
+            if address < a.end:
+                return b.start + address - a.start
+        return None
+
+
+# Compares the segments of two images.  Returns the list of changes,
+# in order of the old image, with inserted segments following the
+# segment preceding them in the new image.
+#
+# The segments are first aligned in sequence by their keys.  Segments
+# left unaligned are then paired, in order, with unaligned segments of
+# the same key as moved code, and the remaining segments are
+# paired in sequence within each region that was replaced.  Each key
+# is replaced by a small integer first, so that comparing segments
+# doesn't compare their tokens.
+def diff_segments(seg_a, seg_b):
+    ids = { }
+    ka = [ids.setdefault(s.key, len(ids)) for s in seg_a]
+    kb = [ids.setdefault(s.key, len(ids)) for s in seg_b]
+    opcodes = SequenceMatcher(None, ka, kb, autojunk = False).get_opcodes()
+
+    unmatched_a = { }
+    unmatched_b = { }
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != 'equal':
+            for i in range(i1, i2):
+                unmatched_a.setdefault(ka[i], []).append(i)
+            for j in range(j1, j2):
+                unmatched_b.setdefault(kb[j], []).append(j)
+    moved_a = { }
+    moved_b = set()
+    for k, la in unmatched_a.items():
+        lb = unmatched_b.get(k, ())
+        for i, j in zip(la, lb):
+            moved_a[i] = j
+            moved_b.add(j)
+
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                changes.append(Change('equal', seg_a[i], seg_b[j]))
+            continue
+        rest_a = [i for i in range(i1, i2) if i not in moved_a]
+        rest_b = [j for j in range(j1, j2) if j not in moved_b]
+        pairs = dict(zip(rest_a, rest_b))
+        for i in range(i1, i2):
+            if i in moved_a:
+                changes.append(Change('moved', seg_a[i], seg_b[moved_a[i]]))
+            elif i in pairs:
+                a = seg_a[i]
+                b = seg_b[pairs[i]]
+                changes.append(Change('modified', a, b, count_changes(a, b)))
+            else:
+                changes.append(Change('deleted', seg_a[i], None))
+        for j in rest_b[len(rest_a):]:
+            changes.append(Change('inserted', None, seg_b[j]))
+
+    # Code that is the same apart from a jump out of the segment is
+    # only unchanged if the target corresponds.
+    address_map = AddressMap([(c.a, c.b) for c in changes
+                              if c.kind in ('equal', 'moved')])
+    for c in changes:
+        if c.kind in ('equal', 'moved'):
+            c.retargeted = [offset for (offset, ta), (_, tb) in
+                            zip(c.a.targets, c.b.targets)
+                            if ta != tb and address_map[ta] != tb]
+            if c.retargeted:
+                c.kind = 'modified'
+                c.changes = len(c.retargeted)
+    return changes
+
+
+# Compares two images given as S8X30x.decode_words() results and the
+# words they were decoded from.
+def diff_images(decoded_a, words_a, decoded_b, words_b,
+                base_a = 0, base_b = 0):
+    return diff_segments(segments(decoded_a, words_a, base_a),
+                         segments(decoded_b, words_b, base_b))
+
+
+# Returns a dictionary of the number of words in each kind of change,
+# counting the larger of the two segments of a modified change.
+def summarize(changes):
+    counts = { 'equal': 0, 'moved': 0, 'modified': 0,
+               'deleted': 0, 'inserted': 0 }
+    for c in changes:
+        if c.kind == 'modified':
+            counts['modified'] += c.changes
+        else:
+            counts[c.kind] += len(c.a or c.b)
+    return counts
+
+
+def format_range(seg):
+    if seg is None:
+        return ' ' * 9
+    return '%04x-%04x' % (seg.start, seg.end - 1)
+
+
+kind_text = { 'equal':    '=',
+              'moved':    '>',
+              'modified': '!',
+              'deleted':  '-',
+              'inserted': '+' }
+
+
+# Writes the changes, one per line, showing the address range of the
+# segment in each image.  Unless show_equal is true, equal segments
+# are omitted.
+def write_changes(changes, output_file, show_equal = False):
+    for c in changes:
+        if c.kind == 'equal' and not show_equal:
+            continue
+        line = '%s %s %s  %s' % (format_range(c.a), kind_text[c.kind],
+                                 format_range(c.b), c.kind)
+        if c.kind == 'modified':
+            line += ' (%d words)' % c.changes
+        output_file.write(line + '\n')
+
+
+def format_word(s8x30x, decoded, words, base, address):
+    d = decoded[address - base]
+    if d is None:
+        dis, operands = s8x30x.format_bad_inst(words[address - base])
+    else:
+        dis, operands = d.text()
+    return '%04x: %04x  %s%s' % (address, words[address - base], dis, operands)
+
+
+# Writes the instructions of a change, prefixed with '-' for the old
+# image and '+' for the new.  For a modified segment only the words
+# that differ are shown.
+def write_listing(s8x30x, change, image_a, image_b, output_file):
+    decoded_a, words_a, base_a = image_a
+    decoded_b, words_b, base_b = image_b
+    a = change.a
+    b = change.b
+    if a is not None and b is not None:
+        opcodes = SequenceMatcher(None, a.tokens, b.tokens,
+                                  autojunk = False).get_opcodes()
+        ranges = [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in opcodes
+                  if tag != 'equal']
+        if not ranges:
+            ranges = [(o, o + 1, o, o + 1) for o in change.retargeted]
+    elif a is not None:
+        ranges = [(0, len(a), 0, 0)]
+    else:
+        ranges = [(0, 0, 0, len(b))]
+    for i1, i2, j1, j2 in ranges:
+        for i in range(i1, i2):
+            output_file.write('    - ' + format_word(s8x30x, decoded_a, words_a,
+                                                     base_a, a.start + i) + '\n')
+        for j in range(j1, j2):
+            output_file.write('    + ' + format_word(s8x30x, decoded_b, words_b,
+                                                     base_b, b.start + j) + '\n')
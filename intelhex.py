@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-# Intel hex file reader
+# Intel hex file reader and writer
 # Copyright 2016 Eric Smith <spacewar@gmail.com>
 
 # This program is free software: you can redistribute it and/or modify
@@ -14,92 +14,208 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import io
+import binascii
+from bisect import bisect_right
 
+# Records are decoded a whole record at a time with binascii, from the
+# entire file read into memory at once.  Data records are collected
+# into segments of contiguous addresses; read_segments() returns all of
+# them, read() returns the data of a file that has only one, and
+# read_image() returns the data of all of them with the gaps filled.
 class IntelHex:
 
     class BadChecksum(Exception):
         pass
 
+    class BadRecord(Exception):
+        pass
+
     class UnknownRecordType(Exception):
         pass
     
     class Discontiguous(Exception):
         pass
-    
-    def get_bytes(self, count):
-        s = self.f.read(2*count)
-        if len(s) != 2*count:
-            raise EOFError()
-        return bytearray([int(s[2*i:2*i+2], 16) for i in range(count)])
-
-    def get_ui8(self):
-        return self.get_bytes(1)[0]
-    
-    def get_ui16(self):
-        b = self.get_bytes(2)
-        return (b[0] << 8) + b[1]
-        
-
-    def get_colon(self):
-        while True:
-            b = self.f.read(1)
-            if len(b) == 0:
-                raise EOFError()
-            if b[0] == 0x3a:
-                return
-        
-
-
-    def get_record(self):
-        self.get_colon()
-        self.rn += 1
-        data_length = self.get_ui8()
-        addr = self.get_ui16()
-        rec_type = self.get_ui8()
-        data = self.get_bytes(data_length)
-        expected_checksum = (((data_length +
-                               ((addr >> 8) & 0xff) +
-                               (addr & 0xff) +
-                               rec_type +
-                               sum(data)) ^ 0xff) + 1) & 0xff
-        checksum = self.get_ui8()
-        if checksum != expected_checksum:
-            raise IntelHex.BadChecksum('Bad checksum for record #%d' % self.rn)
-        if rec_type == 0x00:  # data
-            if self.load_addr is None:
-                self.load_addr = addr
-            if self.expected_addr is not None and self.expected_addr != addr:
-                raise IntelHex.Discontiguous('Unexpected address for data record #%d' % self.rn)
-            self.memory[self.load_addr:self.load_addr+data_length] = data
-            self.expected_addr = addr + data_length
-            self.load_addr += data_length
-            self.limit = max(self.limit, self.load_addr)
-
-        elif rec_type == 0x01:  # end of file
-            raise EOFError()  # end of file
-        elif rec_type == 0x04:
-            return True
-        else:
-            raise IntelHex.UnknownRecordType('Unknown record type %02x for record #%d' % (rec_type, self.rn))
-        return True
-
 
-    def read(self, f):
-        if isinstance(f, bytearray):
-            self.f = io.BytesIO(f)
-        else:
-            self.f = f
-        self.memory = bytearray(65536)
+    @staticmethod
+    def __read_all(f):
+        if isinstance(f, str):
+            return f.encode('ascii')
+        if isinstance(f, (bytes, bytearray, memoryview)):
+            return bytes(f)
+        data = f.read()
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        return data
+
+    # Yields (record number, record type, address, data) for each record
+    # up to and including the end of file record.  Anything between
+    # records is ignored.
+    def __records(self, text):
+        chunks = text.split(b':')
+        for rn, chunk in enumerate(chunks[1:], 1):
+            try:
+                length = int(chunk[:2], 16)
+                rec = binascii.a2b_hex(chunk[:2 * length + 10])
+            except (ValueError, binascii.Error):
+                raise IntelHex.BadRecord('Malformed record #%d' % rn)
+            if len(rec) != length + 5:
+                return  # truncated final record
+            if sum(rec) & 0xff:
+                raise IntelHex.BadChecksum('Bad checksum for record #%d' % rn)
+            yield rn, rec[3], (rec[1] << 8) | rec[2], rec[4:-1]
+
+    # Returns a list of (address, bytearray) segments of contiguous data,
+    # sorted by address.  Extended segment (02) and extended linear (04)
+    # address records are applied to the addresses of the data records
+    # that follow them.  The start address from a 03 or 05 record is
+    # left in self.start_address.
+    def read_segments(self, f):
         self.rn = 0
-        self.load_addr = 0
-        self.expected_addr = None
-        self.limit = 0
-
-        try:
-            while True:
-                self.get_record()
-        except EOFError as e:
-            pass
-
-        return self.memory[:self.limit]
+        self.start_address = None
+        base = 0
+        segments = []
+        seg_addr = None
+        seg_data = None
+        for self.rn, rec_type, addr, data in self.__records(self.__read_all(f)):
+            if rec_type == 0x00:  # data
+                if not data:
+                    continue
+                addr += base
+                if seg_data is None or addr != seg_addr + len(seg_data):
+                    seg_addr = addr
+                    seg_data = bytearray()
+                    segments.append((seg_addr, seg_data))
+                seg_data += data
+            elif rec_type == 0x01:  # end of file
+                break
+            elif rec_type == 0x02:  # extended segment address
+                base = int.from_bytes(data, 'big') << 4
+            elif rec_type == 0x03:  # start segment address, CS:IP
+                self.start_address = ((int.from_bytes(data[:2], 'big') << 4) +
+                                      int.from_bytes(data[2:], 'big'))
+            elif rec_type == 0x04:  # extended linear address
+                base = int.from_bytes(data, 'big') << 16
+            elif rec_type == 0x05:  # start linear address
+                self.start_address = int.from_bytes(data, 'big')
+            else:
+                raise IntelHex.UnknownRecordType('Unknown record type %02x for record #%d' % (rec_type, self.rn))
+
+        # coalesce segments that are out of order in the file into
+        # contiguous ranges, then copy each segment into its range in
+        # file order, so that later records overwrite earlier ones
+        # where they overlap
+        ranges = []
+        for addr, data in sorted(segments, key = lambda seg: seg[0]):
+            end = addr + len(data)
+            if ranges and addr <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([addr, end])
+        if len(ranges) == len(segments):
+            return sorted(segments, key = lambda seg: seg[0])
+        merged = [(start, bytearray(end - start)) for start, end in ranges]
+        starts = [start for start, end in ranges]
+        for addr, data in segments:
+            start, merged_data = merged[bisect_right(starts, addr) - 1]
+            merged_data[addr - start:addr - start + len(data)] = data
+        return merged
+
+    # Returns the data of the file, which must be contiguous, as a
+    # bytearray.  The address of the first byte is left in
+    # self.load_addr.
+    def read(self, f):
+        segments = self.read_segments(f)
+        if len(segments) > 1:
+            raise IntelHex.Discontiguous('Data at %x does not follow data ending at %x' %
+                                         (segments[1][0],
+                                          segments[0][0] + len(segments[0][1])))
+        if not segments:
+            self.load_addr = 0
+            return bytearray()
+        self.load_addr, data = segments[0]
+        return data
+
+    # Returns the data of the file as a bytearray, from the lowest
+    # address of its data to the highest, with any gaps between
+    # segments filled with the fill byte.  The address of the first
+    # byte is left in self.load_addr, and the gaps filled, as a list
+    # of (start, end) address pairs, in self.gaps.
+    def read_image(self, f, fill = 0xff):
+        segments = self.read_segments(f)
+        self.gaps = []
+        if not segments:
+            self.load_addr = 0
+            return bytearray()
+        self.load_addr = segments[0][0]
+        if len(segments) == 1:
+            return segments[0][1]
+        end = segments[-1][0] + len(segments[-1][1])
+        image = bytearray([fill]) * (end - self.load_addr)
+        prev_end = self.load_addr
+        for addr, data in segments:
+            if addr > prev_end:
+                self.gaps.append((prev_end, addr))
+            image[addr - self.load_addr:addr - self.load_addr + len(data)] = data
+            prev_end = addr + len(data)
+        return image
+
+    @staticmethod
+    def __record(rec_type, addr, data):
+        rec = bytes([len(data), addr >> 8, addr & 0xff, rec_type]) + bytes(data)
+        rec += bytes([-sum(rec) & 0xff])
+        return ':' + binascii.b2a_hex(rec).decode('ascii').upper() + '\n'
+
+    # Writes data, loaded at load_addr, as data records followed by an
+    # end of file record.  An extended linear address record precedes
+    # the data of each 64K region other than the first.
+    def write(self, f, data, load_addr = 0, record_size = 16):
+        lines = []
+        base = 0
+        offset = 0
+        while offset < len(data):
+            addr = load_addr + offset
+            if addr >> 16 != base:
+                base = addr >> 16
+                lines.append(self.__record(0x04, 0, base.to_bytes(2, 'big')))
+            length = min(record_size, len(data) - offset,
+                         0x10000 - (addr & 0xffff))
+            lines.append(self.__record(0x00, addr & 0xffff,
+                                       data[offset:offset + length]))
+            offset += length
+        lines.append(self.__record(0x01, 0, b''))
+        f.write(''.join(lines))
+
+
+if __name__ == '__main__':
+    # Check that overlapping data records are applied in file order,
+    # whatever their order by address, that empty data records don't
+    # split segments, and that read_image() fills gaps.
+    def hex_text(records):
+        lines = []
+        for addr, data in records:
+            rec = bytes([len(data), addr >> 8, addr & 0xff, 0x00]) + data
+            rec += bytes([-sum(rec) & 0xff])
+            lines.append(':' + binascii.b2a_hex(rec).decode('ascii').upper() + '\n')
+        return ''.join(lines) + ':00000001FF\n'
+
+    cases = [([(0x0002, b'\xaa\xaa'), (0x0000, b'\xbb\xbb\xbb\xbb')],
+              [(0x0000, b'\xbb\xbb\xbb\xbb')]),
+             ([(0x0000, b'\xbb\xbb\xbb\xbb'), (0x0002, b'\xaa\xaa')],
+              [(0x0000, b'\xbb\xbb\xaa\xaa')]),
+             ([(0x0004, b'\x44\x55'), (0x0000, b'\x00\x11'),
+               (0x0001, b'\x22\x33\x66'), (0x0010, b'\x77')],
+              [(0x0000, b'\x00\x22\x33\x66\x44\x55'), (0x0010, b'\x77')]),
+             ([(0x0000, b'\x11\x22\x33\x44'), (0x0001, b'\x55')],
+              [(0x0000, b'\x11\x55\x33\x44')]),
+             ([(0x0000, b'\x11'), (0x1000, b''), (0x0001, b'\x22')],
+              [(0x0000, b'\x11\x22')])]
+    for records, expected in cases:
+        segments = IntelHex().read_segments(hex_text(records))
+        assert [(addr, bytes(data)) for addr, data in segments] == expected, \
+            (records, segments)
+
+    ih = IntelHex()
+    image = ih.read_image(hex_text([(0x0010, b'\x11'), (0x0013, b'\x22')]))
+    assert (ih.load_addr, bytes(image), ih.gaps) == \
+        (0x0010, b'\x11\xff\xff\x22', [(0x0011, 0x0013)]), (image, ih.gaps)
+    print('ok')
@@ -14,24 +14,101 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import math
+from array import array
+import mmap
+import sys
 
 class LengthMismatch(Exception):
     pass
 
+# The banks (e.g., most significant opcode byte, least significant
+# opcode byte, fast I/O select) are interleaved once into a single
+# buffer, so that reading a word is a slice of that buffer rather
+# than a gather from each bank.  The opcodes are also kept as an
+# array of 16-bit words for bulk decoding.
 class Memory:
     def __init__(self, data):
-        self.data = data
-        l = [len(d) for d in self.data]
+        l = [len(d) for d in data]
         if l[1:] != l[:-1]:
             raise LengthMismatch()
         self.size = l[0]
+        self.bank_count = len(data)
+        buf = bytearray(self.size * self.bank_count)
+        for i, d in enumerate(data):
+            buf[i::self.bank_count] = d
+        self.view = memoryview(buf)
+
+        self.words = array('H')
+        if self.bank_count >= 2:
+            self.words.frombytes(self.__opcode_bytes(data[0], data[1]))
+            if sys.byteorder == 'little':
+                self.words.byteswap()
+
+    def __opcode_bytes(self, msb, lsb):
+        buf = bytearray(2 * self.size)
+        buf[0::2] = msb
+        buf[1::2] = lsb
+        return buf
+
+    # Each item of files is a filename or a binary file object.  Files
+    # are memory-mapped where possible, so the only copy made of their
+    # contents is the interleaved buffer.
+    @classmethod
+    def from_files(cls, files):
+        data = []
+        try:
+            for f in files:
+                if isinstance(f, str):
+                    with open(f, 'rb') as f:
+                        data.append(cls.__map(f))
+                else:
+                    data.append(cls.__map(f))
+            return cls(data)
+        finally:
+            for d in data:
+                if isinstance(d, mmap.mmap):
+                    d.close()
+
+    @staticmethod
+    def __map(f):
+        try:
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (OSError, ValueError, AttributeError):
+            return f.read()  # empty file, pipe, or not a real file
 
     def __len__(self):
         return self.size
 
+    # Returns a memoryview of the bytes of all banks at the address.
+    # As with a list, a negative address counts back from the end.
     def __getitem__(self, address):
-        return [self.data[i][address] for i in range(len(self.data))]
+        if address < 0:
+            address += self.size
+        if not 0 <= address < self.size:
+            raise IndexError('memory address out of range')
+        n = self.bank_count
+        return self.view[address * n:(address + 1) * n]
+
+    # Returns the 16-bit opcode at the address and the fast I/O select
+    # byte, or None if there is no fast I/O select bank.
+    def word(self, address):
+        if self.bank_count > 2:
+            return self.words[address], self.view[address * self.bank_count + 2]
+        return self.words[address], None
+
+    # Changes the opcode at the address, and the fast I/O select byte
+    # if select is not None and there is a fast I/O select bank.
+    def patch(self, address, word, select = None):
+        n = self.bank_count
+        self.view[address * n] = word >> 8
+        self.view[address * n + 1] = word & 0xff
+        self.words[address] = word
+        if select is not None and n > 2:
+            self.view[address * n + 2] = select
+
+    # Returns a memoryview of a single bank.
+    def bank(self, i):
+        return self.view[i::self.bank_count]
 
 
 if __name__ == '__main__':
@@ -40,7 +117,7 @@ if __name__ == '__main__':
                  'u28_800000-037a.bin']  # fast select
     
     if False:
-        memory = Memory([open(fn, 'rb').read() for fn in filenames])
+        memory = Memory.from_files(filenames)
 
         for a in range(len(memory)):
             w = memory[a]
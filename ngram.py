@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+# Instruction n-gram index for searching a corpus of 8X300/8X305 images
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from bisect import bisect_left
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from s8x30x import S8X30x
+from disassembler import load_memory, cpu_type_by_name
+
+
+# Each word of an image is normalized to a 32-bit token.  A word that
+# isn't a valid instruction is its own token.  For an instruction,
+# the immediate and jump target fields are cleared, leaving the
+# mnemonic, form and register and IV operands, and bit 16 is set.
+# Unless immediates and targets are wildcarded, the immediate is then
+# kept, and the jump target is added in bits 17 up as an offset from
+# the address of the instruction, so that relocated code has the same
+# tokens.
+class Normalizer:
+    def __init__(self, s8x30x):
+        self.s8x30x = s8x30x
+        table = s8x30x.decode_table()
+        self.form_index = table.form_index
+        self.invalid = table.INVALID
+        self.lookup = table.lookup
+        self.wild_mask = [0xffff & ~(fields.get('i', 0) | fields.get('j', 0))
+                          for fields in table.form_fields]
+        self.has_target = ['j' in fields for fields in table.form_fields]
+
+    def tokens(self, words, base = 0, wildcard = True):
+        form_index = self.form_index
+        invalid = self.invalid
+        wild_mask = self.wild_mask
+        result = array('I', bytes(4 * len(words)))
+        for i, word in enumerate(words):
+            n = form_index[word]
+            if n == invalid:
+                result[i] = word
+            elif wildcard:
+                result[i] = 0x10000 | (word & wild_mask[n])
+            elif self.has_target[n]:
+                target = self.lookup(word, base + i).j
+                result[i] = (0x10000 | (word & wild_mask[n]) |
+                             ((target - base - i) & 0x3fff) << 17)
+            else:
+                result[i] = 0x10000 | word
+        return result
+
+
+def ngram_keys(tokens, n):
+    data = tokens.tobytes()
+    size = 4 * n
+    return [zlib.crc32(data[i:i + size]) for i in range(0, len(data) - size + 1, 4)]
+
+
+# An index of the n-grams of wildcarded tokens of a set of images, for
+# finding code like a given sequence of words.  The words of each
+# image are kept, so that candidate matches can be checked exactly.
+#
+# The index is saved as a single file:
+#   header       magic, version, n, and the lengths of the following
+#   image table  JSON list of { name, files, format, cpu, digest,
+#                offset, size } for each image, padded to a multiple
+#                of 4 bytes
+#   words        words of each image, as 16-bit values, at offset
+#                words into this section
+#   keys         sorted n-gram keys, as 32-bit values
+#   starts       index of the first posting of each key, followed by
+#                the number of postings
+#   postings     image number << 16 | address, for each key
+# All numbers are native byte order.  The file is memory-mapped when
+# loaded.  Images added to a loaded index are indexed in memory, and
+# merged with the existing postings when it is saved.
+class NgramIndex:
+    magic = b'S8X30XNG'
+    version = 1
+    header = struct.Struct('<8sIIIII')
+
+    default_n = 4
+
+    def __init__(self, n = default_n):
+        self.n = n
+        self.images = []         # image table entries
+        self.words = []          # array of words of each image
+        self.removed = set()     # numbers of images to drop on save
+        self.keys = array('I')
+        self.starts = array('I', [0])
+        self.postings = array('I')
+        self.added = { }         # key -> list of postings not yet merged
+        self.__normalizers = { }
+
+    def normalizer(self, cpu):
+        if cpu not in self.__normalizers:
+            s8x30x = S8X30x(cpu_type = cpu_type_by_name(cpu), decode_table = True)
+            self.__normalizers[cpu] = Normalizer(s8x30x)
+        return self.__normalizers[cpu]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, n, table_len, key_count, posting_count = \
+            cls.header.unpack_from(mm)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError('%s is not an n-gram index of version %d' %
+                             (path, cls.version))
+        index = cls(n)
+        view = memoryview(mm)
+        offset = cls.header.size
+        index.images = json.loads(bytes(view[offset:offset + table_len]))
+        offset += table_len
+        words = sum(image['size'] for image in index.images)
+        words_view = view[offset:offset + 2 * words].cast('H')
+        index.words = [words_view[image['offset']:image['offset'] + image['size']]
+                       for image in index.images]
+        offset += 2 * words
+        offset += -offset % 4
+        index.keys = view[offset:offset + 4 * key_count].cast('I')
+        offset += 4 * key_count
+        index.starts = view[offset:offset + 4 * (key_count + 1)].cast('I')
+        offset += 4 * (key_count + 1)
+        index.postings = view[offset:offset + 4 * posting_count].cast('I')
+        return index
+
+    # Returns the number of the image of the given name, or None.
+    def find_image(self, name):
+        for i, image in enumerate(self.images):
+            if image['name'] == name and i not in self.removed:
+                return i
+        return None
+
+    # Adds an image to the index, replacing any image of the same name.
+    # Returns False if the image was already indexed with the same
+    # contents.
+    def add(self, name, files, format = 'binary', cpu = '8x300'):
+        fw = load_memory(files, format)
+        words = fw.words
+        digest = hashlib.sha256(words.tobytes()).hexdigest()
+        i = self.find_image(name)
+        if i is not None:
+            if self.images[i]['digest'] == digest and self.images[i]['cpu'] == cpu:
+                return False
+            self.removed.add(i)
+        number = len(self.images)
+        if number >= 0x10000:
+            raise ValueError('too many images')
+        self.images.append({ 'name': name, 'files': list(files),
+                             'format': format, 'cpu': cpu,
+                             'digest': digest, 'size': len(words) })
+        self.words.append(words)
+        tokens = self.normalizer(cpu).tokens(words)
+        added = self.added
+        for address, key in enumerate(ngram_keys(tokens, self.n)):
+            posting = number << 16 | address
+            l = added.get(key)
+            if l is None:
+                added[key] = [posting]
+            else:
+                l.append(posting)
+        return True
+
+    # Adds each job, as from disassembler.read_manifest() or
+    # scan_directory().  Returns the names of the images indexed.
+    def update(self, jobs):
+        return [job['name'] for job in jobs
+                if self.add(job['name'], job['files'], job['format'], job['cpu'])]
+
+    # Returns the postings of a key, from both the saved and added
+    # images, without those removed.
+    def lookup(self, key):
+        result = []
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            result = list(self.postings[self.starts[i]:self.starts[i + 1]])
+        result += self.added.get(key, [])
+        if self.removed:
+            result = [p for p in result if p >> 16 not in self.removed]
+        return result
+
+    # Returns a list of (image name, address) of sequences like the
+    # given words.  With wildcard true, immediates and jump targets
+    # may differ; otherwise only their absolute position may.  The
+    # candidates are the addresses at which the pattern's rarest
+    # n-gram occurs, and each is checked against the image's words.
+    def search(self, words, cpu = '8x300', base = 0, wildcard = True):
+        if len(words) < self.n:
+            raise ValueError('pattern shorter than %d words' % self.n)
+        normalizer = self.normalizer(cpu)
+        pattern = normalizer.tokens(words, base, wildcard)
+        if wildcard:
+            coarse = pattern
+        else:
+            coarse = normalizer.tokens(words, base)
+        keys = ngram_keys(coarse, self.n)
+        best = None
+        for offset, key in enumerate(keys):
+            postings = self.lookup(key)
+            if best is None or len(postings) < len(best[1]):
+                best = (offset, postings)
+            if not postings:
+                return []
+        offset, postings = best
+        matches = []
+        for posting in postings:
+            number = posting >> 16
+            start = (posting & 0xffff) - offset
+            image = self.images[number]
+            if start < 0 or start + len(words) > image['size']:
+                continue
+            if image['cpu'] == cpu:
+                image_normalizer = normalizer
+            else:
+                image_normalizer = self.normalizer(image['cpu'])
+            candidate = self.words[number][start:start + len(words)]
+            if image_normalizer.tokens(candidate, start, wildcard) == pattern:
+                matches.append((image['name'], start))
+        return sorted(matches)
+
+    def save(self, path):
+        keep = [i for i in range(len(self.images)) if i not in self.removed]
+        renumber = { old: new for new, old in enumerate(keep) }
+        images = []
+        offset = 0
+        for i in keep:
+            image = dict(self.images[i])
+            image['offset'] = offset
+            offset += image['size']
+            images.append(image)
+
+        merged = { }
+        for i, key in enumerate(self.keys):
+            merged[key] = list(self.postings[self.starts[i]:self.starts[i + 1]])
+        for key, postings in self.added.items():
+            merged.setdefault(key, []).extend(postings)
+        keys = array('I', sorted(merged))
+        starts = array('I', [0])
+        postings = array('I')
+        for key in keys:
+            for p in merged[key]:
+                if p >> 16 in renumber:
+                    postings.append(renumber[p >> 16] << 16 | (p & 0xffff))
+            starts.append(len(postings))
+
+        table = json.dumps(images).encode('utf-8')
+        table += b' ' * (-len(table) % 4)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.version, self.n,
+                                     len(table), len(keys), len(postings)))
+            f.write(table)
+            for i in keep:
+                f.write(self.words[i])
+            f.write(bytes(-(2 * offset) % 4))
+            f.write(keys.tobytes())
+            f.write(starts.tobytes())
+            f.write(postings.tobytes())
+        os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import time
+
+    from disassembler import read_manifest, scan_directory
+
+    parser = argparse.ArgumentParser(description = 'Instruction n-gram index of Signetics 8X300/8X305 firmware')
+    parser.add_argument('--hex', action='store_const', dest='inputformat',
+                        const='hex', default='binary',
+                        help = 'input file format is Intel hex')
+    parser.add_argument('-5', '--8x305', action='store_const', dest='cpu',
+                        const='8x305', default='8x300',
+                        help = '8X305 processor')
+    subparsers = parser.add_subparsers(dest = 'command')
+
+    build_parser = subparsers.add_parser('build', help = 'create or update an index')
+    build_parser.add_argument('-n', type=int, default = NgramIndex.default_n,
+                              help = 'n-gram length for a new index (default %(default)d)')
+    build_parser.add_argument('index', help = 'index file')
+    build_parser.add_argument('path', help = 'JSON manifest, or directory of ROM set subdirectories')
+
+    search_parser = subparsers.add_parser('search', help = 'find code like a range of an image')
+    search_parser.add_argument('-x', '--exact', action='store_true',
+                               help = 'immediates and jump targets must also match')
+    search_parser.add_argument('index', help = 'index file')
+    search_parser.add_argument('range', help = 'address range of the pattern, as START-END in hexadecimal')
+    search_parser.add_argument('input', nargs = '+',
+                               help = 'input files of the image containing the pattern')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if os.path.exists(args.index):
+            index = NgramIndex.load(args.index)
+        else:
+            index = NgramIndex(args.n)
+        defaults = { 'format': args.inputformat, 'cpu': args.cpu }
+        if os.path.isdir(args.path):
+            jobs = scan_directory(args.path, defaults)
+        else:
+            jobs = read_manifest(args.path, defaults)
+        names = index.update(jobs)
+        if names or not os.path.exists(args.index):
+            index.save(args.index)
+        print('%d images indexed' % len(names))
+    elif args.command == 'search':
+        index = NgramIndex.load(args.index)
+        start, end = (int(a, 16) for a in args.range.split('-'))
+        fw = load_memory(args.input, args.inputformat)
+        t = time.perf_counter()
+        matches = index.search(fw.words[start:end + 1], args.cpu, start,
+                               wildcard = not args.exact)
+        t = time.perf_counter() - t
+        for name, address in matches:
+            print('%-20s %04x' % (name, address))
+        print('%d matches in %.1f ms' % (len(matches), t * 1000), file = sys.stderr)
+    else:
+        parser.print_help()
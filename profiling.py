@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# Phase timing, counters and profiling support for s8x30x tools
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+from contextlib import contextmanager
+import sys
+import time
+
+
+# Records the wall time of each named phase of a run, in the order the
+# phases are run.  A phase that is run more than once accumulates.
+class PhaseTimer:
+    def __init__(self):
+        self.phases = { }
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (self.phases.get(name, 0.0) +
+                                 time.perf_counter() - t0)
+
+    def report(self, f = sys.stderr):
+        total = sum(self.phases.values())
+        f.write('%-20s %10s %6s\n' % ('phase', 'ms', '%'))
+        for name, seconds in self.phases.items():
+            f.write('%-20s %10.3f %6.1f\n' % (name, seconds * 1000,
+                                              100 * seconds / (total or 1)))
+        f.write('%-20s %10.3f\n' % ('total', total * 1000))
+
+
+# Samples the Python stack of the main thread at intervals of CPU
+# time, counting each distinct stack.  The counts are written in the
+# "folded" format (frames separated by semicolons, root first,
+# followed by the count) read by flamegraph.pl, speedscope and
+# similar tools.  The signal module is only imported when sampling is
+# started, as it takes longer to import than most of a short run of a
+# tool that only uses PhaseTimer.
+class StackSampler:
+    def __init__(self, interval = 0.001):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def __sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (code.co_name, code.co_filename,
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        import signal
+        self.previous = signal.signal(signal.SIGPROF, self.__sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        import signal
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def write(self, f):
+        for stack, count in sorted(self.stacks.items()):
+            f.write('%s %d\n' % (stack, count))
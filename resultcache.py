@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+# Content-addressed cache of disassembly results
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+from s8x30x import default_cache_dir
+
+
+# Results are stored one per file, named by the SHA-256 hash of
+# everything they depend on, so an entry never has to be invalidated;
+# a change to any input just results in a different key.  Each hit
+# updates the modification time of the file, and when the total size
+# of the cache exceeds max_bytes, the least recently used entries are
+# removed, down to low_water of max_bytes.  The directory is only
+# scanned for the first put and for eviction, with the size kept as a
+# running total otherwise, which may drift when several processes
+# share the cache; it's corrected by each scan.
+class ResultCache:
+    version = 1
+
+    default_max_bytes = 256 << 20
+
+    low_water = 0.9
+
+    def __init__(self, directory, max_bytes = default_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.__total = None
+
+    # Returns a cache in the results subdirectory of the default cache
+    # directory, or None if caching is disabled.
+    @classmethod
+    def default(cls, max_bytes = default_max_bytes):
+        directory = default_cache_dir()
+        if directory is None:
+            return None
+        return cls(os.path.join(directory, 'results'), max_bytes)
+
+    # Each part is bytes-like (hashed as is) or any other value (hashed
+    # as its repr()).
+    def key(self, *parts):
+        h = hashlib.sha256()
+        h.update(repr(('ResultCache', self.version)).encode('ascii'))
+        for part in parts:
+            if not isinstance(part, (bytes, bytearray, memoryview)):
+                part = repr(part).encode('utf-8')
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        writer = self.writer(key)
+        writer.write(data)
+        writer.commit()
+
+    # Returns a CacheWriter for the entry of the key, so that an entry
+    # can be stored a piece at a time rather than all at once.
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    # Called by CacheWriter once an entry of size bytes is stored.
+    def stored(self, size):
+        if self.__total is None:
+            self.__total = sum(size for mtime, size, path in self.entries())
+        else:
+            self.__total += size
+        if self.__total > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        entries = []
+        try:
+            subdirs = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for subdir in subdirs:
+            subdir = os.path.join(self.directory, subdir)
+            try:
+                names = os.listdir(subdir)
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # removed by another process
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        if total > self.max_bytes:
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes * self.low_water:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        self.__total = total
+
+
+# Writes a cache entry to a temporary file, which is renamed into place
+# by commit(), or removed by abort().  Errors writing the file abandon
+# the entry rather than raising, since the cache is only an
+# optimization, as does writing more than the maximum size of the
+# cache, since the entry would only be evicted.
+class CacheWriter:
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.path = cache.path(key)
+        self.tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        self.size = 0
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            self.f = open(self.tmp_path, 'wb')
+        except OSError:
+            self.f = None
+
+    def write(self, data):
+        if self.f is None:
+            return
+        try:
+            self.f.write(data)
+        except OSError:
+            self.abort()
+            return
+        self.size += len(data)
+        if self.size > self.cache.max_bytes:
+            self.abort()
+
+    def commit(self):
+        if self.f is None:
+            return
+        try:
+            self.f.close()
+            os.replace(self.tmp_path, self.path)
+        except OSError:
+            self.abort()
+            return
+        self.f = None
+        self.cache.stored(self.size)
+
+    def abort(self):
+        if self.f is None:
+            return
+        try:
+            self.f.close()
+        except OSError:
+            pass
+        self.f = None
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
@@ -14,7 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from collections.abc import Mapping
 from enum import Enum, IntEnum
+import hashlib
+import mmap
+import os
+import struct
+import sys
 
 CpuType = Enum('CpuType', ['s8x300', 's8x305'])
 
@@ -38,6 +45,16 @@ class InternalError(Exception):
     pass
 
 
+# Directory for cache files, from $S8X30X_CACHE_DIR if set (an empty
+# value disables caching), otherwise under the XDG cache directory.
+def default_cache_dir():
+    path = os.environ.get('S8X30X_CACHE_DIR')
+    if path is not None:
+        return path or None
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 's8x30x')
+
+
 class Reg(IntEnum):
     aux  = 0o00;  r0  = 0o00
     r1   = 0o01
@@ -73,7 +90,7 @@ class Reg(IntEnum):
     riv7 = 0o37
 
     def is_iv(self, cpu_type = CpuType.s8x300):
-        return self >= self.__class__.liv0
+        return self.value in iv_regs
 
     def rightmost_liv_bit(self, cpu_type = CpuType.s8x300):
         if not self.is_iv(cpu_type):
@@ -81,23 +98,35 @@ class Reg(IntEnum):
         return 7 - (self.value & 7)
 
     def is_src_reg(self, cpu_type = CpuType.s8x300):
-        c = self.__class__
-        if self.is_iv(cpu_type):
-            return False
-        if self < c.ivl or self is c.ovf or self is c.r11:
-            return True;
-        return cpu_type is CpuType.s8x305
+        return self.value in src_regs[cpu_type]
 
     def is_dest_reg(self, cpu_type = CpuType.s8x300):
-        c = self.__class__
-        if self.is_iv(cpu_type):
-            return False
-        if self is c.ovf:
-            return False
-        if self <= c.r11 or self is c.ivr:
-            return True;
-        return cpu_type is CpuType.s8x305
-        
+        return self.value in dest_regs[cpu_type]
+
+
+# Register numbers and classes as plain integers, for code that tests
+# registers for every instruction, as each use of a Reg member or
+# method goes through the enum machinery.  The 8X305 can use all
+# sixteen registers as source and destination other than OVF (r10) as
+# a destination; the 8X300 has only r0-r6, OVF and r11 as sources, and
+# r0-r11 other than OVF, and IVR, as destinations.
+reg_aux  = 0o00
+reg_ivl  = 0o07
+reg_ovf  = 0o10
+reg_ivr  = 0o17
+reg_liv0 = 0o20
+reg_riv0 = 0o30
+
+iv_regs = frozenset(range(reg_liv0, 0o40))
+
+src_regs  = { CpuType.s8x300: frozenset(list(range(reg_aux, reg_ivl)) +
+                                        [reg_ovf, 0o11]),
+              CpuType.s8x305: frozenset(range(reg_aux, reg_liv0)) }
+
+dest_regs = { CpuType.s8x300: frozenset(list(range(reg_aux, 0o12)) +
+                                        [reg_ivr]) - { reg_ovf },
+              CpuType.s8x305: frozenset(range(reg_aux, reg_liv0)) - { reg_ovf } }
+
 
 # operand type
 # defined outside the I89 class and with very short name because
@@ -121,6 +150,7 @@ class BitField:
     def __init__(self, byte_count = 0):
         self.width = 0  # width of the field within the instruction
         self.mask = bytearray(byte_count)
+        self.__runs = None
 
     def __repr__(self):
         return 'BitField(width = %d, mask = %s' % (self.width, str(self.mask))
@@ -128,19 +158,42 @@ class BitField:
     def append(self, mask_byte):
         self.mask.append(mask_byte)
         self.width += bit_count(mask_byte)
+        self.__runs = None
 
     def pad_length(self, length):
         if len(self.mask) < length:
             self.mask += bytearray(length - len(self.mask))
+        self.__runs = None
+
+    # The field as a list of (value shift, value mask, position) runs
+    # of contiguous bits, so that a value can be inserted into an
+    # instruction (as an integer) a run at a time rather than a bit at
+    # a time.  The most significant bit of the value goes in the
+    # leftmost bit of the mask, as extracted by S8X30x.form_search().
+    def runs(self):
+        if self.__runs is None:
+            mask = int.from_bytes(self.mask, 'big')
+            self.__runs = []
+            shift = 0
+            pos = 0
+            while mask >> pos:
+                if not (mask >> pos) & 1:
+                    pos += 1
+                    continue
+                width = 0
+                while (mask >> (pos + width)) & 1:
+                    width += 1
+                self.__runs.append((shift, (1 << width) - 1, pos))
+                shift += width
+                pos += width
+        return self.__runs
 
     def insert(self, bits, value):
         assert isinstance(value, int)
-        for i in range(len(bits)):
-            for b in [1 << j for j in range(8)]:
-                if self.mask[i] & b:
-                    if value & 1:
-                        bits[i] |= b
-                    value >>= 1
+        v = int.from_bytes(bits, 'big')
+        for shift, mask, pos in self.runs():
+            v |= ((value >> shift) & mask) << pos
+        bits[:] = v.to_bytes(len(bits), 'big')
         #assert value == 0  # XXX causes negative 8-bit immediates to fail
         
 
@@ -201,17 +254,39 @@ class Form:
     def __init__(self, encoding, operands):
         self.operands = operands
         self.encoding = encoding
-        self.bits, self.mask, self.fields = Form.__encoding_parse(encoding)
+        self.__inserts = None
+
+    # The encoding is parsed into bits, mask and fields the first time
+    # any of them is used, by the assembler or to build a decode table,
+    # so that importing the module and disassembling with a cached
+    # decode table don't parse every form.
+    def __getattr__(self, name):
+        if name not in ('bits', 'mask', 'fields'):
+            raise AttributeError(name)
+        self.bits, self.mask, self.fields = Form.__encoding_parse(self.encoding)
+        return getattr(self, name)
 
     def __len__(self):
         return len(self.bits)
 
     def insert_fields(self, fields):
-        bits = bytearray(self.bits)
+        return bytearray(self.encode(fields).to_bytes(len(self.bits), 'big'))
+
+    # As insert_fields(), but returns the instruction as an integer.
+    # The fixed bits and the field runs are combined into one list the
+    # first time, so encoding is a few shifts and masks per field.
+    def encode(self, fields):
+        if self.__inserts is None:
+            self.__opcode = int.from_bytes(self.bits, 'big')
+            self.__inserts = [(k, bitfield.runs())
+                              for k, bitfield in self.fields.items()]
         assert set(self.fields.keys()) == set(fields.keys())
-        for k, bitfield in self.fields.items():
-            bitfield.insert(bits, fields[k])
-        return bits
+        v = self.__opcode
+        for k, runs in self.__inserts:
+            value = fields[k]
+            for shift, mask, pos in runs:
+                v |= ((value >> shift) & mask) << pos
+        return v
         
 
 
@@ -223,6 +298,349 @@ class Inst:
         self.forms = forms
 
 
+# A decoded instruction.  The values of the instruction's fields are
+# attributes named by field letter, None for fields its form doesn't
+# have, with the jump target j already relocated to the page of the
+# instruction.  form_number is the index of the form in the decode
+# table, if decoded by one, and ext is the fast I/O select byte, if
+# known.  The text of the instruction is only rendered when text() is
+# called.
+#
+# For code written for the dictionaries of fields returned before
+# there was a decode table, a decoded instruction is also a read-only
+# Mapping of the letters of the fields it has to their values, so
+# that keys(), items(), iteration and len() work as they did, and
+# copy() returns a dictionary.  Unlike a Mapping, two decoded
+# instructions are equal only if the rest of the instruction is too.
+class DecodedInst(Mapping):
+    __slots__ = ('inst', 'form', 'form_number', 'word', 'pc', 'ext',
+                 's', 'd', 'r', 'l', 'i', 'j')
+
+    letters = ('s', 'd', 'r', 'l', 'i', 'j')
+
+    def __init__(self, inst, form, form_number, word, pc, ext = None,
+                 s = None, d = None, r = None, l = None, i = None, j = None):
+        self.inst = inst
+        self.form = form
+        self.form_number = form_number
+        self.word = word
+        self.pc = pc
+        self.ext = ext
+        self.s = s
+        self.d = d
+        self.r = r
+        self.l = l
+        self.i = i
+        self.j = j
+
+    @classmethod
+    def from_fields(cls, inst, form, fields, word = None, pc = None,
+                    ext = None):
+        return cls(inst, form, None, word, pc, ext, **fields)
+
+    def __repr__(self):
+        return 'DecodedInst(%s %s)' % (self.inst.mnem, self.fields)
+
+    # Equal if the same instruction at the same address, however it
+    # was decoded.
+    def __key(self):
+        return (self.inst, self.form, self.word, self.pc, self.ext,
+                self.s, self.d, self.r, self.l, self.i, self.j)
+
+    def __eq__(self, other):
+        if not isinstance(other, DecodedInst):
+            return NotImplemented
+        return self.__key() == other.__key()
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    @property
+    def fields(self):
+        fields = { }
+        for f in self.letters:
+            v = getattr(self, f)
+            if v is not None:
+                fields[f] = v
+        return fields
+
+    def __getitem__(self, f):
+        v = getattr(self, f) if f in self.letters else None
+        if v is None:
+            raise KeyError(f)
+        return v
+
+    def __contains__(self, f):
+        return f in self.letters and getattr(self, f) is not None
+
+    def __iter__(self):
+        for f in self.letters:
+            if getattr(self, f) is not None:
+                yield f
+
+    def __len__(self):
+        return sum(getattr(self, f) is not None for f in self.letters)
+
+    def get(self, f, default = None):
+        v = getattr(self, f) if f in self.letters else None
+        return default if v is None else v
+
+    def copy(self):
+        return self.fields
+
+    # Render as mnemonic and operand strings.  src_name and dst_name,
+    # if given, replace the generic names of the I/O operands returned
+    # by S8X30x.io_operands().
+    def text(self, symtab_by_value = {}, disassemble_operands = True,
+             src_name = None, dst_name = None):
+        mnem = self.inst.mnem
+        s = mnem_text.get(mnem)
+        if s is None:
+            s = mnem_text.setdefault(mnem, '%-6s' % mnem)
+        if not disassemble_operands:
+            return s, ''
+        operands = []
+        for operand in self.form.operands:
+            if operand is OT.blen or operand is OT.brot:
+                continue
+            elif operand is OT.sr:
+                value = reg_text[self.s] + rot_text[self.r or 0]
+            elif operand is OT.siv:
+                r = self.s
+                l = self.l
+                if l is None:
+                    l = 8 - (7 - (r & 7))
+                value = ((src_name or siv_text[r >> 3 & 1]) +
+                         iv_subscript[r & 7][l])
+            elif operand is OT.dr:
+                value = reg_text[self.d]
+                if dst_name and value in ('ivl', 'ivr'):
+                    value = dst_name
+            elif operand is OT.div:
+                r = self.d
+                l = self.l
+                if l is None:
+                    l = 8 - (7 - (r & 7))
+                value = ((dst_name or div_text[r >> 3 & 1]) +
+                         iv_subscript[r & 7][l])
+            elif operand is OT.imm:
+                value = ihex_text[self.i]
+            elif operand is OT.jmp5 or operand is OT.jmp8 or operand is OT.jmp13:
+                target = self.j
+                if target in symtab_by_value:
+                    value = symtab_by_value[target]
+                else:
+                    value = S8X30x.ihex(target)
+            else:
+                raise NotImplementedError('operand type ' + operand)
+            operands.append(value)
+        return s, ','.join(operands)
+
+
+# Decode results for all 65536 possible instruction words of one CPU
+# type.  Each word maps to an index into a list of (inst, form) pairs,
+# or to INVALID.  The extracted field values are kept in one array
+# per field letter; jump target fields are stored relative to page
+# zero and relocated to the page of the instruction by lookup().
+#
+# A built table can be saved to a cache file, which is later loaded
+# by memory-mapping it rather than by rebuilding the table.
+class DecodeTable:
+    INVALID = 0xff
+
+    field_types = { 's': 'B', 'd': 'B', 'r': 'B', 'l': 'B', 'i': 'B',
+                    'j': 'H' }
+
+    # mask applied to the instruction address to get the page base
+    # added to the jump target field
+    page_mask = { OT.jmp5: 0xffe0, OT.jmp8: 0xff00, OT.jmp13: 0 }
+
+    cache_magic = b'S8X30XDT'
+    cache_version = 1
+    cache_header = struct.Struct('<8sI32sHH')
+
+    # form_fields, if given, is a list with an entry for each form of
+    # the instruction set, each a dictionary of field letters to
+    # 16-bit field masks.  form_index and fields, if given, are the
+    # form index and the dictionary of field arrays, used instead of
+    # allocating empty ones.  They are given when loading from a cache
+    # file, so that the forms don't have to be examined and the arrays
+    # aren't allocated only to be replaced.
+    def __init__(self, inst_set, form_fields = None, form_index = None,
+                 fields = None):
+        if form_fields is None:
+            form_fields = [{ f: int.from_bytes(bf.mask, 'big')
+                             for f, bf in form.fields.items() }
+                           for inst in inst_set for form in inst.forms]
+        self.form_fields = form_fields
+        self.forms = []
+        for inst in inst_set:
+            for form in inst.forms:
+                page_mask = 0
+                for operand in form.operands:
+                    page_mask = self.page_mask.get(operand, page_mask)
+                letters = tuple(form_fields[len(self.forms)])
+                self.forms.append((inst, form, letters, page_mask))
+        assert len(self.forms) < self.INVALID
+        if form_index is None:
+            form_index = array('B', bytes([self.INVALID]) * 65536)
+        if fields is None:
+            fields = { f: array(t, [0]) * 65536
+                       for f, t in self.field_types.items() }
+        self.form_index = form_index
+        self.fields = fields
+        self.__form_arrays = None
+
+    def build(self, inst_search):
+        form_number = { id(form): n for n, (inst, form, letters, page_mask)
+                        in enumerate(self.forms) }
+        for word in range(65536):
+            try:
+                inst, form, fields = inst_search([(word >> 8, word & 0xff)], 0)
+            except BadInstruction:
+                continue
+            self.form_index[word] = form_number[id(form)]
+            for f, v in fields.items():
+                self.fields[f][word] = v
+
+    def valid(self, word):
+        return self.form_index[word] != self.INVALID
+
+    # For each form, the field array of each of DecodedInst.letters,
+    # or None for the fields the form doesn't have.
+    def form_arrays(self):
+        if self.__form_arrays is None:
+            self.__form_arrays = [tuple(self.fields[f] if f in letters else None
+                                        for f in DecodedInst.letters)
+                                  for inst, form, letters, page_mask in self.forms]
+        return self.__form_arrays
+
+    def lookup(self, word, pc, ext = None):
+        n = self.form_index[word]
+        if n == self.INVALID:
+            raise BadInstruction(word >> 13)
+        inst, form, letters, page_mask = self.forms[n]
+        s, d, r, l, i, j = self.form_arrays()[n]
+        if j is not None:
+            j = j[word] + (pc & page_mask)
+        return DecodedInst(inst, form, n, word, pc, ext,
+                           None if s is None else s[word],
+                           None if d is None else d[word],
+                           None if r is None else r[word],
+                           None if l is None else l[word],
+                           None if i is None else i[word],
+                           j)
+
+    # Cache file layout: header, form field masks, padding to a multiple
+    # of eight bytes, then the form index and the field arrays in
+    # field_types order, all in native byte order.
+    def save(self, path, signature):
+        forms = bytearray()
+        for fields in self.form_fields:
+            forms.append(len(fields))
+            for f, mask in fields.items():
+                forms += struct.pack('<cH', f.encode('ascii'), mask)
+        header_len = self.cache_header.size + len(forms)
+        header_len += -header_len % 8
+        header = self.cache_header.pack(self.cache_magic, self.cache_version,
+                                        signature, len(self.form_fields),
+                                        header_len)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(forms)
+                f.write(bytes(header_len - len(header) - len(forms)))
+                f.write(self.form_index.tobytes())
+                for f_name in self.field_types:
+                    f.write(self.fields[f_name].tobytes())
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # Returns None if the file doesn't exist, doesn't match the
+    # signature of the instruction set, or is truncated or otherwise
+    # damaged, so that the table is built again.
+    @classmethod
+    def load(cls, path, inst_set, signature):
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mm) < cls.cache_header.size:
+            return None
+        magic, version, file_signature, form_count, header_len = \
+            cls.cache_header.unpack_from(mm)
+        if (magic != cls.cache_magic or version != cls.cache_version or
+            file_signature != signature):
+            return None
+        data_len = 65536 * sum(array(t).itemsize
+                               for t in cls.field_types.values())
+        if len(mm) != header_len + 65536 + data_len:
+            return None
+        try:
+            form_fields = cls.__load_form_fields(mm, form_count, header_len)
+        except (struct.error, IndexError, UnicodeDecodeError):
+            return None
+        if len(form_fields) != sum(len(inst.forms) for inst in inst_set):
+            return None
+        view = memoryview(mm)
+        offset = header_len
+        form_index = view[offset:offset + 65536]
+        offset += 65536
+        fields = { }
+        for f, t in cls.field_types.items():
+            size = 65536 * array(t).itemsize
+            fields[f] = view[offset:offset + size].cast(t)
+            offset += size
+        return cls(inst_set, form_fields, form_index, fields)
+
+    # The form field masks of a cache file, which must lie within its
+    # header.
+    @classmethod
+    def __load_form_fields(cls, mm, form_count, header_len):
+        form_fields = []
+        offset = cls.cache_header.size
+        for i in range(form_count):
+            fields = { }
+            count = mm[offset]
+            for j in range(count):
+                f, mask = struct.unpack_from('<cH', mm, offset + 1 + 3 * j)
+                fields[f.decode('ascii')] = mask
+            offset += 1 + 3 * count
+            if offset > header_len:
+                raise IndexError('form field masks overrun the header')
+            form_fields.append(fields)
+        return form_fields
+
+
+# Operand text used by DecodedInst.text(), precomputed so that
+# rendering an operand is mostly indexing.  iv_subscript[r & 7][l] is
+# the bit range subscript of an IV operand register r with length
+# field l (zero for eight bits).
+def _iv_subscript(reg, l):
+    rb = 7 - reg
+    lb = rb + (l or 8) - 1
+    if rb == 0 and lb == 7:
+        return ''
+    if rb == lb:
+        return '[%d]' % lb
+    return '[%d:%d]' % (lb, rb)
+
+reg_text     = [Reg(v).name for v in range(32)]
+rot_text     = [''] + ['>>>%d' % r for r in range(1, 8)]
+siv_text     = ['s' + reg_text[reg_liv0][:3], 's' + reg_text[reg_riv0][:3]]
+div_text     = ['d' + reg_text[reg_liv0][:3], 'd' + reg_text[reg_riv0][:3]]
+iv_subscript = [[_iv_subscript(reg, l) for l in range(9)] for reg in range(8)]
+ihex_text    = [('0%xh' if '%x' % v >= 'a' else '%xh') % v for v in range(256)]
+mnem_text    = { }
+
+
 class S8X30x:
     # The source operand precedes the destination operand
     __inst_set = [
@@ -271,11 +689,17 @@ class S8X30x:
             assert inst.mnem not in self.__inst_by_mnemonic
             self.__inst_by_mnemonic[inst.mnem] = inst
             form = inst.forms[0]  # assumes all forms of an inst have same opcode
-            opcode = form.bits[0] >> 5
+            opcode = int(form.encoding[:3], 2)
             if opcode not in self.__inst_by_opcode:
                 self.__inst_by_opcode[opcode] = []
             self.__inst_by_opcode[opcode] += [inst]
 
+    def inst_by_mnemonic(self, mnem):
+        try:
+            return self.__inst_by_mnemonic[mnem]
+        except KeyError:
+            raise UnknownMnemonic(mnem)
+
     def _opcode_table_print(self):
         for mnem in sorted(self.__inst_by_mnemonic.keys()):
             inst = self.__inst_by_mnemonic[mnem]
@@ -312,16 +736,16 @@ class S8X30x:
             for f in form.fields:
                 fields[f] = self.__extract_field(opcode, form.fields, f)
             if 's' in fields:
-                sr = Reg(fields['s'])
-                if OT.sr in form.operands and not sr.is_src_reg(self.cpu_type):
+                sr = fields['s']
+                if OT.sr in form.operands and sr not in src_regs[self.cpu_type]:
                     continue
-                elif OT.siv in form.operands and not sr.is_iv(self.cpu_type):
+                elif OT.siv in form.operands and sr not in iv_regs:
                     continue
             if 'd' in fields:
-                dr = Reg(fields['d'])
-                if OT.dr in form.operands and not dr.is_dest_reg(self.cpu_type):
+                dr = fields['d']
+                if OT.dr in form.operands and dr not in dest_regs[self.cpu_type]:
                     continue
-                elif OT.div in form.operands and not dr.is_iv(self.cpu_type):
+                elif OT.div in form.operands and dr not in iv_regs:
                     continue
             if 'j' in fields:
                 if OT.jmp8 in form.operands:
@@ -334,7 +758,7 @@ class S8X30x:
         return None, None
 
 
-    def inst_search(self, fw, pc):
+    def __inst_search_forms(self, fw, pc):
         opcode = fw[pc][0] >> 5
         for inst in self.__inst_by_opcode[opcode]:
             form, fields = self.form_search(fw, pc, inst)
@@ -342,6 +766,86 @@ class S8X30x:
                 return inst, form, fields
         raise BadInstruction(opcode)
 
+    # Returns a DecodedInst, or raises BadInstruction.
+    def inst_search(self, fw, pc):
+        word = fw[pc]
+        if self.decode_table_enabled:
+            return self.decode_table().lookup((word[0] << 8) | word[1], pc)
+        inst, form, fields = self.__inst_search_forms(fw, pc)
+        return DecodedInst.from_fields(inst, form, fields,
+                                       (word[0] << 8) | word[1], pc)
+
+    # Decode tables are built on first use, and shared by all instances
+    # for the same CPU type.  If decode_table_cache_dir is not None,
+    # built tables are saved there and loaded by later runs.
+    __decode_tables = { }
+
+    decode_table_cache_dir = default_cache_dir()
+
+    # The signature changes whenever the instruction set definition
+    # does, including the registers valid as operands, which decide
+    # which words decode as valid instructions, so cache files built
+    # from an older definition aren't used.
+    @classmethod
+    def inst_set_signature(cls, cpu_type):
+        desc = [DecodeTable.cache_version, cpu_type.name, sys.byteorder,
+                sorted(src_regs[cpu_type]), sorted(dest_regs[cpu_type]),
+                sorted(iv_regs)]
+        for inst in cls.__inst_set:
+            desc.append((inst.mnem,
+                         [(form.encoding, [o.name for o in form.operands])
+                          for form in inst.forms]))
+        return hashlib.sha256(repr(desc).encode('ascii')).digest()
+
+    def decode_table_cache_path(self, signature):
+        if self.decode_table_cache_dir is None:
+            return None
+        return os.path.join(self.decode_table_cache_dir,
+                            'decode-%s-%s.bin' % (self.cpu_type.name,
+                                                  signature.hex()[:16]))
+
+    def decode_table(self):
+        table = self.__decode_tables.get(self.cpu_type)
+        if table is not None:
+            return table
+        signature = self.inst_set_signature(self.cpu_type)
+        path = self.decode_table_cache_path(signature)
+        if path is not None:
+            table = DecodeTable.load(path, self.__inst_set, signature)
+        if table is None:
+            table = DecodeTable(self.__inst_set)
+            table.build(self.__inst_search_forms)
+            if path is not None:
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok = True)
+                    table.save(path, signature)
+                except OSError:
+                    pass  # the cache is only an optimization
+        self.__decode_tables[self.cpu_type] = table
+        return table
+
+    # Decode every word of an image, returning a list indexed by
+    # (address - base) of DecodedInst, or None for words that are not
+    # valid instructions.
+    def decode_image(self, fw, base = 0):
+        return self.decode_words([(fw[pc][0] << 8) | fw[pc][1]
+                                  for pc in range(base, base + len(fw))],
+                                 base)
+
+    # As decode_image(), for a sequence of 16-bit opcodes starting at
+    # address base, and optionally a sequence of the fast I/O select
+    # bytes of each.
+    def decode_words(self, words, base = 0, ext = None):
+        table = self.decode_table()
+        form_index = table.form_index
+        invalid = table.INVALID
+        lookup = table.lookup
+        if ext is None:
+            return [None if form_index[word] == invalid else lookup(word, pc)
+                    for pc, word in enumerate(words, base)]
+        return [None if form_index[word] == invalid else lookup(word, pc, e)
+                for pc, (word, e) in enumerate(zip(words, ext), base)]
+
     @staticmethod
     def ihex(v):
         s = '%xh' % v
@@ -350,91 +854,52 @@ class S8X30x:
         return s
 
 
+    # Returns the mnemonic and operand strings and the DecodedInst, or
+    # an empty dictionary of fields in its place for an invalid
+    # instruction.
     def disassemble_inst(self, fw, pc, symtab_by_value = {}, disassemble_operands = True):
         try:
-            inst, form, fields = self.inst_search(fw, pc)
+            d = self.inst_search(fw, pc)
         except BadInstruction:
-            return 'dw      ', '%s' % self.ihex((fw[pc][0] << 8) + fw[pc][1]), {}
+            return self.format_bad_inst((fw[pc][0] << 8) + fw[pc][1]) + ({},)
+        return d.text(symtab_by_value, disassemble_operands) + (d,)
 
-        s = '%-6s' % inst.mnem
-        operands = []
 
-        if disassemble_operands:
-            ftemp = fields.copy()
-            blen_used = False
-            for operand in form.operands:
-                if operand == OT.blen or operand == OT.brot:
-                    continue
-                elif operand == OT.sr:
-                    value = Reg(ftemp['s']).name
-                    del ftemp['s']
-                    if 'r' in ftemp:
-                        brot = ftemp['r']
-                        del ftemp['r']
-                        if brot != 0:
-                            value += '>>>%d' % brot
-                elif operand == OT.siv:
-                    r = Reg(ftemp['s'])
-                    del ftemp['s']
-                    blen_used = True
-                    rb = r.rightmost_liv_bit()
-                    if 'l' in ftemp:
-                        l = ftemp['l']
-                        if l == 0:
-                            l = 8
-                        lb = rb + l - 1
-                    else:
-                        lb = 7
-                    value = 's' + r.name[:3]
-                    if rb != 0 or lb != 7:
-                        if rb == lb:
-                            value += '[%d]' % lb
-                        else:
-                            value += '[%d:%d]' % (lb, rb)
-                elif operand == OT.dr:
-                    value = Reg(ftemp['d']).name
-                    del ftemp['d']
-                elif operand == OT.div:
-                    r = Reg(ftemp['d'])
-                    del ftemp['d']
-                    blen_used = True
-                    rb = r.rightmost_liv_bit()
-                    if 'l' in ftemp:
-                        l = ftemp['l']
-                        if l == 0:
-                            l = 8
-                        lb = rb + l - 1
-                    else:
-                        lb = 7
-                    value = 'd' + r.name[:3]
-                    if rb != 0 or lb != 7:
-                        if rb == lb:
-                            value += '[%d]' % lb
-                        else:
-                            value += '[%d:%d]' % (lb, rb)
-                elif operand == OT.imm:
-                    value = self.ihex(ftemp['i'])
-                    del ftemp['i']
-                elif operand in [OT.jmp5, OT.jmp8, OT.jmp13]:
-                    target = ftemp['j']
-                    del ftemp['j']
-                    if target in symtab_by_value:
-                        value = symtab_by_value[target]
-                    else:
-                        value = self.ihex(target)
-                else:
-                    raise NotImplementedError('operand type ' + operand)
-                operands.append(value)
-            if blen_used:
-                del ftemp['l']
-            if ftemp:
-                raise NotImplementedError('leftover fields: ' + str(ftemp))
+    def format_bad_inst(self, word):
+        return 'dw      ', '%s' % self.ihex(word)
 
-        return s, ','.join(operands), fields
 
-
-    def __init__(self, cpu_type = CpuType.s8x300):
+    # Returns the generic names of the I/O operands of a decoded
+    # instruction, as a tuple of the source ('sliv', 'sriv' or None)
+    # and destination ('dliv', 'driv', 'ivl', 'ivr' or None).
+    @staticmethod
+    def io_operands(form, fields):
+        src = dst = None
+        if OT.siv in form.operands:
+            src = 'sriv' if fields['s'] & 0o10 else 'sliv'
+        if OT.div in form.operands:
+            dst = 'driv' if fields['d'] & 0o10 else 'dliv'
+        elif OT.dr in form.operands:
+            if fields['d'] == reg_ivl:
+                dst = 'ivl'
+            elif fields['d'] == reg_ivr:
+                dst = 'ivr'
+        return src, dst
+
+
+    # Render an instruction as mnemonic and operand strings, as
+    # DecodedInst.text(), for a dictionary of its fields.
+    def format_inst(self, inst, form, fields, symtab_by_value = {}, disassemble_operands = True,
+                    src_name = None, dst_name = None):
+        if not isinstance(fields, DecodedInst):
+            fields = DecodedInst.from_fields(inst, form, fields)
+        return fields.text(symtab_by_value, disassemble_operands,
+                           src_name, dst_name)
+
+
+    def __init__(self, cpu_type = CpuType.s8x300, decode_table = False):
         self.cpu_type = cpu_type
+        self.decode_table_enabled = decode_table
         self.__opcode_init()
 
 if __name__ == '__main__':
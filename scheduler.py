@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# Event scheduler for board simulation
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import struct
+
+# later than any event
+NEVER = 1 << 62
+
+
+# Events scheduled at processor cycle counts.  An event is the tuple
+# (time, sequence number, target name, method name, argument), where
+# the target is an object registered by name, and the argument an
+# integer or None, so that the queue is plain data which can be saved
+# and restored without the objects it refers to.  When an event is
+# run, the method is called with the time of the event and the
+# argument.  Events at the same time run in the order scheduled.
+#
+# next_time is the time of the earliest event, or NEVER, so that a
+# board can check whether any event is due with one comparison.
+class Scheduler:
+    def __init__(self):
+        self.targets = { }
+        self.queue = []
+        self.sequence = 0
+        self.next_time = NEVER
+
+    def register(self, name, target):
+        self.targets[name] = target
+
+    def schedule(self, time, target, method, arg = None):
+        assert target in self.targets
+        heapq.heappush(self.queue, (time, self.sequence, target, method, arg))
+        self.sequence += 1
+        self.next_time = self.queue[0][0]
+
+    # Remove the pending events of a target, and if given, only those
+    # of one of its methods.
+    def cancel(self, target, method = None):
+        self.queue = [e for e in self.queue
+                      if e[2] != target or (method is not None and e[3] != method)]
+        heapq.heapify(self.queue)
+        self.next_time = self.queue[0][0] if self.queue else NEVER
+
+    def pending(self, target, method = None):
+        return sorted(e for e in self.queue
+                      if e[2] == target and (method is None or e[3] == method))
+
+    # Run all events due at or before time, including any they schedule
+    # which are also due.
+    def run_until(self, time):
+        queue = self.queue
+        while queue and queue[0][0] <= time:
+            t, sequence, target, method, arg = heapq.heappop(queue)
+            self.next_time = queue[0][0] if queue else NEVER
+            getattr(self.targets[target], method)(t, arg)
+        self.next_time = queue[0][0] if queue else NEVER
+
+    # The state of the queue, as the sequence number and event count,
+    # followed by each event in heap order, with its target and method
+    # names.  An argument of None is stored as a flag.
+    header = struct.Struct('<QI')
+    event = struct.Struct('<qQqBBB')
+
+    def snapshot(self):
+        state = [self.header.pack(self.sequence, len(self.queue))]
+        for time, sequence, target, method, arg in self.queue:
+            target = target.encode('ascii')
+            method = method.encode('ascii')
+            state += [self.event.pack(time, sequence, arg or 0, arg is None,
+                                      len(target), len(method)),
+                      target, method]
+        return b''.join(state)
+
+    # The targets must already be registered.  The queue is restored in
+    # heap order, so needn't be reordered.
+    def restore(self, state):
+        self.sequence, count = self.header.unpack_from(state)
+        offset = self.header.size
+        queue = []
+        for i in range(count):
+            time, sequence, arg, no_arg, target_len, method_len = \
+                self.event.unpack_from(state, offset)
+            offset += self.event.size
+            target = str(state[offset:offset + target_len], 'ascii')
+            offset += target_len
+            method = str(state[offset:offset + method_len], 'ascii')
+            offset += method_len
+            queue.append((time, sequence, target, method,
+                          None if no_arg else arg))
+        self.queue = queue
+        self.next_time = queue[0][0] if queue else NEVER
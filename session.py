@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# Incremental disassembly of a patched image
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+
+from disassembler import decode, pass1, render
+
+
+# Holds the decoded image, the symbol table and the rendered lines of
+# a disassembly, so that after words are patched only the affected
+# lines are decoded and rendered again.  The result is always the
+# same as disassembling the patched image from scratch.
+#
+# Every jump target has a label, named after its address, so a
+# reference to it renders the same whether or not other references
+# exist.  Patching a word can therefore only change its own line, and
+# the lines of targets that gain their first reference or lose their
+# last, which gain or lose a label.  The references to each target
+# are counted to find those.
+class DisassemblySession:
+    def __init__(self, s8x30x, fw, base = 0, show_obj = False,
+                 fast_io_decoder = None):
+        self.s8x30x = s8x30x
+        self.fw = fw
+        self.base = base
+        self.show_obj = show_obj
+        self.fast_io_decoder = fast_io_decoder
+        self.decoded = decode(s8x30x, fw, base)
+        self.symtab_by_value = pass1(self.decoded)
+        self.references = Counter(d.j for d in self.decoded
+                                  if d is not None and d.j is not None)
+        self.lines = list(render(s8x30x, fw, base, self.decoded,
+                                 self.symtab_by_value, show_obj,
+                                 fast_io_decoder = fast_io_decoder))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def in_image(self, address):
+        return self.base <= address < self.base + len(self.decoded)
+
+    def line(self, address):
+        return self.lines[address - self.base]
+
+    def text(self):
+        return ''.join(self.lines)
+
+    def write(self, output_file):
+        output_file.writelines(self.lines)
+
+    def __reference(self, d, delta, changed):
+        if d is None or d.j is None:
+            return
+        target = d.j
+        count = self.references[target] + delta
+        self.references[target] = count
+        if count == 0:
+            del self.references[target]
+            del self.symtab_by_value[target]
+        elif count == 1 and delta > 0:
+            self.symtab_by_value[target] = 'x%04x' % target
+        else:
+            return
+        if self.in_image(target):
+            changed.add(target)
+
+    # patches is a dictionary of address to the new opcode, or to a
+    # tuple of the new opcode and fast I/O select byte.  Returns the
+    # sorted list of addresses whose lines were rendered again.
+    def patch(self, patches):
+        changed = set()
+        for address, value in patches.items():
+            if not self.in_image(address):
+                raise IndexError('address %04x not in image' % address)
+            word, select = value if isinstance(value, tuple) else (value, None)
+            self.fw.patch(address, word, select)
+            offset = address - self.base
+            old = self.decoded[offset]
+            new = self.s8x30x.decode_words([word], address,
+                                           [self.fw.word(address)[1]]
+                                           if self.fw.bank_count > 2 else None)[0]
+            self.decoded[offset] = new
+            self.__reference(old, -1, changed)
+            self.__reference(new, 1, changed)
+            changed.add(address)
+        addresses = sorted(changed)
+        for address, line in zip(addresses,
+                                 render(self.s8x30x, self.fw, self.base,
+                                        self.decoded, self.symtab_by_value,
+                                        self.show_obj,
+                                        fast_io_decoder = self.fast_io_decoder,
+                                        addresses = addresses)):
+            self.lines[address - self.base] = line
+        return addresses
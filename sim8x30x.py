@@ -0,0 +1,724 @@
+#!/usr/bin/python3
+# Signetics 8X300/8X305 instruction set simulator
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+import re
+import struct
+
+from s8x30x import S8X30x, CpuType, BadInstruction, OT, reg_ivl, reg_ovf, reg_ivr
+
+PC_MASK = 0x1fff   # 13-bit program counter
+PROGRAM_SIZE = PC_MASK + 1
+XEC_SLOT = PROGRAM_SIZE     # added to the PC while an XEC target executes
+
+LEFT  = 0
+RIGHT = 1
+
+# rot[n][v] is v rotated right by n bits
+rot = [bytes((((v >> n) | (v << (8 - n))) & 0xff) for v in range(256))
+       for n in range(8)]
+
+
+# The default interface vector bus: 256 bytes in each of the left and
+# right banks, addressed by the last value written to IVL or IVR.
+# Boards with other I/O decoding (e.g., fast I/O selects from an extra
+# PROM) provide an object with the same three methods.  select is the
+# fast I/O select byte of the instruction, or None if there is none.
+#
+# Such a bus may also provide iv_tables(sim), returning the pair
+# (readers, writers): for each bank, a list of the function reading
+# (with no arguments) or writing (with the value) the bus for each
+# select byte.  The translated code of an instruction with a select
+# byte then calls the function for its select directly, rather than
+# iv_read() or iv_write().
+class IVBus:
+    def __init__(self):
+        self.address = [0, 0]
+        self.data = [bytearray(256), bytearray(256)]
+
+    def iv_address(self, bank, value):
+        self.address[bank] = value
+
+    def iv_read(self, bank, select):
+        return self.data[bank][self.address[bank]]
+
+    def iv_write(self, bank, value, select):
+        self.data[bank][self.address[bank]] = value
+
+    # The state of the bus, as the bank addresses followed by the left
+    # and right bank storage.
+    state_size = 2 + 2 * 256
+
+    def snapshot(self):
+        return bytes(self.address) + self.data[0] + self.data[1]
+
+    def restore(self, state):
+        self.address[:] = state[0:2]
+        self.data[0][:] = state[2:258]
+        self.data[1][:] = state[258:514]
+
+
+# Python code for an instruction, generated from its decoded fields.
+# stmts are statements executed for the instruction; exit is an
+# expression giving the address of the next instruction, in terms of
+# nxt, the address the instruction falls through to.  For JMP and NZT,
+# target is the jump target and cond is the NZT condition expression.
+class InstCode:
+    def __init__(self, stmts, exit = 'nxt', branch = False,
+                 target = None, cond = None):
+        self.stmts = stmts
+        self.exit = exit
+        self.branch = branch
+        self.target = target
+        self.cond = cond
+
+
+# The instruction at each address is translated to Python source once,
+# the first time it is executed, and compiled into a handler closure.
+# A handler takes the fall-through address and returns the address of
+# the next instruction.
+#
+# XEC saves its fall-through address in c[1] and returns its target
+# address with XEC_SLOT added.  The handler at that index runs the
+# target instruction with the saved address as its fall-through, so
+# that the instruction following the XEC is next unless the target is
+# a taken branch.  The XEC and the instruction it executes each take
+# one cycle.  A PC with XEC_SLOT set is a valid simulator state.
+#
+# Names available to the generated code:
+#   r       registers, indexed by register number (AUX = 0, OVF = 0o10,
+#           IVL and IVR hold the last bank addresses written)
+#   ior     bus iv_read
+#   iow     bus iv_write
+#   ioa     bus iv_address
+#   irl, irr, iwl, iwr  the read and write functions of the left and
+#           right banks by select byte, if the bus has iv_tables()
+#   c       c[0] is the instruction count of the last block executed,
+#           c[1] is the return address saved by XEC, and in timed mode
+#           c[2] + c[3] is the cycle count of the executing instruction
+#   rot1 .. rot7  rotate right tables
+#   texits, tring, tcursor  the exit counts, ring and cursor of the
+#           trace recorder, if any
+#
+# In timed mode, for buses with devices that depend on when they are
+# accessed (see now()), c[2] is set to the cycle count before each
+# instruction or block is run, and within a block, c[3] to the number
+# of instructions of the block executed before each instruction that
+# accesses the bus.  Each instruction takes one cycle.
+class Simulator:
+    env_names = ['r', 'ior', 'iow', 'ioa', 'irl', 'irr', 'iwl', 'iwr', 'c'] + \
+                ['rot%d' % n for n in range(1, 8)] + ['texits', 'tring', 'tcursor']
+
+    def __init__(self, cpu_type = CpuType.s8x300, bus = None, block_mode = False,
+                 timed = False):
+        self.cpu_type = cpu_type
+        self.s8x30x = S8X30x(cpu_type, decode_table = True)
+        self.table = self.s8x30x.decode_table()
+        self.bus = bus if bus is not None else IVBus()
+        self.program = [0] * PROGRAM_SIZE  # unloaded words are NOP
+        self.select = [None] * PROGRAM_SIZE
+        self.r = [0] * 16
+        self.c = [0, 0, 0, 0]
+        self.iv_tables = None
+        if hasattr(self.bus, 'iv_tables'):
+            self.iv_tables = self.bus.iv_tables(self)
+        self.timed = timed
+        self.recorder = None
+        self.trace_entries = None
+        self.handlers = [partial(self._compile_and_run, pc)
+                         for pc in range(PROGRAM_SIZE)]
+        self.handlers += [self.xec_handler(pc) for pc in range(PROGRAM_SIZE)]
+        self.code_cache = { }
+        self.block_mode = block_mode
+        self.blocks = [None] * PROGRAM_SIZE
+        self.blocks += [(self.xec_block(pc), 1) for pc in range(PROGRAM_SIZE)]
+        self.block_owners = [set() for pc in range(PROGRAM_SIZE)]
+        self.pc = 0
+        self.cycles = 0
+
+    def env(self):
+        env = { 'r': self.r,
+                'ior': self.bus.iv_read,
+                'iow': self.bus.iv_write,
+                'ioa': self.bus.iv_address,
+                'irl': None, 'irr': None, 'iwl': None, 'iwr': None,
+                'c': self.c,
+                'texits': None, 'tring': None, 'tcursor': None }
+        if self.iv_tables is not None:
+            readers, writers = self.iv_tables
+            env.update(irl = readers[LEFT], irr = readers[RIGHT],
+                       iwl = writers[LEFT], iwr = writers[RIGHT])
+        if self.recorder is not None:
+            env.update(texits = self.recorder.exit_counts, tring = self.recorder.ring,
+                       tcursor = self.recorder.cursor)
+        for n in range(1, 8):
+            env['rot%d' % n] = rot[n]
+        return env
+
+    # Load the program from a Memory object, or any sequence of
+    # opcode words.  The third bank of a Memory, if present, provides
+    # the fast I/O select byte of each instruction.
+    def load(self, memory, base = 0):
+        words = getattr(memory, 'words', memory)
+        has_select = getattr(memory, 'bank_count', 2) > 2
+        for i, word in enumerate(words):
+            select = memory[i][2] if has_select else None
+            self.write_program(base + i, word, select)
+
+    def write_program(self, address, word, select = None):
+        address &= PC_MASK
+        self.program[address] = word
+        self.select[address] = select
+        self.handlers[address] = partial(self._compile_and_run, address)
+        self.invalidate_blocks(address)
+        if self.recorder is not None:
+            self.trace_entries[address] = self.recorder.entry(address, word, select)
+
+    # Records the instructions executed in an exectrace.TraceRecorder,
+    # or stops recording if recorder is None.  Blocks are translated
+    # again, with or without the statements recording each instruction.
+    def set_recorder(self, recorder):
+        self.recorder = recorder
+        self.trace_entries = None
+        if recorder is not None:
+            self.trace_entries = [recorder.entry(pc, self.program[pc], self.select[pc])
+                                  for pc in range(PROGRAM_SIZE)]
+        self.blocks[:PROGRAM_SIZE] = [None] * PROGRAM_SIZE
+        self.blocks[PROGRAM_SIZE:] = [(self.xec_block(pc), 1) for pc in range(PROGRAM_SIZE)]
+        self.block_owners = [set() for pc in range(PROGRAM_SIZE)]
+
+    # Records the instruction at pc, for instructions not run by a
+    # translated block.
+    def record(self, pc):
+        recorder = self.recorder
+        address = pc & PC_MASK
+        recorder.counts[address] += 1
+        cursor = recorder.cursor
+        if recorder.ring is not None:
+            recorder.ring[cursor[0] & recorder.mask] = self.trace_entries[address]
+        cursor[0] += 1
+
+    # The processor state, as PC, cycle count, the registers and the
+    # c list.  Program memory and the translated code aren't included,
+    # so a snapshot can only be restored to a simulator with the same
+    # program loaded, but they remain valid across a restore.  The
+    # register and c lists are updated in place, since the translated
+    # code refers to them.
+    state = struct.Struct('<HQ16B4Q')
+
+    def snapshot(self):
+        return self.state.pack(self.pc, self.cycles, *self.r, *self.c)
+
+    def restore(self, state):
+        values = self.state.unpack_from(state)
+        self.pc = values[0]
+        self.cycles = values[1]
+        self.r[:] = values[2:18]
+        self.c[:] = values[18:22]
+
+    def reset(self):
+        self.pc = 0
+        self.cycles = 0
+        self.r[:] = [0] * 16
+        self.c[:] = [0, 0, 0, 0]
+
+    # In timed mode, the cycle count of the instruction executing, for
+    # use by the bus while it's accessed.
+    def now(self):
+        return self.c[2] + self.c[3]
+
+    def xec_handler(self, pc):
+        H = self.handlers
+        c = self.c
+        def handler(nxt):
+            return H[pc](c[1])
+        return handler
+
+    def xec_block(self, pc):
+        H = self.handlers
+        c = self.c
+        if self.recorder is not None:
+            record = self.record
+            def block(n):
+                c[0] = 1
+                record(pc)
+                return H[pc](c[1])
+            return block
+        def block(n):
+            c[0] = 1
+            return H[pc](c[1])
+        return block
+
+
+    # operand code generation
+
+    @staticmethod
+    def bank(reg):
+        return RIGHT if reg & 0o10 else LEFT
+
+    @staticmethod
+    def field(reg, length):
+        rb = 7 - (reg & 7)             # rightmost bit of field
+        mask = (1 << (length or 8)) - 1
+        return rb, mask
+
+    @staticmethod
+    def rotate(expr, n):
+        if n & 7 == 0:
+            return expr
+        return 'rot%d[%s]' % (n & 7, expr)
+
+    # The IV bus is read at most once per bank per instruction; reads
+    # is a dictionary of the banks already read, and stmts the list
+    # the read statement is appended to.
+    def iv_bank_code(self, bank, select, reads, stmts):
+        if bank not in reads:
+            reads[bank] = 'b%d' % bank
+            if self.iv_tables is not None and select is not None:
+                stmts.append('b%d = %s[%d]()' % (bank, 'irl' if bank == LEFT else 'irr',
+                                                 select))
+            else:
+                stmts.append('b%d = ior(%d, %r)' % (bank, bank, select))
+        return reads[bank]
+
+    def iv_store_code(self, bank, value, select):
+        if self.iv_tables is not None and select is not None:
+            return '%s[%d](%s)' % ('iwl' if bank == LEFT else 'iwr', select, value)
+        return 'iow(%d, %s, %r)' % (bank, value, select)
+
+    def iv_read_code(self, reg, length, select, reads, stmts):
+        rb, mask = self.field(reg, length)
+        expr = self.rotate(self.iv_bank_code(self.bank(reg), select, reads, stmts), rb)
+        if mask != 0xff:
+            expr = '(%s & 0x%02x)' % (expr, mask)
+        return expr
+
+    def iv_write_code(self, reg, length, value, select, reads, stmts):
+        rb, mask = self.field(reg, length)
+        bank = self.bank(reg)
+        if mask == 0xff and rb == 0:
+            stmts.append(self.iv_store_code(bank, '(%s) & 0xff' % value, select))
+            return
+        dest_mask = rot[(8 - rb) & 7][mask]
+        value = self.rotate('(%s) & 0x%02x' % (value, mask), 8 - rb)
+        old = self.iv_bank_code(bank, select, reads, stmts)
+        stmts.append(self.iv_store_code(bank, '(%s & 0x%02x) | %s' %
+                                        (old, dest_mask ^ 0xff, value), select))
+
+    def reg_write_code(self, reg, value):
+        stmts = ['r[%d] = %s' % (reg, value)]
+        if reg == reg_ivl:
+            stmts.append('ioa(%d, r[%d])' % (LEFT, reg))
+        elif reg == reg_ivr:
+            stmts.append('ioa(%d, r[%d])' % (RIGHT, reg))
+        return stmts
+
+    def inst_code(self, d, select):
+        mnem = d.inst.mnem
+        ops = d.form.operands
+        if mnem == 'nop':
+            return InstCode([])
+        if mnem in ('xml', 'xmr'):
+            bank = LEFT if mnem == 'xml' else RIGHT
+            reg = reg_ivl if bank == LEFT else reg_ivr
+            return InstCode(self.reg_write_code(reg, '%d' % d.i))
+        if mnem == 'jmp':
+            target = d.j & PC_MASK
+            return InstCode([], '%d' % target, True, target)
+
+        # source value
+        stmts = []
+        reads = { }
+        if OT.sr in ops:
+            src = self.rotate('r[%d]' % d.s, d.r or 0)
+        elif OT.siv in ops:
+            src = self.iv_read_code(d.s, d.l, select, reads, stmts)
+        elif OT.imm in ops:
+            src = '%d' % d.i
+
+        if mnem == 'nzt':
+            target = d.j & PC_MASK
+            return InstCode(stmts, '%d if %s else nxt' % (target, src),
+                            True, target, src)
+        if mnem == 'xec':
+            j = d.j
+            page_mask = 0xff if OT.jmp8 in ops else 0x1f
+            target = '%d | ((%d + %s) & %d)' % ((j & ~page_mask) & PC_MASK,
+                                                j & page_mask, src, page_mask)
+            return InstCode(stmts + ['c[1] = nxt'], '%d + (%s)' % (XEC_SLOT, target), True)
+
+        if mnem == 'add':
+            stmts.append('t = %s + r[0]' % src)
+            stmts.append('r[%d] = t >> 8' % reg_ovf)
+            value = 't & 0xff'
+        elif mnem == 'and':
+            value = '%s & r[0]' % src
+        elif mnem == 'xor':
+            value = '%s ^ r[0]' % src
+        else:  # move, xmit
+            value = src
+
+        if OT.dr in ops:
+            stmts += self.reg_write_code(d.d, value)
+        else:
+            self.iv_write_code(d.d, d.l, value, select, reads, stmts)
+        return InstCode(stmts)
+
+    def decode(self, pc):
+        word = self.program[pc]
+        return self.inst_code(self.table.lookup(word, pc), self.select[pc])
+
+    # Compile a function with the given parameters and body, as a
+    # closure over the simulator environment.  Functions with the same
+    # source share a code object.
+    def make_function(self, params, stmts, name):
+        source = ('def _factory(%s):\n'
+                  ' def _f(%s):\n' % (', '.join(self.env_names), params) +
+                  ''.join('  %s\n' % s for s in stmts) +
+                  ' return _f\n')
+        factory = self.code_cache.get(source)
+        if factory is None:
+            namespace = { 'BadInstruction': BadInstruction }
+            exec(compile(source, name, 'exec'), namespace)
+            factory = namespace['_factory']
+            self.code_cache[source] = factory
+        return factory(**self.env())
+
+    # Returns a handler for the instruction at pc.
+    def compile(self, pc):
+        try:
+            code = self.decode(pc)
+            stmts = code.stmts + ['return ' + code.exit]
+        except BadInstruction:
+            stmts = ['raise BadInstruction(%d)' % self.program[pc]]
+        return self.make_function('nxt', stmts, '<8x30x %04x>' % pc)
+
+    def _compile_and_run(self, pc, nxt):
+        self.handlers[pc] = self.compile(pc)
+        return self.handlers[pc](nxt)
+
+
+    # Block translation: the instructions reached from an entry address
+    # by falling through and by following JMPs are compiled into one
+    # function, up to an XEC, the maximum block length, or an address
+    # already in the block.  NZTs become side exits.  If the block
+    # leads back to its own entry, it is compiled as a loop.
+    #
+    # A block function takes the number of instructions it may
+    # execute (which must be at least its length), returns the next
+    # PC, and leaves the number of instructions executed in c[0].
+    # Registers are held in local variables within the block, and
+    # stored back at each exit; if an exception is raised within a
+    # block, register writes made by the block are lost.
+    #
+    # Blocks are cached by entry address as (function, length) tuples,
+    # and dropped when any program word they cover is written.
+    max_block_length = 64
+
+    reg_ref = re.compile(r'\br\[(\d+)\]')
+
+    bus_ref = re.compile(r'\b(io[raw]\(|i[rw][lr]\[)')
+
+    def compile_block(self, entry):
+        # body items are ('s', statement),
+        # ('x', condition or None, instructions executed, next PC expression),
+        # in timed mode, ('t', instructions executed) preceding the
+        # statements of an instruction accessing the bus
+        recorder = self.recorder
+        body = []
+        path = []
+        pc = entry
+        length = 0
+        visited = set()
+        while True:
+            try:
+                code = self.decode(pc)
+            except BadInstruction:
+                break  # left to the instruction handler to raise
+            length += 1
+            visited.add(pc)
+            path.append(pc)
+            self.block_owners[pc].add(entry)
+            nxt = (pc + 1) & PC_MASK
+            if code.branch and code.target is None:      # XEC uses nxt
+                body.append(('s', 'nxt = %d' % nxt))
+            if self.timed and any(self.bus_ref.search(stmt) for stmt in code.stmts):
+                body.append(('t', length - 1))
+            body += [('s', stmt) for stmt in code.stmts]
+            if not code.branch:
+                pc = nxt
+            elif code.cond is not None:                  # NZT
+                body.append(('x', code.cond, length, '%d' % code.target))
+                pc = nxt
+            elif code.target is not None:                # JMP
+                pc = code.target
+            else:                                        # XEC
+                body.append(('x', None, length, code.exit))
+                pc = None
+                break
+            if pc in visited or length == self.max_block_length:
+                break
+        if pc is not None and length:
+            body.append(('x', None, length, '%d' % pc))
+
+        # An instruction that can't be decoded is run by its handler,
+        # looked up when it's run, since the handler is replaced once
+        # it's compiled, and again when the word is written.
+        if length == 0:
+            H = self.handlers
+            def single(n):
+                self.c[0] = 1
+                if self.recorder is not None:
+                    self.record(entry)
+                return H[entry]((entry + 1) & PC_MASK)
+            block = (single, 1)
+            self.block_owners[entry].add(entry)
+            self.blocks[entry] = block
+            return block
+
+        text = ' '.join('%s %s' % (item[1], item[-1]) for item in body)
+        regs = sorted(set(int(n) for n in self.reg_ref.findall(text)))
+        written = sorted(set(int(m.group(1)) for item in body if item[0] == 's'
+                             for m in [self.reg_ref.match(item[1])]
+                             if m and item[1][m.end():].startswith(' = ')))
+        writeback = ['r[%d] = r%d' % (n, n) for n in written]
+        loop = any(item[0] == 'x' and item[3] == '%d' % entry for item in body)
+        indent = ' ' if loop else ''
+        count = 'i + %d' if loop else '%d'
+
+        # While recording, each exit is counted in the recorder, and
+        # if it has a ring, recorded in it, standing for the
+        # instructions executed; those are counted by the recorder
+        # when it's folded.  The exits back to the entry of a loop are
+        # counted in local variables, added to the recorder's counts
+        # when the block returns.
+        records = { }
+        loop_exits = []
+        ring = None
+        if recorder is not None:
+            ring = recorder.ring
+            for i, item in enumerate(body):
+                if item[0] == 'x':
+                    records[i] = recorder.add_exit([self.trace_entries[address]
+                                                    for address in path[:item[2]]])
+                    if loop and item[3] == '%d' % entry:
+                        loop_exits.append(records[i] & ~recorder.EXIT)
+            writeback += ['texits[%d] += x%d' % (e, e) for e in loop_exits]
+
+        stmts = ['r%d = r[%d]' % (n, n) for n in regs]
+        if ring is not None:
+            stmts.append('tpos = tcursor[0]')
+        stmts += ['x%d = 0' % e for e in loop_exits]
+        if loop:
+            stmts += ['i = 0', 'while True:']
+        for i, item in enumerate(body):
+            if item[0] == 's':
+                stmts.append(indent + self.reg_ref.sub(r'r\1', item[1]))
+                continue
+            if item[0] == 't':
+                stmts.append(indent + 'c[3] = ' + count % item[1])
+                continue
+            kind, cond, executed, exit = item
+            pad = indent
+            if cond is not None:
+                stmts.append(pad + 'if %s:' % self.reg_ref.sub(r'r\1', cond))
+                pad += ' '
+            if loop and exit == '%d' % entry:
+                if recorder is not None:
+                    stmts.append(pad + 'x%d += 1' % (records[i] & ~recorder.EXIT))
+                if ring is not None:
+                    stmts += [pad + 'tring[tpos & %d] = %d' % (recorder.mask, records[i]),
+                              pad + 'tpos += 1']
+                stmts += [pad + 'i += %d' % executed,
+                          pad + 'if i + %d > n:' % length,
+                          pad + ' break',
+                          pad + 'continue']
+            else:
+                if recorder is not None:
+                    stmts.append(pad + 'texits[%d] += 1' % (records[i] & ~recorder.EXIT))
+                if ring is not None:
+                    stmts += [pad + 'tring[tpos & %d] = %d' % (recorder.mask, records[i]),
+                              pad + 'tcursor[0] = tpos + 1']
+                stmts += [pad + s for s in writeback]
+                stmts += [pad + 'c[0] = ' + count % executed,
+                          pad + 'return ' + self.reg_ref.sub(r'r\1', exit)]
+        if loop:
+            if ring is not None:
+                writeback.append('tcursor[0] = tpos')
+            stmts += writeback + ['c[0] = i', 'return %d' % entry]
+        block = (self.make_function('n', stmts, '<8x30x block %04x>' % entry),
+                 length)
+        self.blocks[entry] = block
+        return block
+
+    def invalidate_blocks(self, address):
+        for entry in self.block_owners[address]:
+            self.blocks[entry] = None
+        self.block_owners[address] = set()
+
+
+    # Execute count instructions, returning the number executed.  If
+    # an instruction raises an exception, the PC is left at that
+    # instruction, or in block mode, at the start of its block.
+    def run(self, count):
+        if self.block_mode:
+            return self.run_blocks(count)
+        if self.recorder is not None:
+            return self.run_traced(count)
+        return self.run_insts(count)
+
+    def run_insts(self, count):
+        H = self.handlers
+        pc = self.pc
+        done = 0
+        try:
+            if self.timed:
+                c = self.c
+                cycles = self.cycles
+                c[3] = 0
+                for done in range(count):
+                    c[2] = cycles + done
+                    pc = H[pc]((pc + 1) & PC_MASK)
+            else:
+                for done in range(count):
+                    pc = H[pc]((pc + 1) & PC_MASK)
+            done = count
+        finally:
+            self.pc = pc
+            self.cycles += done
+        return done
+
+    # As run_insts(), recording each instruction in the recorder.  An
+    # instruction executed by XEC is recorded at its own address.
+    def run_traced(self, count):
+        H = self.handlers
+        c = self.c
+        recorder = self.recorder
+        counts = recorder.counts
+        ring = recorder.ring
+        mask = recorder.mask
+        entries = self.trace_entries
+        cursor = recorder.cursor
+        position = cursor[0]
+        cycles = self.cycles
+        pc = self.pc
+        done = 0
+        c[3] = 0
+        try:
+            if ring is None:
+                for done in range(count):
+                    c[2] = cycles + done
+                    counts[pc & PC_MASK] += 1
+                    position += 1
+                    pc = H[pc]((pc + 1) & PC_MASK)
+            else:
+                for done in range(count):
+                    c[2] = cycles + done
+                    address = pc & PC_MASK
+                    counts[address] += 1
+                    ring[position & mask] = entries[address]
+                    position += 1
+                    pc = H[pc]((pc + 1) & PC_MASK)
+            done = count
+        finally:
+            self.pc = pc
+            self.cycles += done
+            cursor[0] = position
+        return done
+
+    # Blocks longer than the number of instructions remaining are not
+    # entered; the remaining instructions are run singly, so that
+    # exactly count instructions are executed.
+    def run_blocks(self, count):
+        B = self.blocks
+        H = self.handlers
+        c = self.c
+        pc = self.pc
+        done = 0
+        cycles = self.cycles
+        try:
+            while done < count:
+                block = B[pc]
+                if block is None:
+                    block = self.compile_block(pc)
+                c[2] = cycles + done
+                c[3] = 0
+                if block[1] <= count - done:
+                    pc = block[0](count - done)
+                    done += c[0]
+                else:
+                    if self.recorder is not None:
+                        self.record(pc)
+                    pc = H[pc]((pc + 1) & PC_MASK)
+                    done += 1
+        finally:
+            self.pc = pc
+            self.cycles += done
+        return done
+
+    def step(self):
+        return self.run_insts(1)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from memory import Memory
+
+    parser = argparse.ArgumentParser(description = 'Simulator for Signetics 8X300/8X305')
+    parser.add_argument('-5', '--8x305', action='store_const',
+                        dest='cpu_type', const=CpuType.s8x305,
+                        default=CpuType.s8x300, help = '8X305 processor')
+    parser.add_argument('-n', '--count', type=int, default=10000000,
+                        help = 'number of instructions to execute')
+    parser.add_argument('-b', '--blocks', action='store_true',
+                        help = 'use block translation')
+    parser.add_argument('--compare', action='store_true',
+                        help = 'run with and without block translation, and compare')
+    parser.add_argument('-t', '--trace', action='store_true',
+                        help = 'record a trace and coverage while running')
+    parser.add_argument('-c', '--coverage', action='store_true',
+                        help = 'record only coverage while running')
+    parser.add_argument('input', nargs='+',
+                        help = 'binary input files, interleaved')
+    args = parser.parse_args()
+
+    memory = Memory.from_files(args.input)
+
+    def timed_run(block_mode):
+        sim = Simulator(args.cpu_type, block_mode = block_mode)
+        sim.load(memory)
+        if args.trace or args.coverage:
+            from exectrace import TraceRecorder
+            sim.set_recorder(TraceRecorder(TraceRecorder.default_size if args.trace else 0))
+        t = time.perf_counter()
+        try:
+            sim.run(args.count)
+        except BadInstruction as e:
+            print('%04x: %s' % (sim.pc, e))
+        t = time.perf_counter() - t
+        print('%-12s %d cycles in %.3f s, %.0f instructions/s' %
+              ('blocks' if block_mode else 'instructions', sim.cycles, t, sim.cycles / t))
+        return sim, t
+
+    if args.compare:
+        sim_i, t_i = timed_run(False)
+        sim_b, t_b = timed_run(True)
+        if (sim_i.pc, sim_i.r, sim_i.cycles) != (sim_b.pc, sim_b.r, sim_b.cycles):
+            print('state mismatch between modes')
+        print('block translation speedup %.2fx' % (t_i / t_b))
+    else:
+        timed_run(args.blocks)
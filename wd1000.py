@@ -14,9 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
+from fastio import FastIODecoder
 
-class WD1000():
+class WD1000(FastIODecoder):
     iv_name = { 'sriv': { 0: 'rd_ram'},
                 'sliv': { 1: 'drq_clk',
                           2: 'rd2',
@@ -33,47 +33,10 @@ class WD1000():
                           6: 'wr_host_port',
                           7: 'mac_control'}}
 
-    # process Fast I/O selects, currently hard-coded for WD1000
-    def fast_io_decode(self, ext, operands):
-        rr = ext[0] & 0x7
-        rr_needed = rr != 0x07
+    rd_shift = 0
+    rd_mask  = 0x7
+    rd_idle  = 0x7
 
-        wr = (ext[0] >> 4) & 0x7
-        wr_needed = wr != 0x0
-
-        # is s[lr]iv in operands?
-        siv = re.search('s[lr]iv', operands)
-        if siv:
-            generic_name = siv.group()
-            if rr in self.iv_name[generic_name]:
-                operands = operands.replace(generic_name,
-                                            self.iv_name[generic_name][rr])
-                rr_needed = False
-
-        # is d[lr]iv in operands?
-        div = re.search('d[lr]iv', operands)
-        if div:
-            generic_name = div.group()
-            if wr in self.iv_name[generic_name]:
-                operands = operands.replace(generic_name,
-                                            self.iv_name[generic_name][wr])
-                wr_needed = False
-
-        # is iv[lr] in operands?  (xmit destination)
-        div = re.search('iv[lr]', operands)
-        if div:
-            generic_name_1 = div.group()
-            generic_name_2 = { 'ivl' : 'dliv', 'ivr' : 'driv' } [generic_name_1]
-            if wr in self.iv_name[generic_name_2]:
-                operands = operands.replace(generic_name_1,
-                                            self.iv_name[generic_name_2][wr])
-                wr_needed = False
-
-        if rr_needed or wr_needed:
-            operands += ' //'
-            if rr_needed:
-                operands += ' rd=%d' % rr
-            if wr_needed:
-                operands += ' wr=%d' % wr
-
-        return operands
+    wr_shift = 4
+    wr_mask  = 0x7
+    wr_idle  = 0x0
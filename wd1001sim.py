@@ -0,0 +1,756 @@
+#!/usr/bin/python3
+# Board level simulation of the Western Digital WD1001 disk controller
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The controller firmware runs on the instruction set simulator, with
+# its fast I/O selects, as named by the WD1001 fast I/O decoder,
+# connected to models of the peripherals of the board.  The models are
+# behavioral: the sector buffer, disk data, drive and host port are
+# modeled at the level of the bytes the firmware reads and writes, not
+# of the logic of the board.  Where the function of a select isn't
+# known from its name (the rd2 and rd5 selects, which the model uses
+# as drive and host status), the model's choice is noted.
+
+from binascii import crc_hqx
+import os
+import struct
+
+from s8x30x import CpuType
+from sim8x30x import Simulator, IVBus, LEFT, RIGHT
+from scheduler import Scheduler
+from wd1001 import WD1001
+
+
+# A disk image file, holding the data of each sector in order of
+# cylinder, head and sector, and the layout of its tracks as the
+# serializer/deserializer sees them.  Each track starts with gap 1 at
+# the index pulse, followed by each sector as:
+#
+#   sync        twelve 00 bytes
+#   ID field    a1, ID mark, cylinder, SDH, sector, CRC (two bytes)
+#   gap 2       five 4e bytes
+#   sync        twelve 00 bytes
+#   data field  a1, f8, data, CRC (two bytes)
+#   gap 3       4e bytes
+#
+# and gap 4 filling the rest of the track.  As on the WD1010, the ID
+# mark holds the high bits of the cylinder (fe, ff, fc or fd), and the
+# SDH byte the sector size code and head.  CRCs are CRC-CCITT from the
+# a1 byte on.
+class DiskImage:
+    size_codes = { 256: 0, 512: 1, 1024: 2, 128: 3 }
+    id_marks = (0xfe, 0xff, 0xfc, 0xfd)
+    data_mark = 0xf8
+
+    gap1 = 16
+    gap2 = 5
+    gap3 = 15
+    sync = 12
+
+    def __init__(self, path, cylinders, heads, sectors, sector_size = 512,
+                 first_sector = 0, create = False):
+        if sector_size not in self.size_codes:
+            raise ValueError('sector size %d not supported' % sector_size)
+        self.path = path
+        self.cylinders = cylinders
+        self.heads = heads
+        self.sectors = sectors
+        self.sector_size = sector_size
+        self.first_sector = first_sector
+        size = cylinders * heads * sectors * sector_size
+        if create and not os.path.exists(path):
+            self.data = bytearray(size)
+        else:
+            with open(path, 'rb') as f:
+                self.data = bytearray(f.read())
+            if len(self.data) != size:
+                raise ValueError('%s is %d bytes, geometry requires %d' %
+                                 (path, len(self.data), size))
+
+    def offset(self, cylinder, head, sector):
+        return (((cylinder * self.heads + head) * self.sectors +
+                 sector - self.first_sector) * self.sector_size)
+
+    def sector(self, cylinder, head, sector):
+        offset = self.offset(cylinder, head, sector)
+        return bytes(self.data[offset:offset + self.sector_size])
+
+    def write_sector(self, cylinder, head, sector, data):
+        assert len(data) == self.sector_size
+        offset = self.offset(cylinder, head, sector)
+        self.data[offset:offset + self.sector_size] = data
+
+    def id_field(self, cylinder, head, sector):
+        field = bytes([0xa1, self.id_marks[(cylinder >> 8) & 3],
+                       cylinder & 0xff,
+                       (self.size_codes[self.sector_size] << 5) | (head & 7),
+                       sector])
+        return field + crc_hqx(field, 0xffff).to_bytes(2, 'big')
+
+    def track(self, cylinder, head, track_bytes):
+        track = bytearray([0x4e] * self.gap1)
+        for sector in range(self.first_sector, self.first_sector + self.sectors):
+            track += bytes(self.sync)
+            track += self.id_field(cylinder, head, sector)
+            track += bytes([0x4e] * self.gap2)
+            track += bytes(self.sync)
+            field = bytes([0xa1, self.data_mark]) + self.sector(cylinder, head, sector)
+            track += field + crc_hqx(field, 0xffff).to_bytes(2, 'big')
+            track += bytes([0x4e] * self.gap3)
+        if len(track) > track_bytes:
+            raise ValueError('%d sectors of %d bytes do not fit in a track of %d bytes' %
+                             (self.sectors, self.sector_size, track_bytes))
+        return track + bytes([0x4e] * (track_bytes - len(track)))
+
+    # Store the data fields of a track, as written by the controller,
+    # for each sector whose ID field matches the track and whose data
+    # field follows it within a gap and has a good CRC.  A field may
+    # wrap around the index.  Returns the number of sectors stored.
+    def write_track(self, cylinder, head, track):
+        n = len(track)
+        size = self.sector_size
+        data_start = 7 + self.gap2 + self.sync
+        t = bytes(track) + bytes(track[:data_start + 64 + size + 4])
+        count = 0
+        i = t.find(0xa1)
+        while 0 <= i < n:
+            field = t[i:i + 7]
+            if (field[1] in self.id_marks and
+                crc_hqx(field, 0xffff) == 0 and
+                field[2] | (self.id_marks.index(field[1]) << 8) == cylinder and
+                field[3] & 7 == head and
+                self.first_sector <= field[4] < self.first_sector + self.sectors):
+                j = t.find(bytes([0xa1, self.data_mark]), i + 7, i + data_start + 64)
+                if j >= 0 and crc_hqx(t[j:j + size + 4], 0xffff) == 0:
+                    self.write_sector(cylinder, head, field[4], t[j + 2:j + 2 + size])
+                    count += 1
+            i = t.find(0xa1, i + 1)
+        return count
+
+    def save(self):
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(self.data)
+        os.replace(tmp_path, self.path)
+
+
+# A drive, with the image of its disk (None if there is no drive) and
+# the position of its heads.  Each step pulse moves the heads one
+# cylinder after step_cycles, and the seek is complete settle_cycles
+# after the last step.  The heads stop at the first and last cylinders.
+# Tracks are laid out from the image when first read or written, and
+# tracks written are stored back into the image by flush().
+class Drive:
+    def __init__(self, image = None, step_cycles = 15000, settle_cycles = 75000):
+        self.image = image
+        self.step_cycles = step_cycles
+        self.settle_cycles = settle_cycles
+        self.cylinder = 0
+        self.steps = 0       # step pulses not yet completed
+        self.settled = 0     # cycle at which the last seek is complete
+        self.tracks = { }
+        self.dirty = set()
+        self.scheduler = None
+        self.name = None
+
+    def attach(self, scheduler, name, track_bytes):
+        self.scheduler = scheduler
+        self.name = name
+        self.track_bytes = track_bytes
+        scheduler.register(name, self)
+
+    @property
+    def ready(self):
+        return self.image is not None
+
+    def step(self, now, inward):
+        self.steps += 1
+        self.scheduler.schedule(now + self.step_cycles, self.name, 'step_done',
+                                1 if inward else -1)
+
+    # event
+    def step_done(self, time, delta):
+        last = self.image.cylinders - 1 if self.image is not None else 0
+        self.cylinder = min(max(self.cylinder + delta, 0), last)
+        self.steps -= 1
+        if self.steps == 0:
+            self.settled = time + self.settle_cycles
+
+    def seek_complete(self, now):
+        return self.steps == 0 and now >= self.settled
+
+    def track(self, head):
+        key = (self.cylinder, head)
+        track = self.tracks.get(key)
+        if track is None:
+            track = self.image.track(self.cylinder, head, self.track_bytes)
+            self.tracks[key] = track
+        return track
+
+    def read(self, head, position):
+        if self.image is None or head >= self.image.heads:
+            return 0
+        return self.track(head)[position]
+
+    def write(self, head, position, value):
+        if self.image is None or head >= self.image.heads:
+            return
+        self.track(head)[position] = value
+        self.dirty.add((self.cylinder, head))
+
+    # Returns the number of sectors stored.
+    def flush(self):
+        count = 0
+        for cylinder, head in sorted(self.dirty):
+            count += self.image.write_track(cylinder, head,
+                                            self.tracks[cylinder, head])
+        self.dirty.clear()
+        if count:
+            self.image.save()
+        return count
+
+
+# The host port: a latch for a byte in each direction, and the DRQ and
+# INTRQ signals to the host.  Reading drq_clk or int_clk sets DRQ or
+# INTRQ; the host transferring a byte clears DRQ, and acknowledging the
+# interrupt clears INTRQ.  flags is also the host status byte read by
+# the firmware with the rd5 select.  on_drq and on_intrq, if set, are
+# called with the cycle count when DRQ or INTRQ is set.
+class HostPort:
+    IN_FULL  = 0x01   # byte from the host not yet read by the controller
+    OUT_FULL = 0x02   # byte to the host not yet read by the host
+    DRQ      = 0x04
+    INTRQ    = 0x08
+
+    def __init__(self):
+        self.data_in = 0
+        self.data_out = 0
+        self.flags = 0
+        self.on_drq = None
+        self.on_intrq = None
+
+    @property
+    def drq(self):
+        return bool(self.flags & self.DRQ)
+
+    @property
+    def intrq(self):
+        return bool(self.flags & self.INTRQ)
+
+    # host side
+
+    def write(self, value):
+        self.data_in = value & 0xff
+        self.flags = (self.flags | self.IN_FULL) & ~self.DRQ
+
+    def read(self):
+        self.flags &= ~(self.OUT_FULL | self.DRQ)
+        return self.data_out
+
+    def acknowledge(self):
+        self.flags &= ~self.INTRQ
+
+    # host side, as events, for host activity scheduled at given cycles
+    def write_event(self, time, value):
+        self.write(value)
+
+    def acknowledge_event(self, time, arg):
+        self.acknowledge()
+
+    # controller side
+
+    def controller_read(self):
+        self.flags &= ~self.IN_FULL
+        return self.data_in
+
+    def controller_write(self, value):
+        self.data_out = value
+        self.flags |= self.OUT_FULL
+
+    def set_drq(self, now):
+        self.flags |= self.DRQ
+        if self.on_drq is not None:
+            self.on_drq(now)
+
+    def set_intrq(self, now):
+        self.flags |= self.INTRQ
+        if self.on_intrq is not None:
+            self.on_intrq(now)
+
+
+# The sector buffer RAM, addressed by a counter loaded by writes to
+# ram_addr and incremented by each read of rd_ram or write of wr_ram,
+# wrapping at the end of the RAM.
+class SectorBuffer:
+    def __init__(self, size = 1024):
+        self.ram = bytearray(size)
+        self.address = 0
+
+    def read(self):
+        value = self.ram[self.address]
+        self.address = (self.address + 1) % len(self.ram)
+        return value
+
+    def write(self, value):
+        self.ram[self.address] = value
+        self.address = (self.address + 1) % len(self.ram)
+
+
+# The board.  memory is the firmware, including the fast I/O select
+# PROM as its third bank.  drives is a list of up to four Drives.
+#
+# The disk rotates once every track_bytes * cycles_per_byte cycles,
+# so that the byte under the heads is given by the cycle count; the
+# firmware reads and writes disk data a byte at a time with rd_serdes
+# and wr_serdes, in step with the disk.  A write to wr_serdes is stored
+# only while bit 0 of write_gate is set.
+#
+# Writes to any fast I/O write select are kept in latches, indexed by
+# select.  The model uses bit 0 of direction (set for inward, toward
+# higher cylinders), write_gate and step (a step pulse on each change
+# from 0 to 1), and drive_head_sel as the drive number in bits 4-3 and
+# head in bits 2-0.
+#
+# The status byte read with the rd2 select has the bits below, and
+# with rd5 is the HostPort flags.  Reads and writes without a device
+# selected go to ordinary IV bus storage addressed by IVL and IVR.
+#
+# The simulator calls the read or write function for the select of
+# each access directly, from the tables returned by iv_tables().  Only
+# the functions of devices that depend on the cycle count, or on state
+# changed by events, find the cycle count and run the events due; the
+# others, named in untimed, and the latches and IV bus storage, don't.
+class WD1001Board:
+    INDEX         = 0x01   # index pulse
+    INDEX_SEEN    = 0x02   # index pulse since the last write to reset_index
+    TRACK0        = 0x04
+    SEEK_COMPLETE = 0x08
+    READY         = 0x10
+
+    cycle_ns = 200
+    cycles_per_byte = 8
+    track_bytes = 10416
+    index_bytes = 64
+
+    untimed = { 'rd_ram', 'wr_ram', 'ram_addr' }
+
+    def __init__(self, memory, drives = (), cpu_type = CpuType.s8x300,
+                 block_mode = True):
+        if memory.bank_count < 3:
+            raise ValueError('the WD1001 simulation requires the fast I/O select bank')
+        self.decoder = WD1001()
+        self.scheduler = Scheduler()
+        self.buffer = SectorBuffer()
+        self.host = HostPort()
+        self.scheduler.register('host', self.host)
+        self.drives = list(drives) + [Drive() for i in range(4 - len(drives))]
+        for i, drive in enumerate(self.drives):
+            drive.attach(self.scheduler, 'drive%d' % i, self.track_bytes)
+        self.iv = IVBus()
+        self.latches = bytearray(16)
+        self.index_reset = 0
+        self.revolution = self.track_bytes * self.cycles_per_byte
+
+        wr = { name: select for kind in ('dliv', 'driv')
+               for select, name in self.decoder.iv_name[kind].items() }
+        self.direction_latch = wr['direction']
+        self.write_gate_latch = wr['write_gate']
+        self.step_latch = wr['step']
+        self.drive_head_latch = wr['drive_head_sel']
+        self.idle_select = self.decoder.select_byte()
+
+        self.sim = Simulator(cpu_type, bus = self, block_mode = block_mode,
+                             timed = True)
+        self.c = self.sim.c
+        self.sim.load(memory)
+
+    # For each bank, the function handling a read or write for each
+    # select byte: the io_ method named for the device the select
+    # addresses in that bank, if any, or the IV bus storage.  An idle
+    # select addresses no device, so mac_control, which has the idle
+    # write select, isn't modeled.
+    def iv_tables(self, sim):
+        d = self.decoder
+        c = sim.c
+        devices = { }
+        for kind, names in d.iv_name.items():
+            bank = RIGHT if kind[1] == 'r' else LEFT
+            for select, name in names.items():
+                devices[kind[0], bank, select] = name
+        self.readers = []
+        self.writers = []
+        for bank in (LEFT, RIGHT):
+            read = self.__iv_reader(bank)
+            write = self.__iv_writer(bank)
+            rd = [read] * 256
+            wr = [write] * 256
+            for ext in range(256):
+                if d.rd_select[ext] != d.rd_idle:
+                    name = devices.get(('s', bank, d.rd_select[ext]))
+                    if name is not None:
+                        rd[ext] = self.__device_reader(name, c)
+                select = d.wr_select[ext]
+                if select != d.wr_idle:
+                    name = devices.get(('d', bank, select))
+                    if name is not None:
+                        wr[ext] = self.__latch_writer(select, name, c)
+            self.readers.append(rd)
+            self.writers.append(wr)
+        return self.readers, self.writers
+
+    def __iv_reader(self, bank):
+        data = self.iv.data[bank]
+        address = self.iv.address
+        def read():
+            return data[address[bank]]
+        return read
+
+    def __iv_writer(self, bank):
+        data = self.iv.data[bank]
+        address = self.iv.address
+        def write(value):
+            data[address[bank]] = value
+        return write
+
+    def __device_reader(self, name, c):
+        handler = getattr(self, 'io_' + name)
+        if name in self.untimed:
+            return handler
+        scheduler = self.scheduler
+        def read():
+            now = c[2] + c[3]
+            if now >= scheduler.next_time:
+                scheduler.run_until(now)
+            return handler(now)
+        return read
+
+    # The handler, if any, is called before the latch is written, so
+    # that it can compare the old value with the new.
+    def __latch_writer(self, select, name, c):
+        latches = self.latches
+        handler = getattr(self, 'io_' + name, None)
+        if handler is None:
+            def write(value):
+                latches[select] = value
+        elif name in self.untimed:
+            def write(value):
+                handler(value)
+                latches[select] = value
+        else:
+            scheduler = self.scheduler
+            def write(value):
+                now = c[2] + c[3]
+                if now >= scheduler.next_time:
+                    scheduler.run_until(now)
+                handler(now, value)
+                latches[select] = value
+        return write
+
+    # the IV bus, as called by the simulator for an access without a
+    # select byte
+
+    def iv_address(self, bank, value):
+        self.iv.address[bank] = value
+
+    def iv_read(self, bank, select):
+        return self.readers[bank][self.idle_select if select is None else select]()
+
+    def iv_write(self, bank, value, select):
+        self.writers[bank][self.idle_select if select is None else select](value)
+
+    # disk position
+
+    def position(self, now):
+        return (now // self.cycles_per_byte) % self.track_bytes
+
+    def selected(self):
+        v = self.latches[self.drive_head_latch]
+        return self.drives[(v >> 3) & 3], v & 7
+
+    # devices
+
+    def io_rd_ram(self):
+        return self.buffer.read()
+
+    def io_wr_ram(self, value):
+        self.buffer.write(value)
+
+    def io_ram_addr(self, value):
+        self.buffer.address = value
+
+    def io_rd_serdes(self, now):
+        v = self.latches[self.drive_head_latch]
+        return self.drives[(v >> 3) & 3].read(v & 7, (now // self.cycles_per_byte) %
+                                                     self.track_bytes)
+
+    def io_wr_serdes(self, now, value):
+        if self.latches[self.write_gate_latch] & 1:
+            drive, head = self.selected()
+            drive.write(head, self.position(now), value)
+
+    def io_step(self, now, value):
+        if value & 1 and not self.latches[self.step_latch] & 1:
+            drive, head = self.selected()
+            drive.step(now, self.latches[self.direction_latch] & 1)
+
+    def io_reset_index(self, now, value):
+        self.index_reset = now
+
+    # The firmware polls the status while it waits, so the drive state
+    # is tested directly rather than through selected(), position(),
+    # ready and seek_complete().
+    def io_rd2(self, now):
+        drive = self.drives[(self.latches[self.drive_head_latch] >> 3) & 3]
+        revolution = self.revolution
+        status = 0
+        if now % revolution < self.index_bytes * self.cycles_per_byte:
+            status = self.INDEX
+        if now // revolution > self.index_reset // revolution:
+            status |= self.INDEX_SEEN
+        if drive.image is not None:
+            status |= self.READY
+            if drive.cylinder == 0:
+                status |= self.TRACK0
+            if drive.steps == 0 and now >= drive.settled:
+                status |= self.SEEK_COMPLETE
+        return status
+
+    def io_rd5(self, now):
+        return self.host.flags
+
+    def io_rd_host_port(self, now):
+        return self.host.controller_read()
+
+    def io_wr_host_port(self, now, value):
+        self.host.controller_write(value)
+
+    def io_drq_clk(self, now):
+        self.host.set_drq(now)
+        return 0xff
+
+    def io_int_clk(self, now):
+        self.host.set_intrq(now)
+        return 0xff
+
+    # running
+
+    @property
+    def cycles(self):
+        return self.sim.cycles
+
+    # Runs the firmware for count cycles, and the events due by then.
+    # The simulator runs until the next event is due, and events are
+    # also run when due at each access to the IV bus, so that the
+    # firmware sees the effect of an event at its exact cycle.
+    def run(self, count):
+        sim = self.sim
+        scheduler = self.scheduler
+        end = sim.cycles + count
+        while sim.cycles < end:
+            scheduler.run_until(sim.cycles)
+            sim.run(min(end, scheduler.next_time) - sim.cycles)
+        scheduler.run_until(sim.cycles)
+
+    def run_until(self, cycle):
+        if cycle > self.sim.cycles:
+            self.run(cycle - self.sim.cycles)
+
+    def seconds(self, cycles = None):
+        if cycles is None:
+            cycles = self.sim.cycles
+        return cycles * self.cycle_ns * 1e-9
+
+    # Stores the tracks written back into their disk images, returning
+    # the number of sectors stored.
+    def flush(self):
+        return sum(drive.flush() for drive in self.drives if drive.ready)
+
+    # snapshots
+
+    # A snapshot of the board is a bytes object holding:
+    #
+    #   header       magic and version
+    #   processor    Simulator state
+    #   IV bus       IVBus state
+    #   latches      the write select latches
+    #   board        index reset cycle, RAM address, and the host port
+    #                input and output bytes and flags
+    #   RAM          the sector buffer
+    #   drives       for each drive, cylinder, step pulses in progress,
+    #                seek complete cycle and the number of tracks
+    #                written since the last flush
+    #   tracks       cylinder, head and contents of each track written,
+    #                for each drive in turn
+    #   scheduler    Scheduler state
+    #
+    # The firmware and disk images aren't included: a snapshot is
+    # restored to a board with the same firmware and the same disk
+    # images, as of the last flush before the snapshot.  Restoring
+    # copies each part into the existing objects, so the translated
+    # code of the simulator remains valid, and a board booted once can
+    # be restored to the same point for any number of runs.
+    snapshot_magic = b'WD1001SS'
+    snapshot_version = 1
+    snapshot_header = struct.Struct('<8sI')
+    board_state = struct.Struct('<QHBBB')
+    drive_state = struct.Struct('<HIQI')
+    track_header = struct.Struct('<HB')
+
+    def snapshot(self):
+        host = self.host
+        state = [self.snapshot_header.pack(self.snapshot_magic,
+                                           self.snapshot_version),
+                 self.sim.snapshot(),
+                 self.iv.snapshot(),
+                 bytes(self.latches),
+                 self.board_state.pack(self.index_reset, self.buffer.address,
+                                       host.data_in, host.data_out, host.flags),
+                 bytes(self.buffer.ram)]
+        for drive in self.drives:
+            state.append(self.drive_state.pack(drive.cylinder, drive.steps,
+                                               drive.settled, len(drive.dirty)))
+        for drive in self.drives:
+            for cylinder, head in sorted(drive.dirty):
+                state += [self.track_header.pack(cylinder, head),
+                          bytes(drive.tracks[cylinder, head])]
+        state.append(self.scheduler.snapshot())
+        return b''.join(state)
+
+    def restore(self, state):
+        state = memoryview(state)
+        magic, version = self.snapshot_header.unpack_from(state)
+        if magic != self.snapshot_magic or version != self.snapshot_version:
+            raise ValueError('not a WD1001 board snapshot of version %d' %
+                             self.snapshot_version)
+        offset = self.snapshot_header.size
+        self.sim.restore(state[offset:])
+        offset += self.sim.state.size
+        self.iv.restore(state[offset:offset + IVBus.state_size])
+        offset += IVBus.state_size
+        self.latches[:] = state[offset:offset + len(self.latches)]
+        offset += len(self.latches)
+        host = self.host
+        (self.index_reset, self.buffer.address,
+         host.data_in, host.data_out, host.flags) = \
+            self.board_state.unpack_from(state, offset)
+        offset += self.board_state.size
+        ram = self.buffer.ram
+        ram[:] = state[offset:offset + len(ram)]
+        offset += len(ram)
+        track_counts = []
+        for drive in self.drives:
+            drive.cylinder, drive.steps, drive.settled, count = \
+                self.drive_state.unpack_from(state, offset)
+            offset += self.drive_state.size
+            track_counts.append(count)
+        for drive, count in zip(self.drives, track_counts):
+            # tracks written since the snapshot are laid out again
+            for key in drive.dirty:
+                del drive.tracks[key]
+            drive.dirty = set()
+            for i in range(count):
+                key = self.track_header.unpack_from(state, offset)
+                offset += self.track_header.size
+                drive.tracks[key] = bytearray(state[offset:offset + self.track_bytes])
+                drive.dirty.add(key)
+                offset += self.track_bytes
+        self.scheduler.restore(state[offset:])
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from disassembler import load_memory
+    from s8x30x import BadInstruction
+
+    def geometry(s):
+        values = [int(v, 0) for v in s.split(',')]
+        if len(values) not in (3, 4):
+            raise argparse.ArgumentTypeError('geometry is CYLINDERS,HEADS,SECTORS[,SIZE]')
+        return values
+
+    parser = argparse.ArgumentParser(description = 'WD1001 disk controller board simulation')
+    parser.add_argument('--hex', action='store_const', dest='inputformat',
+                        const='hex', default='binary',
+                        help = 'input file format is Intel hex')
+    parser.add_argument('-5', '--8x305', action='store_const', dest='cpu_type',
+                        const=CpuType.s8x305, default=CpuType.s8x300,
+                        help = '8X305 processor')
+    parser.add_argument('-n', '--cycles', type=int, default=10000000,
+                        help = 'number of cycles to run')
+    parser.add_argument('-i', '--instructions', action='store_true',
+                        help = 'translate single instructions rather than blocks')
+    parser.add_argument('-d', '--disk', action='append', default = [],
+                        help = 'disk image file of each drive (may be repeated)')
+    parser.add_argument('-g', '--geometry', type=geometry, default=[306, 4, 17, 512],
+                        help = 'disk geometry as CYLINDERS,HEADS,SECTORS[,SIZE] (default 306,4,17,512)')
+    parser.add_argument('--create', action='store_true',
+                        help = 'create disk image files that do not exist')
+    parser.add_argument('-r', '--restore', metavar = 'FILE',
+                        help = 'start from a snapshot saved by --save')
+    parser.add_argument('-s', '--save', metavar = 'FILE',
+                        help = 'save a snapshot of the board when the run ends')
+    parser.add_argument('--trace', metavar = 'FILE',
+                        help = 'write a trace of the last instructions executed to FILE')
+    parser.add_argument('--trace-size', type=int, default = 1 << 16,
+                        help = 'number of instructions in the trace (a power of two, default %(default)d)')
+    parser.add_argument('--coverage', metavar = 'FILE',
+                        help = 'merge the coverage of the run into FILE')
+    parser.add_argument('input', nargs = 3,
+                        help = 'firmware files, most significant byte, least significant byte and fast I/O select')
+    args = parser.parse_args()
+
+    drives = [Drive(DiskImage(path, *args.geometry, create = args.create))
+              for path in args.disk]
+    board = WD1001Board(load_memory(args.input, args.inputformat), drives,
+                        args.cpu_type, block_mode = not args.instructions)
+    if args.restore:
+        with open(args.restore, 'rb') as f:
+            board.restore(f.read())
+    recorder = None
+    if args.trace or args.coverage:
+        from exectrace import Coverage, TraceRecorder
+        recorder = TraceRecorder(args.trace_size if args.trace else 0)
+        board.sim.set_recorder(recorder)
+    start = board.cycles
+    t = time.perf_counter()
+    try:
+        board.run(args.cycles)
+    except BadInstruction as e:
+        print('%04x: %s' % (board.sim.pc, e))
+    t = time.perf_counter() - t
+    cycles = board.cycles - start
+    print('%d cycles (%.3f s simulated) in %.3f s, %.0f cycles/s, %.2fx real time' %
+          (cycles, board.seconds(cycles), t, cycles / t, board.seconds(cycles) / t))
+    print('pc %04x, host flags %02x, cylinders %s' %
+          (board.sim.pc, board.host.flags,
+           ' '.join('%d' % d.cylinder for d in board.drives if d.ready)))
+    if args.trace:
+        recorder.save(args.trace)
+    if args.coverage:
+        coverage = recorder.coverage
+        if os.path.exists(args.coverage):
+            coverage = Coverage.load(args.coverage)
+            coverage.merge(recorder.coverage)
+        coverage.save(args.coverage)
+    if args.save:
+        tmp_path = '%s.%d.tmp' % (args.save, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(board.snapshot())
+        os.replace(tmp_path, args.save)
+    stored = board.flush()
+    if stored:
+        print('%d sectors written' % stored)
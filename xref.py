@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+# Cross-reference index of a decoded 8X300/8X305 image
+# Copyright 2016 Eric Smith <spacewar@gmail.com>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of version 3 of the GNU General Public License
+# as published by the Free Software Foundation.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from s8x30x import OT, Reg, reg_aux, reg_ivl, reg_ovf, reg_ivr
+
+alu_mnemonics = frozenset(['add', 'and', 'xor'])   # also read AUX
+port_mnemonics = { 'xml': 'l', 'xmr': 'r' }
+
+iv_bank = { reg_ivl: 'l', reg_ivr: 'r' }
+
+
+# Index of the addresses of an image decoded by S8X30x.decode_words()
+# that use each jump target, register, IV bank, IV port and fast I/O
+# device.  All lists of addresses are in ascending order.
+#
+#   jump_sources    target -> JMP and NZT instructions jumping to it
+#   xec_sources     target -> XEC instructions with it as base address
+#   reg_readers     register -> instructions reading it, including the
+#                   implicit read of AUX by ADD, AND and XOR
+#   reg_writers     register -> instructions writing it, including the
+#                   implicit write of OVF by ADD
+#   iv_readers      bank ('l' or 'r') -> instructions reading IV data
+#   iv_writers      bank -> instructions writing IV data
+#   port_selectors  (bank, port) -> instructions selecting an IV port
+#                   with an immediate value (XMIT to IVL or IVR, XML,
+#                   XMR)
+#   device_users    fast I/O device name -> instructions accessing it
+#   select_users    ('rd' or 'wr', select) -> instructions with that
+#                   fast I/O select active
+#
+# Registers are keyed by value, so r7 and ivl are the same register.
+# If code_mask is given, only words for which it is true are treated
+# as instructions.  The fast I/O indexes require a fast I/O decoder
+# and an image (fw) with a fast I/O select bank.
+class XrefIndex:
+    def __init__(self, s8x30x, decoded, fw = None, base = 0,
+                 code_mask = None, fast_io_decoder = None):
+        self.base = base
+        self.jump_sources = { }
+        self.xec_sources = { }
+        self.reg_readers = { }
+        self.reg_writers = { }
+        self.iv_readers = { }
+        self.iv_writers = { }
+        self.port_selectors = { }
+        self.device_users = { }
+        self.select_users = { }
+
+        fast_io = (fast_io_decoder is not None and fw is not None and
+                   fw.bank_count > 2)
+        io_operands = s8x30x.io_operands
+        for pc, d in enumerate(decoded, base):
+            if d is None:
+                continue
+            if code_mask is not None and not code_mask[pc - base]:
+                continue
+            self.__index_inst(pc, d)
+            if fast_io:
+                self.__index_fast_io(pc, fast_io_decoder, fw[pc][2],
+                                     *io_operands(d.form, d))
+
+    @staticmethod
+    def __add(index, key, pc):
+        l = index.get(key)
+        if l is None:
+            index[key] = [pc]
+        else:
+            l.append(pc)
+
+    def __index_inst(self, pc, d):
+        add = self.__add
+        mnem = d.inst.mnem
+        if d.j is not None:
+            if mnem == 'xec':
+                add(self.xec_sources, d.j, pc)
+            else:
+                add(self.jump_sources, d.j, pc)
+        if mnem in port_mnemonics:
+            bank = port_mnemonics[mnem]
+            add(self.port_selectors, (bank, d.i), pc)
+            add(self.reg_writers, reg_ivl if bank == 'l' else reg_ivr, pc)
+            return
+        if mnem in alu_mnemonics:
+            add(self.reg_readers, reg_aux, pc)
+        if mnem == 'add':
+            add(self.reg_writers, reg_ovf, pc)
+        for operand in d.form.operands:
+            if operand is OT.sr:
+                add(self.reg_readers, d.s, pc)
+            elif operand is OT.siv:
+                add(self.iv_readers, 'r' if d.s & 0o10 else 'l', pc)
+            elif operand is OT.dr:
+                add(self.reg_writers, d.d, pc)
+                if mnem == 'xmit' and d.d in iv_bank:
+                    add(self.port_selectors, (iv_bank[d.d], d.i), pc)
+            elif operand is OT.div:
+                add(self.iv_writers, 'r' if d.d & 0o10 else 'l', pc)
+
+    def __index_fast_io(self, pc, fast_io_decoder, ext, src_kind, dst_kind):
+        add = self.__add
+        src_name, dst_name, note = fast_io_decoder.lookup(ext, src_kind,
+                                                          dst_kind)
+        if src_name is not None:
+            add(self.device_users, src_name, pc)
+        if dst_name is not None:
+            add(self.device_users, dst_name, pc)
+        rd = fast_io_decoder.rd_select[ext]
+        if rd != fast_io_decoder.rd_idle:
+            add(self.select_users, ('rd', rd), pc)
+        wr = fast_io_decoder.wr_select[ext]
+        if wr != fast_io_decoder.wr_idle:
+            add(self.select_users, ('wr', wr), pc)
+
+    # A register may be given as a Reg, its value, or its name.
+    @staticmethod
+    def reg_value(reg):
+        if isinstance(reg, str):
+            return Reg[reg.lower()].value
+        return int(reg)
+
+    def jumps_to(self, target):
+        return self.jump_sources.get(target, [])
+
+    def executes(self, target):
+        return self.xec_sources.get(target, [])
+
+    # All instructions referring to the target, by jump or XEC.
+    def references(self, target):
+        return sorted(self.jumps_to(target) + self.executes(target))
+
+    def readers(self, reg):
+        return self.reg_readers.get(self.reg_value(reg), [])
+
+    def writers(self, reg):
+        return self.reg_writers.get(self.reg_value(reg), [])
+
+    def iv_reads(self, bank):
+        return self.iv_readers.get(bank, [])
+
+    def iv_writes(self, bank):
+        return self.iv_writers.get(bank, [])
+
+    def port_selects(self, bank, port):
+        return self.port_selectors.get((bank, port), [])
+
+    def device(self, name):
+        return self.device_users.get(name, [])
+
+    def select(self, kind, value):
+        return self.select_users.get((kind, value), [])
+
+    # Returns a dictionary of address to listing annotation, for each
+    # address that is referred to by a jump or XEC, listing the
+    # referring addresses.  At most limit addresses are listed.
+    def annotations(self, limit = 8):
+        result = { }
+        for target in set(self.jump_sources) | set(self.xec_sources):
+            sources = self.references(target)
+            text = ' ; refs ' + ' '.join('%04x' % a for a in sources[:limit])
+            if len(sources) > limit:
+                text += ' +%d' % (len(sources) - limit)
+            result[target] = text
+        return result
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from s8x30x import S8X30x, CpuType
+    from disassembler import load_memory, fast_io_decoders
+
+    parser = argparse.ArgumentParser(description = 'Cross-reference queries on Signetics 8X300/8X305 firmware')
+    parser.add_argument('--hex', action='store_const', dest='inputformat',
+                        const='hex', default='binary',
+                        help = 'input file format is Intel hex')
+    parser.add_argument('-5', '--8x305', action='store_const', dest='cpu_type',
+                        const=CpuType.s8x305, default=CpuType.s8x300,
+                        help = '8X305 processor')
+    parser.add_argument('--fastio', choices = sorted(fast_io_decoders),
+                        help = 'fast I/O select decoder')
+    parser.add_argument('-q', '--query', action='append', default = [],
+                        help = 'address (callers), register, liv/riv, or fast I/O device name (may be repeated)')
+    parser.add_argument('input', nargs = '+',
+                        help = 'input files, most significant byte first')
+    args = parser.parse_args()
+
+    s8x30x = S8X30x(cpu_type = args.cpu_type, decode_table = True)
+    fw = load_memory(args.input, args.inputformat)
+    fast_io_decoder = None
+    if args.fastio:
+        fast_io_decoder = fast_io_decoders[args.fastio]()
+    index = XrefIndex(s8x30x, s8x30x.decode_words(fw.words), fw,
+                      fast_io_decoder = fast_io_decoder)
+
+    def show(what, addresses):
+        print('%-20s %s' % (what, ' '.join('%04x' % a for a in addresses)))
+
+    for q in args.query:
+        if q in ('liv', 'riv'):
+            show(q + ' read', index.iv_reads(q[0]))
+            show(q + ' write', index.iv_writes(q[0]))
+        elif q.lower() in Reg.__members__:
+            show(q + ' read', index.readers(q))
+            show(q + ' write', index.writers(q))
+        elif q in index.device_users:
+            show(q, index.device(q))
+        else:
+            try:
+                show(q + ' refs', index.references(int(q, 16)))
+            except ValueError:
+                print('%s: unknown query' % q, file = sys.stderr)